@@ -2,86 +2,297 @@ import sys
 sys.path.append(".")
 import os
 from flask import Flask, request, jsonify
+from werkzeug.exceptions import HTTPException
 from src.chatbot import ChatBot
-from src.db import VectorDB
+from src.db import VectorDB, PERSIST_DIRECTORY
+from src.jobs import IngestionJobManager
+from src.models import registry, EMBEDDING_MODEL_NAME, RERANKER_MODEL_NAME
+from src.context import DEFAULT_TOKEN_MODEL
+from src.startup import Startup, warm_up
+from src.artifacts import activate_bundle
+from src.synonyms import load_wordnet, english_stopwords
+from src.sessions import SessionStore
+from src.filters import build_where
+from src.pipeline import StageError
+from src.uploads import (
+    UploadError, UploadSessions, extract_documents, is_archive, is_document, safe_filename, copy_stream,
+    MAX_UPLOAD_BYTES, UPLOADS_DIR
+)
 import glob
+import shutil
+import uuid
 
 
 DOCUMENTS_DIR = "data"  # Folder where the PDFs are stored
 DOCUMENT_EXTENSIONS = ["*.pdf"]  # Supported document extensions
 
-def create_app():
+
+def valid_session_id(session_id) -> bool:
+    return isinstance(session_id, str) and 0 < len(session_id) <= 128
+
+
+def initialize_components(app, startup: Startup):
+    """
+    Builds the components of the app, timing every step in `startup`:
+
+    1. The models (sentence-transformer, CrossEncoder, tokenizer) and the NLTK data are loaded in parallel threads.
+    2. The ChatBot and the VectorDB are built in parallel, from the models already in the registry.
+    3. The documents of the "data" folder are queued for ingestion if the vector store is empty.
+    4. Every model runs a dummy inference (warm-up).
+
+    If the `ARTIFACTS_DIR` environment variable points to an artifact bundle, it is verified and activated first: every
+    model and corpus is loaded from it, without network access (see `src/artifacts.py`).
+    """
+    bundle_dir = os.getenv("ARTIFACTS_DIR")
+    if bundle_dir:
+        verify = os.getenv("ARTIFACTS_VERIFY", "true").lower() == "true"
+        startup.step("artifacts.verify", lambda: activate_bundle(bundle_dir, verify=verify))
+
+    models = {
+        "load.embedding_model": ("sentence_transformer", EMBEDDING_MODEL_NAME),
+        "load.cross_encoder": ("cross_encoder", RERANKER_MODEL_NAME),
+        "load.tokenizer": ("tokenizer", DEFAULT_TOKEN_MODEL),
+    }
+    steps = {step: (lambda kind=kind, name=name: registry.acquire(kind, name)) for step, (kind, name) in models.items()}
+    steps["load.nltk"] = lambda: (load_wordnet(), english_stopwords())
+    # A model that fails here is loaded (and fails) again by its component, so these steps aren't required.
+    startup.parallel(steps, required=False)
+
+    # Both share the folder of the vector store, where the ChatBot keeps its translation cache.
+    components = startup.parallel({
+        "init.chatbot": lambda: ChatBot(PERSIST_DIRECTORY),
+        "init.vector_db": lambda: VectorDB(PERSIST_DIRECTORY),
+    })
+    app.chatbot, app.vector_db = components["init.chatbot"], components["init.vector_db"]
+    # The components hold their own references to the models now.
+    for step, (kind, name) in models.items():
+        if step not in startup.errors:
+            registry.release(kind, name)
+
+    # Uploads are ingested in the background by a small pool of low-priority workers.
+    app.jobs = IngestionJobManager(app.vector_db)
+    collection_size = app.vector_db.count()
+    if collection_size == 0:  # Only load if the collection is empty
+        documents = sorted(glob.glob(os.path.join(DOCUMENTS_DIR, "*.pdf")))
+        print(f"Queueing the ingestion of the initial documents: {documents}")
+        for document in documents:
+            app.jobs.submit(document, cleanup=False)
+    else:
+        print(f"Using existing {app.vector_db.backend.name} collection with {collection_size} chunks")
+
+    warm_up(startup, app.chatbot, app.vector_db)
+
+
+def create_app(background: bool = None):
     """
     Factory function that creates and configures the Flask app.
     
-    - Initializes ChatBot and VectorDB instances.
-    - Loads documents into the vector store (if not already loaded).
+    - Starts the ChatBot and VectorDB instances in a background thread (see `initialize_components`), so the app
+      answers its liveness probe (GET /health) right away and GET /ready once everything is loaded and warmed up.
+    - Queues the ingestion of the documents of the "data" folder (if the vector store is empty).
     - Defines the available API routes for document upload, inference, listing, deletion, etc.
+
+    Parameters:
+        background (bool): Whether the components are started in the background. Defaults to the
+            `STARTUP_BACKGROUND` environment variable or True; if False, this function returns once they are ready.
     
     Returns:
         Flask app instance
     """
     app = Flask(__name__)
+    # Larger requests are rejected (413) before they are read. Multipart files are spooled to disk by Werkzeug.
+    app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
     
-    # Initialize chatbot and vector_db
-    app.chatbot = ChatBot()
-    app.vector_db = VectorDB()
-    
-    # Check if documents are already loaded
-    collection_size = len(app.vector_db.vector_store.get()["ids"])
-    
-    if collection_size == 0:  # Only load if the collection is empty
-        documents = glob.glob("data/*.pdf")
-        print(f"Loading initial documents: {documents}")
-        app.vector_db.upload_documents(documents)
-        # Set initial context for chatbot
-        app.chatbot.retrieve_context_from_db("general context", app.vector_db)
-        print("Initial documents loaded successfully")
-    else:
-        print(f"Using existing collection with {collection_size} documents")
-        app.chatbot.retrieve_context_from_db("general context", app.vector_db)
-        
-    # Unset the context to leave the chatbot "clean"
-    app.chatbot.remove_context()
+    # Components set by the startup thread.
+    app.chatbot = None
+    app.vector_db = None
+    app.jobs = None
+    app.uploads = UploadSessions()
+    # Conversation state of every session (the ChatBot and the models are shared by all of them).
+    app.sessions = SessionStore()
+    app.startup = Startup()
+    if background is None:
+        background = os.getenv("STARTUP_BACKGROUND", "true").lower() == "true"
+    app.startup.run(lambda startup: initialize_components(app, startup), background=background)
+
+    @app.before_request
+    def require_ready():
+        # Only the probes answer while the components are starting.
+        if request.endpoint in ("health", "ready") or app.startup.ready:
+            return None
+        return jsonify({"error": f"The service is {app.startup.status}", **app.startup.to_dict()}), 503
+
+    @app.route("/health", methods=["GET"])
+    def health():
+        """
+        Route: GET /health
+        Liveness probe: the process is up (even if the models are still loading).
+        """
+        return jsonify({"status": "alive"}), 200
+
+    @app.route("/ready", methods=["GET"])
+    def ready():
+        """
+        Route: GET /ready
+        Readiness probe: 200 once the models are loaded and warmed up, 503 while starting (or if the startup failed).
+        Returns the startup status with the time taken by every component.
+        """
+        return jsonify(app.startup.to_dict()), 200 if app.startup.ready else 503
 
     # These are flask routes, they can be used later in our streamlit app to allow us to directly use this from the frontend. right now, we are not using this
     # All backend logic is done in src inside wither chatbot or vector db. These are routes and we are only pointing the streamlit app to /infer on port 5002 
     
+    def queue_ingestion(path, filename, tags):
+        """
+        Queues the ingestion of an uploaded file `filename` (saved at `path`): a PDF is moved to the "temp" folder and
+        ingested by a background job; the PDFs of an archive are extracted (one at a time) and get one job each.
+        Returns the queued jobs and the errors / skipped files as lists of dicts.
+        """
+        jobs, errors = [], []
+        if is_archive(filename):
+            extract_dir = os.path.join(UPLOADS_DIR, uuid.uuid4().hex)
+            os.makedirs(extract_dir)
+            try:
+                documents, skipped = extract_documents(path, extract_dir)
+                errors.extend({"filename": name, "error": "Not a PDF document or duplicated name"} for name in skipped)
+                for document in documents:
+                    jobs_, errors_ = queue_ingestion(document, os.path.basename(document), tags)
+                    jobs.extend(jobs_)
+                    errors.extend(errors_)
+            finally:
+                shutil.rmtree(extract_dir, ignore_errors=True)
+                os.remove(path)
+            return jobs, errors
+
+        # Documents are stored with their path in the "temp" folder, so a new upload of a file replaces its
+        # previous version.
+        temp_path = os.path.join("temp", filename)
+        if app.jobs.busy(temp_path):
+            os.remove(path)
+            return [], [{"filename": filename, "error": "It is already being ingested"}]
+        if os.path.abspath(path) != os.path.abspath(temp_path):
+            shutil.move(path, temp_path)
+        try:
+            job = app.jobs.submit(temp_path, tags=tags)
+        except (RuntimeError, ValueError) as e:
+            os.remove(temp_path)
+            return [], [{"filename": filename, "error": str(e)}]
+        return [{"filename": filename, "job_id": job.id, "status_url": f"/jobs/{job.id}"}], []
+
+    def ingestion_response(jobs, errors):
+        if not jobs:
+            return jsonify({"error": "No document could be queued", "errors": errors}), 400
+        return jsonify({
+            "message": f"{len(jobs)} document(s) uploaded, they are being processed",
+            "jobs": jobs,
+            "errors": errors
+        }), 202
+
+    def parse_tags(value):
+        return [tag.strip() for tag in (value or "").split(",") if tag.strip()] or None
+
+    @app.errorhandler(UploadError)
+    def upload_error(e):
+        return jsonify({"error": str(e)}), e.status
+
+    @app.errorhandler(413)
+    def request_too_large(e):
+        return jsonify({"error": f"The upload exceeds the limit of {MAX_UPLOAD_BYTES} bytes"}), 413
+
     @app.route("/upload", methods=["POST"])
     def upload_document():
         """
         Route: POST /upload
-        Allows the user to upload a PDF document which is processed and added to the vector store.
+        Allows the user to upload one or more PDF documents and/or zip/tar archives of PDFs (several "file" fields),
+        which are processed and added to the vector store by background ingestion jobs. Returns the ids of the jobs
+        right away (202); their progress is polled with GET /jobs/<id>. For large transfers, use the resumable
+        chunked uploads (/uploads).
+        Form fields:
+            tags (str): Optional comma-separated tags of the documents, usable later as retrieval filters.
         """
         try:
-            if "file" not in request.files:
+            files = [file for file in request.files.getlist("file") if file.filename]
+            if not files:
                 return jsonify({"error": "No file provided"}), 400
             
-            file = request.files["file"]
-            if file.filename == "":
-                return jsonify({"error": "No file selected"}), 400
-            
-            if not file.filename.endswith(".pdf"):
-                return jsonify({"error": "Only PDF files are supported"}), 400
-            
-            # Save the file temporarily
-            temp_path = os.path.join("temp", file.filename)
-            os.makedirs("temp", exist_ok=True)
-            file.save(temp_path)
-            
-            print(f"DEBUG - Processing document: {file.filename}")
-            # Upload to vector database
-            app.vector_db.upload_document(temp_path)
-            print(f"DEBUG - Document processed successfully: {file.filename}")
-            
-            # Clean up
-            os.remove(temp_path)
+            for file in files:
+                if not (is_document(file.filename) or is_archive(file.filename)):
+                    return jsonify({"error": "Only PDF files and zip/tar archives of PDFs are supported"}), 400
             
-            return jsonify({"message": "Document uploaded and processed successfully"})
+            # Save the files temporarily. Uploads are copied to disk in small blocks (PDFs need random access to be
+            # parsed), and then the pages of every PDF are streamed into the splitter and embedded in batches by its
+            # job, which removes the file when it ends.
+            tags = parse_tags(request.form.get("tags"))
+            os.makedirs(UPLOADS_DIR, exist_ok=True)
+            jobs, errors = [], []
+            for file in files:
+                path = os.path.join(UPLOADS_DIR, f"{uuid.uuid4().hex}-{safe_filename(file.filename)}")
+                with open(path, "wb") as output:
+                    copy_stream(file.stream, output)
+                jobs_, errors_ = queue_ingestion(path, safe_filename(file.filename), tags)
+                jobs.extend(jobs_)
+                errors.extend(errors_)
+            return ingestion_response(jobs, errors)
             
+        except (UploadError, HTTPException):
+            raise
         except Exception as e:
             print(f"Error in upload endpoint: {str(e)}")
             return jsonify({"error": str(e)}), 500
+
+    @app.route("/uploads", methods=["POST"])
+    def create_upload():
+        """
+        Route: POST /uploads
+        Starts a resumable chunked upload. JSON body: {"filename": str, "size": int (bytes), "tags": str (optional,
+        comma-separated)}. Returns its "upload_id" and the bytes "received" so far (0).
+        """
+        data = request.get_json(silent=True) or {}
+        if not data.get("filename") or data.get("size") is None:
+            return jsonify({"error": "filename and size are required"}), 400
+        return jsonify(app.uploads.create(data["filename"], int(data["size"]), tags=data.get("tags"))), 201
+
+    @app.route("/uploads/<upload_id>", methods=["GET", "PUT", "PATCH"])
+    def upload_chunk(upload_id):
+        """
+        Route: GET /uploads/<upload_id>
+        Returns the bytes "received" so far, where an interrupted upload has to resume.
+        Route: PUT or PATCH /uploads/<upload_id>
+        Appends the raw request body (streamed to disk) to the upload. The optional "Content-Range" header
+        (bytes <first>-<last>/<total>) must start at the bytes received so far.
+        """
+        if request.method == "GET":
+            return jsonify(app.uploads.status(upload_id))
+        return jsonify(app.uploads.write(upload_id, request.stream, request.headers.get("Content-Range")))
+
+    @app.route("/uploads/<upload_id>/complete", methods=["POST"])
+    def complete_upload(upload_id):
+        """
+        Route: POST /uploads/<upload_id>/complete
+        Ends a fully received chunked upload and queues the ingestion of its documents, like POST /upload.
+        """
+        upload = app.uploads.complete(upload_id, UPLOADS_DIR)
+        return ingestion_response(*queue_ingestion(upload["path"], upload["filename"], parse_tags(upload["tags"])))
+
+    @app.route("/jobs/<job_id>", methods=["GET"])
+    def job_status(job_id):
+        """
+        Route: GET /jobs/<job_id>
+        Returns the status of an ingestion job (queued, running, done or failed) and its progress: pages parsed,
+        total pages, chunks embedded and estimated seconds left.
+        """
+        job = app.jobs.get(job_id)
+        if job is None:
+            return jsonify({"error": f"Job {job_id} not found"}), 404
+        return jsonify(job.to_dict())
+
+    @app.route("/jobs", methods=["GET"])
+    def list_jobs():
+        """
+        Route: GET /jobs
+        Returns the status of the recent ingestion jobs, oldest first.
+        """
+        return jsonify({"jobs": [job.to_dict() for job in app.jobs.list()]})
             
 
     @app.route("/infer", methods=["POST"])
@@ -90,35 +301,54 @@ def create_app():
         Route: POST /infer
         Takes a list of chat messages (from frontend), reconstructs conversation,
         retrieves context, and returns the chatbot's response.
+        The conversation state (memory, context and sources) is kept per "session_id" (a new session is created if
+        the payload has none, and its id is returned), so concurrent users don't share it.
+        An optional "filters" entry of the payload restricts the retrieved chunks by source, page, language and/or
+        tags (see `src/filters.py`); a turn whose filters differ from the ones of the current context retrieves it
+        again.
         """
         try:
             payload = request.get_json()
-            messages = payload["messages"]
-            latest_message = messages[-1]["content"]
+            session_id = payload.get("session_id")
+            if session_id is not None and not valid_session_id(session_id):
+                return jsonify({"error": "Invalid session_id"}), 400
+            try:
+                build_where(payload.get("filters"), app.vector_db.catalog)
+            except (ValueError, TypeError) as e:
+                return jsonify({"error": f"Invalid filters: {e}"}), 400
+            # Ingestion jobs pause while a query is being answered. Requests of the same session run one at a time.
+            with app.jobs.interactive(), app.sessions.session(session_id) as conversation:
+                messages = payload["messages"]
+                latest_message = messages[-1]["content"]
+                filters = payload.get("filters")
             
-            # Reset chatbot memory to sync with frontend
-            app.chatbot.memory.reset_memory()
+                # Reset the conversation memory to sync with frontend
+                conversation.memory.reset_memory()
             
-            # Rebuild memory from frontend history (excluding the last message)
-            for msg in messages[:-1]:
-                if msg["role"] in ["user", "assistant"]:
-                    if msg["role"] == "user":
-                        user_msg = msg["content"]
-                    else:
-                        app.chatbot.memory.update_memory(user_msg, msg["content"])
+                # Rebuild memory from frontend history (excluding the last message)
+                for msg in messages[:-1]:
+                    if msg["role"] in ["user", "assistant"]:
+                        if msg["role"] == "user":
+                            user_msg = msg["content"]
+                        else:
+                            conversation.memory.update_memory(user_msg, msg["content"])
                         
-            # Retrieve fresh context for the latest query if it isn't loaded yet.
-            if not app.chatbot.has_context():
-                print(f"DEBUG - Retrieving context for query: {latest_message}")
-                app.chatbot.retrieve_context_from_db_with_reranking(latest_message, app.vector_db)
-            
-            answer, sources = app.chatbot.infer(latest_message)
-            print(f"DEBUG - Sources from chatbot: {sources}")
-            return jsonify({
-                "response": answer,
-                "sources": sources
-            })
+                # Retrieve the context again if the latest query drifted from the one that retrieved it (or if it
+                # isn't loaded yet or it's restricted by a filter), otherwise reuse it topped up with a dense search.
+                app.chatbot.refresh_context(latest_message, app.vector_db, filters=filters, conversation=conversation)
             
+                answer, sources = app.chatbot.infer(latest_message, conversation=conversation)
+                print(f"DEBUG - Sources from chatbot: {sources}")
+                return jsonify({
+                    "response": answer,
+                    "sources": sources,
+                    "session_id": conversation.id
+                })
+
+        except StageError as e:
+            # A required stage of the retrieval (e.g. the metadata filter) failed or timed out.
+            print(f"Retrieval failed in infer endpoint: {str(e)}")
+            return jsonify({"error": f"The context couldn't be retrieved: {e}"}), 503
         except Exception as e:
             print(f"Error in infer endpoint: {str(e)}")
             return jsonify({"error": str(e)}), 500
@@ -127,15 +357,69 @@ def create_app():
     def list_documents():
         """
         Route: GET /list_documents
-        Returns a list of all loaded document filenames in the vector store.
+        Returns a page of the loaded document filenames in the vector store, sorted by name.
+        Query parameters:
+            offset (int): Number of documents to skip. Defaults to 0.
+            limit (int): Max number of documents to return. Defaults to all of them.
+            details (bool): Whether to return the catalog entries (chunks, pages, size, ingest time) instead of names.
         """
         try:
-            documents = app.vector_db.list_documents()
-            return jsonify({"documents": documents})
+            offset = request.args.get("offset", default=0, type=int)
+            limit = request.args.get("limit", default=None, type=int)
+            details = request.args.get("details", default="false").lower() == "true"
+            documents = app.vector_db.list_documents(offset=offset, limit=limit, details=details)
+            return jsonify({
+                "documents": documents,
+                "total": app.vector_db.catalog.count_documents(),
+                "offset": offset,
+                "limit": limit
+            })
         except Exception as e:
             print(f"Error listing documents: {str(e)}")
             return jsonify({"error": str(e)}), 500
 
+    @app.route("/query_cache", methods=["GET"])
+    def query_cache_stats():
+        """
+        Route: GET /query_cache
+        Returns the counters of the semantic query cache (size, hits, misses, hit rate, evictions, invalidations).
+        """
+        return jsonify(app.vector_db.query_cache.stats())
+
+    @app.route("/reranker", methods=["GET"])
+    def reranker_stats():
+        """
+        Route: GET /reranker
+        Returns the counters of the CrossEncoder reranker: calls, pairs, score cache hits/misses and latency (ms).
+        """
+        return jsonify(app.chatbot.reranker.stats())
+
+    @app.route("/translation", methods=["GET"])
+    def translation_stats():
+        """
+        Route: GET /translation
+        Returns the counters of the query translation: English fast path, cache hits/misses, timeouts and errors.
+        """
+        return jsonify(app.chatbot.translator.stats())
+
+    @app.route("/context_refresh", methods=["GET"])
+    def context_refresh_stats():
+        """
+        Route: GET /context_refresh
+        Returns how many turns retrieved their context (first turn, filter or drift above the threshold) and how many
+        reused it, with or without a top-up.
+        """
+        return jsonify(app.chatbot.refresh_stats())
+
+    @app.route("/refresh_llm_model", methods=["POST"])
+    def refresh_llm_model():
+        """
+        Route: POST /refresh_llm_model
+        Tells the API that the model of the LLM service was switched, so the context is counted with its tokenizer.
+        """
+        app.chatbot.refresh_llm_model()
+        return jsonify({"message": "The model of the LLM service will be refreshed."}), 200
+
     @app.route("/delete_document", methods=["DELETE", "POST"])
     def delete_document():
         """
@@ -161,32 +445,54 @@ def create_app():
             print(f"Error in delete_document endpoint: {str(e)}")
             return jsonify({"error": str(e)}), 500
 
+    def request_session():
+        """
+        Conversation of the "session_id" of the JSON body or query string, or None.
+        """
+        session_id = (request.get_json(silent=True) or {}).get("session_id") or request.args.get("session_id")
+        if not valid_session_id(session_id):
+            return None
+        return app.sessions.get(session_id, create=False)
+
     @app.route("/remove_context", methods=["DELETE", "POST"])
     def remove_context():
         """
         Route: DELETE or POST /remove_context
-        Removes the current context loaded into the chatbot.
+        Removes the current context loaded into the conversation of a "session_id".
         """
-        if app.chatbot.has_context():
-            app.chatbot.remove_context()
-            return jsonify({"message": "Context deleted succesfully"}), 200
-        else:
-            return jsonify({"message": "Chatbot has already no context loaded."}), 200
+        conversation = request_session()
+        if conversation is not None:
+            with conversation.lock:
+                if app.chatbot.has_context(conversation):
+                    app.chatbot.remove_context(conversation)
+                    return jsonify({"message": "Context deleted succesfully"}), 200
+        return jsonify({"message": "Chatbot has already no context loaded."}), 200
         
     @app.route("/reset_chatbot", methods=["DELETE", "POST"])
     def reset_chatbot():
         """
         Route: DELETE or POST /reset_chatbot
-        Resets the chatbot's context and memory to default empty state.
+        Resets the context and memory of the conversation of a "session_id" to default empty state.
         """
-        if app.chatbot.has_context():
-            app.chatbot.remove_context()
-        app.chatbot.memory.reset_memory()
+        conversation = request_session()
+        if conversation is not None:
+            with conversation.lock:
+                app.chatbot.remove_context(conversation)
+                conversation.memory.reset_memory()
         return jsonify({"message": "Reset made succesfully."}), 200
 
+    @app.route("/sessions", methods=["GET"])
+    def session_stats():
+        """
+        Route: GET /sessions
+        Returns the counters of the session store (active and spilled conversations, evictions, restores).
+        """
+        return jsonify(app.sessions.stats())
+
     return app
 
 # Create and run the application
 if __name__ == "__main__":
     app = create_app()
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", "5002")), debug=True)
\ No newline at end of file
+    # The reloader would start a second process that loads every model again.
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", "5002")), debug=True, use_reloader=False)
\ No newline at end of file
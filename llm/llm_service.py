@@ -3,10 +3,52 @@ sys.path.append(".")
 import os
 import json
 from flask import Flask, request, jsonify
+
+
+def load_bundle_models(bundle_dir):
+    """
+    Offline mode: returns the generation models of an artifact bundle (see `src/artifacts.py`) as {Hub name: local
+    path} and keeps the Hugging Face libraries from reaching the Hub. The service container only has the `llm`
+    package, so the manifest is read here instead of with `src.artifacts`.
+    """
+    manifest_path = os.path.join(bundle_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        raise RuntimeError(f"{bundle_dir} is not an artifact bundle (no manifest.json).")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    # Set before transformers is imported, which reads them at import time.
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    os.environ["TRANSFORMERS_OFFLINE"] = "1"
+    models = {
+        entry["name"]: os.path.abspath(os.path.join(bundle_dir, entry["path"]))
+        for entry in manifest["models"] if entry["kind"] == "snapshot"
+    }
+    print(f"Offline mode: artifact bundle {manifest['version']} ({bundle_dir}), generation models: {list(models)}")
+    return models
+
+
+# Generation models of the offline artifact bundle {Hub name: local path}, or None if the service runs online.
+BUNDLE_MODELS = load_bundle_models(os.environ["ARTIFACTS_DIR"]) if os.getenv("ARTIFACTS_DIR") else None
+
 from llm.model import CustomLLM
 
 app = Flask(__name__)
 
+
+def model_path(model_name):
+    """
+    Local path of a model in offline mode (None online, where models are loaded from the Hub by name).
+    """
+    if BUNDLE_MODELS is None:
+        return None
+    if model_name not in BUNDLE_MODELS:
+        raise ValueError(
+            f"Model {model_name} is not in the artifact bundle (offline mode). Build the bundle with "
+            f"--generation-model {model_name}."
+        )
+    return BUNDLE_MODELS[model_name]
+
+
 # Model mapping from frontend names to HuggingFace model names
 MODEL_MAPPING = {
     "Gemma 3 1B": "google/gemma-3-1b-it",
@@ -24,7 +66,8 @@ llm = CustomLLM(
     current_model,
     os.getenv("DEVICE", "cuda"),
     torch_dtype=torch_dtype,
-    gen_kwargs=generation_kwargs
+    gen_kwargs=generation_kwargs,
+    model_path=model_path(current_model)
 )
 
 @app.route('/switch_model', methods=['POST'])
@@ -42,6 +85,10 @@ def switch_model():
             
         # Get the HuggingFace model name
         hf_model_name = MODEL_MAPPING[model_name]
+        try:
+            path = model_path(hf_model_name)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         # Only switch if it's a different model
         if hf_model_name != current_model:
@@ -50,8 +97,9 @@ def switch_model():
             llm = CustomLLM(
                 hf_model_name,
                 os.getenv("DEVICE", "cuda"),
-                int(os.getenv("MAX_TOKENS", -1)),
-                float(os.getenv("TEMPERATURE", 0.7))
+                torch_dtype=torch_dtype,
+                gen_kwargs=generation_kwargs,
+                model_path=path
             )
             current_model = hf_model_name
             
@@ -26,18 +26,22 @@ class CustomLLM:
         model_name,
         device,
         torch_dtype,
-        gen_kwargs
+        gen_kwargs,
+        model_path=None
     ) -> None:
         self.model_loaded = False
         print(f"🚀 Starting to load model: {model_name} on {device}")
         self.model_name = model_name
+        # Local folder of the model (e.g. in an offline artifact bundle). The Hub name is kept in `model_name`.
+        self.model_path = model_path or model_name
         self.device = device
 
         # Load tokenizer
         print(f"🔑 Loading tokenizer for {model_name}...")
         self.tokenizer = AutoTokenizer.from_pretrained(
-            self.model_name,
-            token=os.getenv("HUGGINGFACE_TOKEN", None)
+            self.model_path,
+            token=os.getenv("HUGGINGFACE_TOKEN", None),
+            local_files_only=model_path is not None
         )
         print(f"✅ Tokenizer loaded successfully")
 
@@ -55,12 +59,13 @@ class CustomLLM:
             print(f"Not supported dtype: {torch_dtype}. Defaulting to torch.float32.")
             dtype_config = {"torch_dtype": torch.float32}
         self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_name,
+            self.model_path,
             # torch_dtype=torch.float16,
             # quantization_config=BitsAndBytesConfig(load_in_8bit=True),
             **dtype_config,
             device_map={"": 0},
-            token=os.getenv("HUGGINGFACE_TOKEN", None)
+            token=os.getenv("HUGGINGFACE_TOKEN", None),
+            local_files_only=model_path is not None
         )
         print(f"✅ Model loaded successfully and placed on {self.model.device}")
 
@@ -0,0 +1,44 @@
+import sys
+import argparse
+sys.path.append(".")
+from src.artifacts import ArtifactError, build_bundle, default_models, verify_bundle
+from src.translation import MARIAN_MODEL_NAME
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build or verify an offline artifact bundle (models, tokenizers and NLTK corpora)."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Download the artifacts into <output>/<version>.")
+    build.add_argument("--output", default="artifacts", help="Folder of the bundles.")
+    build.add_argument("--version", default=None, help="Version (name) of the bundle (default: a timestamp).")
+    build.add_argument(
+        "--translation-model", nargs="?", const=MARIAN_MODEL_NAME, default=None,
+        help=f"Include a local MarianMT translation model (default: {MARIAN_MODEL_NAME})."
+    )
+    build.add_argument(
+        "--generation-model", default=None,
+        help="Include a snapshot of the generation model of the LLM service (e.g. meta-llama/Llama-3.2-3B-Instruct)."
+    )
+
+    verify = subparsers.add_parser("verify", help="Check the checksums of a bundle.")
+    verify.add_argument("bundle_dir", help="Folder of the bundle (<output>/<version>).")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "build":
+            models = default_models(args.translation_model, args.generation_model)
+            bundle_dir = build_bundle(args.output, models=models, version=args.version)
+            print(f"Start the app offline with ARTIFACTS_DIR={bundle_dir}")
+        else:
+            manifest = verify_bundle(args.bundle_dir)
+            print(f"Bundle {manifest['version']} OK ({len(manifest['files'])} files verified)")
+    except ArtifactError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,43 @@
 import sys
-import os
+import argparse
 sys.path.append(".")
 from src.db import VectorDB
+from src.backends import DEFAULT_BACKEND
 
 def main():
+    parser = argparse.ArgumentParser(description="Print the documents stored in the vector database.")
+    parser.add_argument("--db", default="db", help="Folder of the vector database.")
+    parser.add_argument("--backend", default=DEFAULT_BACKEND, choices=["chroma", "numpy"], help="Vector backend.")
+    args = parser.parse_args()
+
     # Initialize the vector database
-    db = VectorDB()
+    db = VectorDB(args.db, backend=args.backend)
     
     # Get all documents
     print("\nFetching documents from the database...\n")
     
-    # Get all vectors and their metadata
-    results = db.vector_store.get()
+    # Get the documents from the catalog (the chunks themselves aren't loaded)
+    documents = db.list_documents(details=True)
     
     # Print document information
-    if not results['ids']:
+    if not documents:
         print("No documents found in the database.")
         return
         
-    print(f"Total number of chunks: {len(results['ids'])}")
+    print(f"Backend: {db.backend.name}")
+    print(f"Total number of chunks: {db.count()}")
+    print(f"Total number of documents: {len(documents)}")
     print("\nDocuments in database:")
     print("-" * 50)
     
-    # Group chunks by source document
-    documents = {}
-    for i, source in enumerate(results['metadatas']):
-        doc_source = source.get('source', 'Unknown')
-        if doc_source not in documents:
-            documents[doc_source] = {
-                'chunks': 0,
-                'pages': set()
-            }
-        documents[doc_source]['chunks'] += 1
-        documents[doc_source]['pages'].add(source.get('page', 0))
-    
     # Print document information
-    for doc_source, info in documents.items():
-        print(f"Document: {os.path.basename(doc_source)}")
-        print(f"  - Number of chunks: {info['chunks']}")
-        print(f"  - Pages: {sorted(info['pages'])}")
+    for info in documents:
+        print(f"Document: {info['filename']}")
+        print(f"  - Number of chunks: {info['chunk_count']}")
+        print(f"  - Pages: {info['pages'] if info['pages'] is not None else 'Unknown'}")
+        if info['size_bytes'] is not None:
+            print(f"  - Size: {info['size_bytes'] / 1024:.1f} KB")
         print("-" * 50)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
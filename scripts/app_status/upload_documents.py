@@ -1,6 +1,27 @@
 import sys
+import argparse
 sys.path.append(".")
 from src.db import VectorDB
 
-db = VectorDB()
-db.upload_documents("/home/carlangas/Documents/Master/NLP/Documents/data/raw_pdfs")
\ No newline at end of file
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload every PDF of a folder to the vector database.")
+    parser.add_argument("documents_dir", nargs="?", default="data", help="Folder with the PDF documents.")
+    parser.add_argument("--workers", type=int, default=None, help="Processes that parse the PDFs (default: all CPUs).")
+    parser.add_argument("--batch-size", type=int, default=256, help="Number of chunks embedded and written together.")
+    parser.add_argument("--multi-process", action="store_true", help="Use multi-process sentence-transformers encoding.")
+    args = parser.parse_args()
+
+    db = VectorDB()
+    stats = db.upload_documents(
+        args.documents_dir,
+        workers=args.workers,
+        embed_batch_size=args.batch_size,
+        multi_process_encoding=args.multi_process
+    )
+    if stats.failures:
+        sys.exit(1)
+
+# The guard is required: the parsing stage runs in spawned processes, which import this module again.
+if __name__ == "__main__":
+    main()
@@ -5,12 +5,11 @@ sys.path.append(".")
 import time
 from src.chatbot import ChatBot
 from src.db import VectorDB
+from src.models import registry
 import matplotlib.pyplot as plt
 import seaborn as sns
 import evaluate # from https://huggingface.co/spaces/evaluate-metric/bertscore
 
-from transformers import AutoTokenizer
-
 # Metric computation functions
 
 def compute_bert_score(generated, reference, bertscore_metric):
@@ -35,14 +34,13 @@ def compute_mrr(gt_doc_id, retrieved_doc_ids):
 # Load the ground truth (GT) that contains queries, GT answers and GT document name.
 df = pd.read_csv("scripts/evaluation/Ground_Truth.csv", encoding = "utf-8", delimiter=";")   
 
+# ChatBot and VectorDB share the sentence-transformer through the model registry.
 chatbot = ChatBot()
 vector_db = VectorDB()
-bertscore_metric = evaluate.load("bertscore")
+bertscore_metric = registry.acquire("metric", "bertscore", loader=evaluate.load)
 
-tokenizer = AutoTokenizer.from_pretrained(
-    "Qwen/Qwen2.5-0.5B-Instruct",
-    token=os.getenv("HUGGINGFACE_TOKEN", None)
-)
+tokenizer = registry.tokenizer("Qwen/Qwen2.5-0.5B-Instruct")
+registry.print_memory_report()
 
 output_path = "scripts/evaluation/qwen/"
 just_time_measurement = False
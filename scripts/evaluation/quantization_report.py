@@ -0,0 +1,115 @@
+"""
+Compares the compact (quantized and dimension-reduced) indexes of `src/quantization.py` with the float32 Chroma store
+on the Ground_Truth queries: memory of the first-pass index, size on disk, search latency and recall@k, both against
+the top-k chunks of the float32 store and against the ground truth document.
+
+    python scripts/evaluation/quantization_report.py --configs int8 binary int8:256:pca binary:384:pca --k 5
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+sys.path.append(".")
+import numpy as np
+import pandas as pd
+from src.db import VectorDB
+from src.quantization import QuantizedIndex, parse_spec
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index size and recall@k of quantized indexes vs the float32 store.")
+    parser.add_argument("--db", default="db", help="Folder of the vector database.")
+    parser.add_argument("--ground-truth", default="scripts/evaluation/Ground_Truth.csv")
+    parser.add_argument("--configs", nargs="+", default=["int8", "binary", "int8:256:pca", "binary:384:pca"],
+                        help="Quantization specs: method[:dims[:reduction]].")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument("--output", default="scripts/evaluation/quantization_report.csv")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.ground_truth, encoding="utf-8", delimiter=";")
+    vector_db = VectorDB(args.db, quantization="")
+    backend = vector_db.backend
+    queries = df["query"].tolist()
+    query_embeddings = vector_db.embeddings.embed_queries(queries)
+
+    # Baseline: the float32 store (HNSW over 768-d float32 vectors with the Chroma backend).
+    start = time.perf_counter()
+    baseline = backend.search(query_embeddings, args.k)
+    baseline_latency = (time.perf_counter() - start) / len(queries)
+    sources = {}
+    for ids, metadatas in zip(baseline["ids"], baseline["metadatas"]):
+        sources.update({chunk_id: metadata.get("source", "") for chunk_id, metadata in zip(ids, metadatas)})
+
+    def doc_recall(retrieved_ids):
+        # Like `evaluation_metrics.py`: the ground truth document is among the sources of the top-k chunks.
+        hits = 0
+        for gt_doc_id, ids in zip(df["ground_truth_doc_id"], retrieved_ids):
+            doc_ids = [os.path.basename(sources.get(chunk_id, "")).split(".")[0] for chunk_id in ids]
+            hits += int(gt_doc_id in doc_ids)
+        return hits / len(df)
+
+    n_chunks = backend.count()
+    rows = [{
+        "config": f"float32 ({backend.name})",
+        "memory_mb": round(n_chunks * len(query_embeddings[0]) * 4 / 1024 ** 2, 2),
+        "disk_mb": round(directory_size(args.db) / 1024 ** 2, 2),
+        "latency_ms": round(baseline_latency * 1000, 2),
+        f"recall@{args.k} vs float32": 1.0,
+        f"doc recall@{args.k}": doc_recall(baseline["ids"]),
+    }]
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for spec in args.configs:
+            for rescore in (False, True):
+                index = QuantizedIndex(
+                    os.path.join(tmp_dir, spec.replace(":", "_")),
+                    rescore_factor=args.rescore_factor,
+                    **parse_spec(spec)
+                )
+                if not len(index):
+                    offset = 0
+                    while True:
+                        batch = backend.get(include=["embeddings", "metadatas"], limit=5000, offset=offset)
+                        if not len(batch["ids"]):
+                            break
+                        index.add(batch["ids"], batch["embeddings"])
+                        sources.update({i: m.get("source", "") for i, m in zip(batch["ids"], batch["metadatas"])})
+                        offset += len(batch["ids"])
+                start = time.perf_counter()
+                results = index.search(query_embeddings, k=args.k, rescore=rescore)
+                latency = (time.perf_counter() - start) / len(queries)
+                retrieved_ids = [[chunk_id for chunk_id, _ in hits] for hits in results]
+                overlap = np.mean([
+                    len(set(ids) & set(base_ids)) / max(len(base_ids), 1)
+                    for ids, base_ids in zip(retrieved_ids, baseline["ids"])
+                ])
+                rows.append({
+                    "config": f"{spec} ({'rescored x' + str(args.rescore_factor) if rescore else 'codes only'})",
+                    "memory_mb": round(index.memory_bytes() / 1024 ** 2, 2),
+                    "disk_mb": round(index.disk_bytes() / 1024 ** 2, 2),
+                    "latency_ms": round(latency * 1000, 2),
+                    f"recall@{args.k} vs float32": round(float(overlap), 4),
+                    f"doc recall@{args.k}": doc_recall(retrieved_ids),
+                })
+    finally:
+        shutil.rmtree(tmp_dir)
+        vector_db.close()
+
+    report = pd.DataFrame(rows)
+    print(f"{n_chunks} chunks, {len(queries)} queries")
+    print(report.to_string(index=False))
+    report.to_csv(args.output, index=False, sep=";")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Sweeps the HNSW parameters (M, ef_construction, ef_search) of the Chroma collection against an exact search baseline
+and picks the cheapest setting (lowest search latency) that reaches a target recall@k.
+
+Every (M, ef_construction) pair builds a temporary collection with the embeddings of the vector database; every
+ef_search is then evaluated on the Ground_Truth queries plus a sample of stored chunks used as queries.
+
+    python scripts/evaluation/tune_hnsw.py --k 5 --target-recall 0.95 --m 8 16 32 --ef-search 10 20 40 80 160
+
+The chosen setting is applied with the `HNSW_M`, `HNSW_EF_CONSTRUCTION` and `HNSW_EF_SEARCH` environment variables
+(M and ef_construction only take effect when the collection is created, e.g. after re-ingesting into a new `db/`).
+"""
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+sys.path.append(".")
+import numpy as np
+import pandas as pd
+from src.db import VectorDB
+from src.backends import ChromaBackend
+
+
+def exact_top_k(vectors, queries, k):
+    """
+    Rows of the k nearest vectors (squared L2) of every query.
+    """
+    distances = (vectors ** 2).sum(axis=1) - 2 * queries @ vectors.T
+    top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    return [set(rows.tolist()) for rows in top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick the cheapest HNSW setting that reaches a target recall@k.")
+    parser.add_argument("--db", default="db", help="Folder of the vector database.")
+    parser.add_argument("--ground-truth", default="scripts/evaluation/Ground_Truth.csv")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--ef-construction", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 20, 40, 80, 160])
+    parser.add_argument("--sample-queries", type=int, default=200, help="Stored chunks also used as queries.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs of every search (the best one is kept).")
+    parser.add_argument("--output", default="scripts/evaluation/hnsw_tuning.csv")
+    args = parser.parse_args()
+
+    vector_db = VectorDB(args.db, quantization="")
+    ids, vectors = [], []
+    offset = 0
+    while True:
+        batch = vector_db.backend.get(include=["embeddings"], limit=5000, offset=offset)
+        if not len(batch["ids"]):
+            break
+        ids.extend(batch["ids"])
+        vectors.extend(batch["embeddings"])
+        offset += len(batch["ids"])
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors) < args.k:
+        print(f"The vector database has {len(vectors)} chunks, fewer than k={args.k}.")
+        return
+
+    df = pd.read_csv(args.ground_truth, encoding="utf-8", delimiter=";")
+    queries = np.asarray(vector_db.embeddings.embed_queries(df["query"].tolist()), dtype=np.float32)
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(vectors), min(args.sample_queries, len(vectors)), replace=False)
+    queries = np.vstack([queries, vectors[sample]])
+    vector_db.close()
+
+    exact = exact_top_k(vectors, queries, args.k)
+    row_of = {chunk_id: row for row, chunk_id in enumerate(ids)}
+    print(f"{len(vectors)} chunks, {len(queries)} queries, target recall@{args.k} = {args.target_recall}")
+
+    rows = []
+    for m in args.m:
+        for ef_construction in args.ef_construction:
+            tmp_dir = tempfile.mkdtemp()
+            try:
+                backend = ChromaBackend(
+                    tmp_dir, None, collection_name="hnsw_tuning", hnsw={"M": m, "ef_construction": ef_construction}
+                )
+                start = time.perf_counter()
+                backend.add(ids, vectors.tolist(), [""] * len(ids), [{"row": row} for row in range(len(ids))])
+                build_time = time.perf_counter() - start
+                for ef_search in args.ef_search:
+                    latency = float("inf")
+                    for _ in range(args.repeats):
+                        start = time.perf_counter()
+                        results = backend.search(queries.tolist(), args.k, ef_search=ef_search)
+                        latency = min(latency, (time.perf_counter() - start) / len(queries))
+                    recall = np.mean([
+                        len({row_of[chunk_id] for chunk_id in found} & expected) / args.k
+                        for found, expected in zip(results["ids"], exact)
+                    ])
+                    rows.append({
+                        "M": m,
+                        "ef_construction": ef_construction,
+                        "ef_search": ef_search,
+                        f"recall@{args.k}": round(float(recall), 4),
+                        "latency_ms": round(latency * 1000, 3),
+                        "build_s": round(build_time, 2),
+                    })
+                    print(rows[-1])
+            finally:
+                shutil.rmtree(tmp_dir)
+
+    report = pd.DataFrame(rows)
+    report.to_csv(args.output, index=False, sep=";")
+    candidates = report[report[f"recall@{args.k}"] >= args.target_recall]
+    if candidates.empty:
+        best = report.sort_values(f"recall@{args.k}", ascending=False).iloc[0]
+        print(f"\nNo setting reaches recall@{args.k} >= {args.target_recall}. The best recall is "
+              f"{best[f'recall@{args.k}']} (M={best['M']}, ef_construction={best['ef_construction']}, "
+              f"ef_search={best['ef_search']}): try larger values.")
+        return
+    best = candidates.sort_values(["latency_ms", "M", "ef_construction", "ef_search"]).iloc[0]
+    print(f"\nCheapest setting with recall@{args.k} >= {args.target_recall}: recall {best[f'recall@{args.k}']}, "
+          f"{best['latency_ms']} ms per query")
+    print(f"  HNSW_M={best['M']} HNSW_EF_CONSTRUCTION={best['ef_construction']} HNSW_EF_SEARCH={best['ef_search']}")
+
+
+if __name__ == "__main__":
+    main()
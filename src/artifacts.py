@@ -0,0 +1,192 @@
+"""
+Offline artifact bundles: every model and corpus the backend downloads on first use, fetched ahead of time into a
+versioned local directory, so the app can start without any network access.
+
+    artifacts/<version>/
+        manifest.json                           version, models and sha256 of every file
+        models/<kind>/<name>/                   sentence-transformers, CrossEncoder, tokenizers... (safetensors)
+        nltk_data/corpora/{wordnet,stopwords}
+
+`build_bundle` creates a bundle (see `scripts/app_status/bundle.py`). `activate_bundle` verifies the checksums of a
+bundle and switches the process to offline mode: the model registry loads the models from the bundle (and refuses to
+load any other), the Hugging Face libraries don't reach the Hub and NLTK reads its corpora from the bundle without
+downloading. The app activates the bundle of the `ARTIFACTS_DIR` environment variable at startup.
+"""
+import os
+import json
+import time
+import hashlib
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from src import synonyms
+from src.models import registry, EMBEDDING_MODEL_NAME, RERANKER_MODEL_NAME
+from src.context import DEFAULT_TOKEN_MODEL
+
+MANIFEST = "manifest.json"
+NLTK_RESOURCES = ("wordnet", "stopwords")
+# Files of the Hub snapshots that are kept (the weights only in safetensors).
+SNAPSHOT_PATTERNS = ["*.json", "*.safetensors", "*.model", "*.txt", "tokenizer*"]
+
+
+class ArtifactError(Exception):
+    """
+    Invalid or corrupted artifact bundle.
+    """
+
+
+def _model_dir(kind: str, name: str) -> str:
+    return os.path.join("models", kind, name.replace("/", "--"))
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _checksums(bundle_dir: str, files: list[str], workers: int = 8) -> dict:
+    # hashlib releases the GIL on large buffers, so files are hashed in parallel threads.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        digests = executor.map(lambda file: _sha256(os.path.join(bundle_dir, file)), files)
+        return dict(zip(files, digests))
+
+
+def _save_model(kind: str, name: str, path: str):
+    """
+    Downloads a model and saves it to `path` (weights converted to safetensors).
+    """
+    if kind in ("sentence_transformer", "cross_encoder"):
+        from sentence_transformers import CrossEncoder, SentenceTransformer
+        model = (SentenceTransformer if kind == "sentence_transformer" else CrossEncoder)(name, device="cpu")
+        model.save(path, safe_serialization=True)
+    elif kind == "tokenizer":
+        from transformers import AutoTokenizer
+        AutoTokenizer.from_pretrained(name, token=os.getenv("HUGGINGFACE_TOKEN", None)).save_pretrained(path)
+    elif kind == "translation":
+        from transformers import MarianMTModel, MarianTokenizer
+        MarianTokenizer.from_pretrained(name).save_pretrained(path)
+        MarianMTModel.from_pretrained(name).save_pretrained(path, safe_serialization=True)
+    elif kind == "snapshot":
+        # Any other repository of the Hub (e.g. the generation model of the LLM service), as it is published.
+        from huggingface_hub import snapshot_download
+        snapshot_download(
+            name, local_dir=path, allow_patterns=SNAPSHOT_PATTERNS, token=os.getenv("HUGGINGFACE_TOKEN", None)
+        )
+    else:
+        raise ValueError(f"Unknown kind of model '{kind}'.")
+
+
+def default_models(translation_model: str = None, generation_model: str = None) -> list[tuple[str, str]]:
+    """
+    (kind, name) of the models used by the backend, plus the optional local translation and generation models.
+    """
+    models = [
+        ("sentence_transformer", EMBEDDING_MODEL_NAME),
+        ("cross_encoder", RERANKER_MODEL_NAME),
+        ("tokenizer", DEFAULT_TOKEN_MODEL),
+    ]
+    if translation_model:
+        models.append(("translation", translation_model))
+    if generation_model:
+        models.append(("snapshot", generation_model))
+    return models
+
+
+def build_bundle(output_dir: str, models: list[tuple[str, str]] = None, version: str = None) -> str:
+    """
+    Downloads `models` (defaults to `default_models()`) and the NLTK corpora into `output_dir/<version>` and writes
+    its manifest. The bundle is built in a temporary folder and renamed when complete. Returns its path.
+    """
+    models = default_models() if models is None else models
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    bundle_dir = os.path.join(output_dir, version)
+    if os.path.exists(bundle_dir):
+        raise ArtifactError(f"The bundle {bundle_dir} already exists.")
+    build_dir = bundle_dir + ".partial"
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir)
+
+    entries = []
+    for kind, name in models:
+        path = _model_dir(kind, name)
+        print(f"Saving {kind} model {name}...")
+        _save_model(kind, name, os.path.join(build_dir, path))
+        entries.append({"kind": kind, "name": name, "path": path})
+
+    import nltk
+    for resource in NLTK_RESOURCES:
+        if not nltk.download(resource, download_dir=os.path.join(build_dir, "nltk_data"), quiet=True):
+            raise ArtifactError(f"NLTK resource '{resource}' couldn't be downloaded.")
+
+    files = sorted(
+        os.path.relpath(os.path.join(root, file), build_dir)
+        for root, _, names in os.walk(build_dir) for file in names
+    )
+    manifest = {
+        "version": version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "models": entries,
+        "nltk_resources": list(NLTK_RESOURCES),
+        "files": _checksums(build_dir, files),
+    }
+    with open(os.path.join(build_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(build_dir, bundle_dir)
+    print(f"Bundle {version} written to {bundle_dir} ({len(files)} files)")
+    return bundle_dir
+
+
+def load_manifest(bundle_dir: str) -> dict:
+    path = os.path.join(bundle_dir, MANIFEST)
+    if not os.path.exists(path):
+        raise ArtifactError(f"{bundle_dir} is not an artifact bundle (no {MANIFEST}).")
+    with open(path) as f:
+        return json.load(f)
+
+
+def verify_bundle(bundle_dir: str) -> dict:
+    """
+    Checks that every file of the manifest exists with its checksum. Returns the manifest.
+
+    Raises
+    ------
+    ArtifactError
+        If a file is missing or modified.
+    """
+    manifest = load_manifest(bundle_dir)
+    missing = [file for file in manifest["files"] if not os.path.isfile(os.path.join(bundle_dir, file))]
+    if missing:
+        raise ArtifactError(f"Missing files in the bundle {bundle_dir}: {missing[:5]}")
+    checksums = _checksums(bundle_dir, list(manifest["files"]))
+    modified = [file for file, digest in manifest["files"].items() if checksums[file] != digest]
+    if modified:
+        raise ArtifactError(f"Checksum mismatch in the bundle {bundle_dir}: {modified[:5]}")
+    return manifest
+
+
+def activate_bundle(bundle_dir: str, verify: bool = True) -> dict:
+    """
+    Switches the process to offline mode, loading the models and corpora from a bundle (verified first, if `verify`).
+    Returns its manifest.
+    """
+    manifest = verify_bundle(bundle_dir) if verify else load_manifest(bundle_dir)
+    # The models are loaded from local paths, these keep the Hugging Face libraries from reaching the Hub anyway.
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    os.environ["TRANSFORMERS_OFFLINE"] = "1"
+
+    for entry in manifest["models"]:
+        registry.model_paths[(entry["kind"], entry["name"])] = os.path.abspath(os.path.join(bundle_dir, entry["path"]))
+    registry.offline = True
+    # Queries are translated by the local model of the bundle, if any (Google Translate needs the network).
+    translation = [entry["name"] for entry in manifest["models"] if entry["kind"] == "translation"]
+    os.environ.setdefault("TRANSLATION_BACKEND", "marian" if translation else "none")
+    if translation:
+        os.environ.setdefault("TRANSLATION_MODEL", translation[0])
+
+    import nltk
+    nltk.data.path.insert(0, os.path.abspath(os.path.join(bundle_dir, "nltk_data")))
+    synonyms.ALLOW_DOWNLOADS = False
+    print(f"Offline mode: artifact bundle {manifest['version']} ({bundle_dir})")
+    return manifest
@@ -0,0 +1,543 @@
+"""
+Storage backends of the VectorDB.
+
+A backend stores chunks (id, embedding, text and metadata) and searches them by embedding. Every backend returns the
+same structures as Chroma (dicts of "ids", "documents", "metadatas", "embeddings" and, for searches, per-query lists
+of "distances" as squared L2 distances), so the VectorDB doesn't depend on a particular engine:
+
+- `ChromaBackend`: the Chroma collection (HNSW index), used by default.
+- `NumpyBackend`: embeddings in a memory-mapped `.npy` matrix with an SQLite sidecar for ids, texts and metadata, and
+  exact top-k search with matrix products. For corpora below ~1M chunks it is competitive with HNSW, it uses less
+  memory (no graph) and several processes share the matrix through the page cache.
+
+The backend is chosen with the `VECTOR_BACKEND` environment variable ("chroma" or "numpy").
+"""
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+from src.filters import TAG_PREFIX
+
+DEFAULT_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+
+# HNSW parameters of the Chroma collection and their names in the collection metadata.
+HNSW_PARAMS = {"M": "hnsw:M", "ef_construction": "hnsw:construction_ef", "ef_search": "hnsw:search_ef"}
+# Chroma defaults.
+HNSW_DEFAULTS = {"M": 16, "ef_construction": 100, "ef_search": 100}
+
+
+def hnsw_from_env() -> dict:
+    """
+    HNSW parameters set with the `HNSW_M`, `HNSW_EF_CONSTRUCTION` and `HNSW_EF_SEARCH` environment variables.
+    """
+    params = {}
+    for name in HNSW_PARAMS:
+        value = os.getenv(f"HNSW_{name.upper()}")
+        if value:
+            params[name] = int(value)
+    return params
+
+# Maximum number of parameters of the SQLite queries of the NumPy backend.
+_SQL_BATCH = 500
+# Metadata attributes indexed by the NumPy backend (besides the "tag:<name>" keys), so filters on them don't scan.
+INDEXED_ATTRIBUTES = ("source", "page", "language")
+
+
+class VectorBackend:
+    """
+    Interface of the storage backends. Write methods are batched by the backend itself.
+    """
+    name = None
+
+    def add(self, ids: list[str], embeddings: list, documents: list[str], metadatas: list[dict]):
+        """
+        Adds chunks. Ids that are already stored are ignored.
+        """
+        raise NotImplementedError
+
+    def upsert(self, ids: list[str], embeddings: list, documents: list[str], metadatas: list[dict]):
+        """
+        Adds chunks, replacing the ones with the same id.
+        """
+        raise NotImplementedError
+
+    def delete(self, ids: list[str]):
+        raise NotImplementedError
+
+    def update_metadatas(self, ids: list[str], metadatas: list[dict]):
+        """
+        Updates the metadata of stored chunks: the given keys are merged into their stored metadata.
+        """
+        raise NotImplementedError
+
+    def search(self, query_embeddings: list, k: int, ef_search: int = None, where: dict = None) -> dict:
+        """
+        Returns the k nearest chunks of every query: {"ids", "documents", "metadatas", "distances"}, each one a list
+        (one per query) of lists sorted by increasing distance. `ef_search` is the size of the candidate list of
+        approximate (HNSW) backends for this search; exact backends ignore it. With `where` (Chroma filter syntax)
+        only the chunks whose metadata matches are scored.
+        """
+        raise NotImplementedError
+
+    def get(
+        self,
+        ids: list[str] = None,
+        where: dict = None,
+        include: list[str] = ("documents", "metadatas"),
+        limit: int = None,
+        offset: int = None
+    ) -> dict:
+        """
+        Returns the chunks with the given ids and/or whose metadata matches `where` (Chroma filter syntax), as a dict
+        with the "ids" and the included fields ("documents", "metadatas", "embeddings").
+        """
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def relevance_score(self, distance: float) -> float:
+        """
+        Converts a squared L2 distance between normalized embeddings into a relevance score in [0, 1]
+        (the same conversion LangChain applies to Chroma results).
+        """
+        return 1.0 - distance / np.sqrt(2)
+
+
+class ChromaBackend(VectorBackend):
+    name = "chroma"
+
+    def __init__(
+        self,
+        persist_directory: str,
+        embedding_function,
+        collection_name: str = "example_collection",
+        hnsw: dict = None,
+        brute_force_threshold: int = 2000
+    ):
+        """
+        Parameters
+        ----------
+        hnsw : dict, optional
+            HNSW parameters of the collection: "M" and "ef_construction" (only applied when the collection is
+            created) and "ef_search" (default candidate list size of the searches). Chroma defaults if not given.
+        brute_force_threshold : int
+            Filtered searches whose filter matches at most this number of chunks score them exactly instead of
+            walking the HNSW graph, which loses recall when most of its nodes are filtered out.
+        """
+        from langchain_chroma import Chroma
+        hnsw = hnsw or {}
+        self.vector_store = Chroma(
+            collection_name=collection_name,
+            embedding_function=embedding_function,
+            persist_directory=persist_directory,
+            collection_metadata={HNSW_PARAMS[name]: value for name, value in hnsw.items()} or None
+        )
+        self._collection = self.vector_store._collection
+        self.brute_force_threshold = brute_force_threshold
+        stored = self.hnsw_settings()
+        for name in ("M", "ef_construction"):
+            if name in hnsw and hnsw[name] != stored[name]:
+                print(f"[WARN] The collection was built with {name}={stored[name]}. "
+                      f"{name}={hnsw[name]} only applies to a new collection.")
+        self.ef_search = hnsw.get("ef_search", stored["ef_search"])
+        # hnswlib keeps `ef` in the index, so searches that change it are serialized.
+        self._search_lock = threading.Lock()
+
+    def hnsw_settings(self) -> dict:
+        """
+        HNSW parameters the collection was created with.
+        """
+        metadata = self._collection.metadata or {}
+        return {name: int(metadata.get(key, HNSW_DEFAULTS[name])) for name, key in HNSW_PARAMS.items()}
+
+    def _hnsw_index(self):
+        """
+        The hnswlib index of the collection, or None if it isn't reachable (e.g. with a remote Chroma client).
+        """
+        try:
+            from chromadb.segment import VectorReader
+            segment = self.vector_store._client._server._manager.get_segment(self._collection.id, VectorReader)
+            return segment._index
+        except Exception:
+            return None
+
+    def _batches(self, *columns):
+        max_batch_size = self.vector_store._client.get_max_batch_size()
+        for start in range(0, len(columns[0]), max_batch_size):
+            yield [column[start:start + max_batch_size] for column in columns]
+
+    def add(self, ids, embeddings, documents, metadatas):
+        for ids, embeddings, documents, metadatas in self._batches(ids, embeddings, documents, metadatas):
+            self._collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        for ids, embeddings, documents, metadatas in self._batches(ids, embeddings, documents, metadatas):
+            self._collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids):
+        for (ids,) in self._batches(ids):
+            self._collection.delete(ids=ids)
+
+    def update_metadatas(self, ids, metadatas):
+        for ids, metadatas in self._batches(ids, metadatas):
+            self._collection.update(ids=ids, metadatas=metadatas)
+
+    def search(self, query_embeddings, k, ef_search=None, where=None):
+        if where:
+            # The metadata segment of Chroma (an indexed SQLite table) gives the chunks that match the filter.
+            candidates = self._collection.get(where=where, include=[])["ids"]
+            if len(candidates) <= self.brute_force_threshold:
+                return self._exact_search(query_embeddings, k, candidates)
+        with self._search_lock:
+            index = self._hnsw_index()
+            if index is not None:
+                index.set_ef(ef_search or self.ef_search)
+            return self._collection.query(
+                query_embeddings=query_embeddings,
+                n_results=k,
+                where=where,
+                include=["documents", "metadatas", "distances"]
+            )
+
+    def _exact_search(self, query_embeddings, k, ids):
+        """
+        Scores the chunks `ids` exactly against every query.
+        """
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        chunks = self.get(ids=ids, include=["embeddings", "documents", "metadatas"])
+        if not len(chunks["ids"]):
+            for field in results:
+                results[field] = [[] for _ in query_embeddings]
+            return results
+        vectors = np.asarray(chunks["embeddings"], dtype=np.float32)
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        distances = (vectors ** 2).sum(axis=1) - 2 * queries @ vectors.T + (queries ** 2).sum(axis=1, keepdims=True)
+        n_results = min(k, len(vectors))
+        for query_distances in distances:
+            top = np.argpartition(query_distances, n_results - 1)[:n_results]
+            top = top[np.argsort(query_distances[top])]
+            results["ids"].append([chunks["ids"][i] for i in top])
+            results["documents"].append([chunks["documents"][i] for i in top])
+            results["metadatas"].append([chunks["metadatas"][i] for i in top])
+            results["distances"].append([max(float(query_distances[i]), 0.0) for i in top])
+        return results
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=None):
+        if ids is None:
+            return self._collection.get(where=where, include=list(include), limit=limit, offset=offset)
+        result = {"ids": [], **{field: [] for field in include}}
+        for (batch,) in self._batches(list(ids)):
+            chunks = self._collection.get(ids=batch, where=where, include=list(include))
+            for field in result:
+                result[field].extend(chunks[field])
+        return result
+
+    def count(self):
+        return self._collection.count()
+
+    def relevance_score(self, distance):
+        return self.vector_store._select_relevance_score_fn()(distance)
+
+
+def _attribute_column(field: str) -> str:
+    """
+    SQL expression of a metadata attribute. The JSON path is written literally (not as a parameter) so the query
+    planner can use the expression indexes of the attributes.
+    """
+    path = ("$." + json.dumps(field)).replace("'", "''")
+    return f"json_extract(metadata, '{path}')"
+
+
+def _where_clause(where: dict):
+    """
+    Translates a Chroma metadata filter (field equality, $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $and, $or) into
+    an SQL condition over the JSON metadata column, with its parameters.
+    """
+    operators = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+    clauses, params = [], []
+    for field, condition in where.items():
+        if field in ("$and", "$or"):
+            parts = [_where_clause(sub) for sub in condition]
+            clauses.append("(" + f" {field[1:].upper()} ".join(sql for sql, _ in parts) + ")")
+            params.extend(param for _, sub_params in parts for param in sub_params)
+            continue
+        column = _attribute_column(field)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, value in condition.items():
+            if operator in ("$in", "$nin"):
+                placeholders = ",".join("?" * len(value))
+                negation = "NOT " if operator == "$nin" else ""
+                clauses.append(f"{column} {negation}IN ({placeholders})")
+                params.extend(value)
+            elif operator in operators:
+                clauses.append(f"{column} {operators[operator]} ?")
+                params.append(value)
+            else:
+                raise ValueError(f"Not supported filter operator: {operator}")
+    return " AND ".join(clauses) or "1", params
+
+
+class NumpyBackend(VectorBackend):
+    name = "numpy"
+
+    def __init__(self, persist_directory: str, block_size: int = 65536):
+        """
+        Parameters
+        ----------
+        persist_directory : str
+            Folder of the embeddings matrix (`embeddings.npy`) and of its sidecar (`metadata.sqlite3`).
+        block_size : int
+            Number of rows multiplied at once by a search, which bounds its temporary memory.
+        """
+        self.block_size = block_size
+        self._matrix_path = os.path.join(persist_directory, "embeddings.npy")
+        self._conn = sqlite3.connect(os.path.join(persist_directory, "metadata.sqlite3"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (row INTEGER PRIMARY KEY, id TEXT UNIQUE, document TEXT, metadata TEXT)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        for attribute in INDEXED_ATTRIBUTES:
+            self._index_attribute(attribute)
+        self._conn.commit()
+        self._lock = threading.RLock()
+        self._version = None
+        self._sync()
+
+    def _index_attribute(self, attribute):
+        """
+        Creates (if needed) the expression index of a metadata attribute: the attribute index used to pre-filter.
+        """
+        name = "attribute_" + "".join(c if c.isalnum() else "_" for c in attribute)
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON chunks ({_attribute_column(attribute)})")
+
+    def _stored_version(self):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else 0
+
+    def _sync(self):
+        """
+        Maps the matrix again and reloads the row mask and the norms if the store was modified by another process
+        (or another instance), which is detected with a version counter in the sidecar.
+        """
+        version = self._stored_version()
+        if version == self._version:
+            return
+        self._matrix = np.load(self._matrix_path, mmap_mode="r+") if os.path.exists(self._matrix_path) else None
+        capacity = 0 if self._matrix is None else len(self._matrix)
+        self._alive = np.zeros(capacity, dtype=bool)
+        rows = [row for (row,) in self._conn.execute("SELECT row FROM chunks")]
+        self._alive[rows] = True
+        self._norms = np.zeros(capacity, dtype=np.float32)
+        for start in range(0, capacity, self.block_size):
+            block = np.asarray(self._matrix[start:start + self.block_size])
+            self._norms[start:start + len(block)] = (block ** 2).sum(axis=1)
+        self._version = version
+
+    def _bump_version(self):
+        self._version = self._stored_version() + 1
+        self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self._version,))
+
+    def _grow(self, needed: int, dim: int):
+        """
+        Makes room for `needed` more rows, doubling the capacity of the matrix (rewritten to a new file).
+        """
+        capacity = 0 if self._matrix is None else len(self._matrix)
+        new_capacity = max(2 * capacity, capacity + needed, 1024)
+        tmp_path = self._matrix_path + ".tmp.npy"
+        matrix = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(new_capacity, dim))
+        for start in range(0, capacity, self.block_size):
+            matrix[start:start + self.block_size] = self._matrix[start:start + self.block_size]
+        matrix.flush()
+        del matrix
+        self._matrix = None
+        os.replace(tmp_path, self._matrix_path)
+        self._matrix = np.load(self._matrix_path, mmap_mode="r+")
+        self._alive = np.concatenate([self._alive, np.zeros(new_capacity - capacity, dtype=bool)])
+        self._norms = np.concatenate([self._norms, np.zeros(new_capacity - capacity, dtype=np.float32)])
+
+    def _rows_of(self, ids):
+        rows = {}
+        for start in range(0, len(ids), _SQL_BATCH):
+            batch = ids[start:start + _SQL_BATCH]
+            rows.update(self._conn.execute(
+                f"SELECT id, row FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+            ).fetchall())
+        return rows
+
+    def _write(self, ids, embeddings, documents, metadatas, replace: bool):
+        if not ids:
+            return
+        with self._lock, self._conn:
+            self._sync()
+            # The last occurrence of a repeated id wins, like in Chroma.
+            positions = {chunk_id: i for i, chunk_id in enumerate(ids)}
+            existing = self._rows_of(list(positions))
+            if not replace:
+                positions = {chunk_id: i for chunk_id, i in positions.items() if chunk_id not in existing}
+                if not positions:
+                    return
+            vectors = np.asarray(embeddings, dtype=np.float32)
+            n_new = sum(chunk_id not in existing for chunk_id in positions)
+            free = np.flatnonzero(~self._alive)
+            if len(free) < n_new:
+                self._grow(n_new - len(free), vectors.shape[1])
+                free = np.flatnonzero(~self._alive)
+            free = iter(free.tolist())
+            rows = [existing[chunk_id] if chunk_id in existing else next(free) for chunk_id in positions]
+            selected = list(positions.values())
+            self._matrix[rows] = vectors[selected]
+            self._matrix.flush()
+            self._norms[rows] = (vectors[selected] ** 2).sum(axis=1)
+            self._alive[rows] = True
+            for key in {key for i in selected for key in metadatas[i] if key.startswith(TAG_PREFIX)}:
+                self._index_attribute(key)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+                [
+                    (row, chunk_id, documents[i], json.dumps(metadatas[i]))
+                    for row, (chunk_id, i) in zip(rows, positions.items())
+                ]
+            )
+            self._bump_version()
+
+    def add(self, ids, embeddings, documents, metadatas):
+        self._write(ids, embeddings, documents, metadatas, replace=False)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self._write(ids, embeddings, documents, metadatas, replace=True)
+
+    def update_metadatas(self, ids, metadatas):
+        with self._lock, self._conn:
+            updates = dict(zip(ids, metadatas))
+            keys = list(updates)
+            rows = []
+            for start in range(0, len(keys), _SQL_BATCH):
+                batch = keys[start:start + _SQL_BATCH]
+                for chunk_id, metadata in self._conn.execute(
+                    f"SELECT id, metadata FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+                ):
+                    metadata = json.loads(metadata)
+                    metadata.update(updates[chunk_id])
+                    rows.append((json.dumps(metadata), chunk_id))
+            for key in {key for metadata in metadatas for key in metadata if key.startswith(TAG_PREFIX)}:
+                self._index_attribute(key)
+            self._conn.executemany("UPDATE chunks SET metadata = ? WHERE id = ?", rows)
+            self._bump_version()
+
+    def delete(self, ids):
+        with self._lock, self._conn:
+            self._sync()
+            rows = list(self._rows_of(list(ids)).values())
+            if not rows:
+                return
+            self._alive[rows] = False
+            self._conn.executemany("DELETE FROM chunks WHERE row = ?", [(row,) for row in rows])
+            self._bump_version()
+
+    def _fetch_rows(self, rows, include):
+        """
+        Returns the chunks stored in the given rows, in the same order.
+        """
+        found = {}
+        for start in range(0, len(rows), _SQL_BATCH):
+            batch = rows[start:start + _SQL_BATCH]
+            for row, chunk_id, document, metadata in self._conn.execute(
+                f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({','.join('?' * len(batch))})", batch
+            ):
+                found[row] = (chunk_id, document, metadata)
+        rows = [row for row in rows if row in found]
+        result = {"ids": [found[row][0] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [found[row][1] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(found[row][2]) for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [self._matrix[row].tolist() for row in rows]
+        return result
+
+    def search(self, query_embeddings, k, ef_search=None, where=None):
+        with self._lock:
+            self._sync()
+            results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+            if where:
+                # Pre-filter with the attribute indexes: only the matching rows are read and scored.
+                where_sql, where_params = _where_clause(where)
+                candidates = np.array(
+                    [row for (row,) in self._conn.execute(f"SELECT row FROM chunks WHERE {where_sql}", where_params)],
+                    dtype=np.int64
+                )
+            else:
+                candidates = np.flatnonzero(self._alive)
+            n_results = min(k, len(candidates))
+            if n_results <= 0:
+                for field in results:
+                    results[field] = [[] for _ in query_embeddings]
+                return results
+            queries = np.asarray(query_embeddings, dtype=np.float32)
+            full_scan = len(candidates) == int(self._alive.sum())
+            if full_scan:
+                candidates = np.arange(len(self._alive))
+            # ||x - q||^2 = ||x||^2 - 2 <x, q> + ||q||^2, computed block by block over the memory-mapped matrix.
+            distances = np.empty((len(queries), len(candidates)), dtype=np.float32)
+            for start in range(0, len(candidates), self.block_size):
+                if full_scan:
+                    block = self._matrix[start:start + self.block_size]
+                else:
+                    block = self._matrix[candidates[start:start + self.block_size]]
+                norms = self._norms[candidates[start:start + len(block)]]
+                distances[:, start:start + len(block)] = norms - 2 * (queries @ block.T)
+            distances += (queries ** 2).sum(axis=1, keepdims=True)
+            if full_scan:
+                distances[:, ~self._alive] = np.inf
+            top = np.argpartition(distances, n_results - 1, axis=1)[:, :n_results]
+            for query_distances, positions in zip(distances, top):
+                positions = positions[np.argsort(query_distances[positions])]
+                rows = candidates[positions]
+                chunks = self._fetch_rows(rows.tolist(), ("documents", "metadatas"))
+                results["ids"].append(chunks["ids"])
+                results["documents"].append(chunks["documents"])
+                results["metadatas"].append(chunks["metadatas"])
+                results["distances"].append([max(float(query_distances[i]), 0.0) for i in positions])
+            return results
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=None):
+        with self._lock:
+            self._sync()
+            where_sql, where_params = _where_clause(where) if where else ("1", [])
+            if ids is None:
+                rows = [row for (row,) in self._conn.execute(
+                    f"SELECT row FROM chunks WHERE {where_sql} ORDER BY row LIMIT ? OFFSET ?",
+                    [*where_params, -1 if limit is None else limit, offset or 0]
+                )]
+            else:
+                rows = sorted(self._rows_of(list(ids)).values())
+                if where:
+                    matching = []
+                    for start in range(0, len(rows), _SQL_BATCH):
+                        batch = rows[start:start + _SQL_BATCH]
+                        matching.extend(row for (row,) in self._conn.execute(
+                            f"SELECT row FROM chunks WHERE row IN ({','.join('?' * len(batch))}) AND {where_sql}",
+                            [*batch, *where_params]
+                        ))
+                    rows = sorted(matching)
+                rows = rows[offset or 0:None if limit is None else (offset or 0) + limit]
+            return self._fetch_rows(rows, include)
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+def make_backend(name: str, persist_directory: str, embedding_function, hnsw: dict = None) -> VectorBackend:
+    """
+    Creates the backend `name` ("chroma" or "numpy") persisted in `persist_directory`. `hnsw` are the HNSW
+    parameters of the Chroma collection.
+    """
+    if name == "chroma":
+        return ChromaBackend(persist_directory, embedding_function, hnsw=hnsw)
+    if name == "numpy":
+        return NumpyBackend(persist_directory)
+    raise ValueError(f"Not supported vector backend: {name}. Use 'chroma' or 'numpy'.")
@@ -0,0 +1,166 @@
+"""
+Sparse (BM25) index over the chunks of the vector store, used together with the dense search for hybrid retrieval.
+"""
+import math
+import re
+import heapq
+import sqlite3
+import threading
+from collections import Counter
+
+# Tokens are lowercase alphanumeric words. Dots, dashes and slashes inside a token are kept so that drug names,
+# dosages and ICD codes (e.g. "O24.4", "covid-19") are indexed as a single term.
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    def __init__(self, path: str = None, k1: float = 1.5, b: float = 0.75):
+        """
+        Inverted index scored with Okapi BM25.
+
+        The postings are kept in memory for searching and persisted in a SQLite file, which is updated incrementally
+        on every `add`/`remove` so it never has to be rewritten as a whole.
+
+        Parameters
+        ----------
+        path : str, optional
+            Path of the SQLite file where the index is persisted. If None, the index only lives in memory.
+        k1 : float
+            Term frequency saturation parameter.
+        b : float
+            Document length normalization parameter.
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+
+        self._postings = {}  # {term: {chunk_id: term frequency}}
+        self._doc_terms = {}  # {chunk_id: {term: term frequency}}
+        self._doc_lengths = {}  # {chunk_id: number of tokens}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+        self._conn = None
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS postings (chunk_id TEXT, term TEXT, tf INTEGER)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id)")
+            self._conn.commit()
+            self._load()
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self._doc_lengths
+
+    def _load(self):
+        """
+        Loads the persisted postings in memory.
+        """
+        doc_terms = {}
+        for chunk_id, term, tf in self._conn.execute("SELECT chunk_id, term, tf FROM postings"):
+            doc_terms.setdefault(chunk_id, {})[term] = tf
+        for chunk_id, terms in doc_terms.items():
+            self._add_in_memory(chunk_id, terms)
+
+    def _add_in_memory(self, chunk_id, terms):
+        self._doc_terms[chunk_id] = terms
+        length = sum(terms.values())
+        self._doc_lengths[chunk_id] = length
+        self._total_length += length
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[chunk_id] = tf
+
+    def _remove_in_memory(self, chunk_id):
+        terms = self._doc_terms.pop(chunk_id)
+        self._total_length -= self._doc_lengths.pop(chunk_id)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[chunk_id]
+            if not postings:
+                del self._postings[term]
+
+    def add(self, ids: list[str], texts: list[str]):
+        """
+        Indexes chunks. Chunks that are already indexed are replaced.
+        """
+        entries = dict(zip(ids, texts))
+        with self._lock:
+            replaced = [chunk_id for chunk_id in entries if chunk_id in self._doc_terms]
+            for chunk_id in replaced:
+                self._remove_in_memory(chunk_id)
+            rows = []
+            for chunk_id, text in entries.items():
+                terms = dict(Counter(tokenize(text)))
+                self._add_in_memory(chunk_id, terms)
+                rows.extend((chunk_id, term, tf) for term, tf in terms.items())
+            if self._conn is not None:
+                self._conn.executemany("DELETE FROM postings WHERE chunk_id = ?", [(i,) for i in replaced])
+                self._conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", rows)
+                self._conn.commit()
+
+    def remove(self, ids: list[str]):
+        """
+        Removes chunks from the index. Unknown ids are ignored.
+        """
+        with self._lock:
+            ids = [chunk_id for chunk_id in ids if chunk_id in self._doc_terms]
+            for chunk_id in ids:
+                self._remove_in_memory(chunk_id)
+            if self._conn is not None and ids:
+                self._conn.executemany("DELETE FROM postings WHERE chunk_id = ?", [(i,) for i in ids])
+                self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._postings, self._doc_terms, self._doc_lengths = {}, {}, {}
+            self._total_length = 0
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM postings")
+                self._conn.commit()
+
+    def search(self, query: str, k: int = 5, ids: set = None) -> list[tuple[str, float]]:
+        """
+        Returns the `k` chunks with the highest BM25 score for the query, as (chunk_id, score) tuples sorted by
+        decreasing score. Chunks that share no term with the query are never returned. If `ids` is given, only those
+        chunks are scored (the corpus statistics are still the ones of the whole index).
+        """
+        with self._lock:
+            n_docs = len(self._doc_lengths)
+            if n_docs == 0:
+                return []
+            avg_length = self._total_length / n_docs
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    if ids is not None and chunk_id not in ids:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[tuple[str, float]]:
+    """
+    Fuses several rankings of chunk ids with Reciprocal Rank Fusion: every id scores sum(1 / (k + rank)) over the
+    rankings where it appears.
+
+    Returns
+    -------
+    list[tuple[str, float]]
+        (chunk_id, fused score) tuples sorted by decreasing score.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
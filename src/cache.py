@@ -0,0 +1,235 @@
+"""
+Persistent cache of chunk embeddings, so re-ingesting a document only embeds the chunks whose text has changed,
+persistent cache of query translations, and in-memory semantic cache of retrieval results, so paraphrases of a recent
+query skip the retrieval pipeline.
+"""
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str):
+        """
+        SQLite store of embeddings keyed by (model name, sha256 of the embedded text).
+
+        Parameters
+        ----------
+        path : str
+            Path of the SQLite file.
+        """
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, text_hash TEXT, vector BLOB, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model: str, texts: list[str]) -> list:
+        """
+        Returns the cached embedding of every text (as a list of floats), or None for the texts that aren't cached.
+        """
+        hashes = [text_hash(text) for text in texts]
+        found = {}
+        with self._lock:
+            # SQLite limits the number of parameters of a query, so hashes are looked up in slices.
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *chunk]
+                )
+                for h, vector in rows:
+                    found[h] = np.frombuffer(vector, dtype=np.float32).tolist()
+            self.hits += sum(h in found for h in hashes)
+            self.misses += sum(h not in found for h in hashes)
+        return [found.get(h) for h in hashes]
+
+    def put_many(self, model: str, texts: list[str], vectors: list[list[float]]):
+        rows = [
+            (model, text_hash(text), np.asarray(vector, dtype=np.float32).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+
+class TranslationCache:
+    def __init__(self, path: str):
+        """
+        SQLite store of translations keyed by (translation backend, target language, sha256 of the source text).
+
+        Parameters
+        ----------
+        path : str
+            Path of the SQLite file.
+        """
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations (backend TEXT, target TEXT, text_hash TEXT, translation TEXT, "
+            "PRIMARY KEY (backend, target, text_hash))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, backend: str, target: str, text: str) -> str:
+        """
+        Returns the cached translation of a text, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT translation FROM translations WHERE backend = ? AND target = ? AND text_hash = ?",
+                (backend, target, text_hash(text))
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, backend: str, target: str, text: str, translation: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)",
+                (backend, target, text_hash(text), translation)
+            )
+            self._conn.commit()
+
+
+class SemanticQueryCache:
+    def __init__(self, threshold: float = None, max_size: int = None, ttl: float = None):
+        """
+        In-memory cache of retrieval results keyed by query embeddings: a lookup hits when the query is within a
+        cosine similarity `threshold` of a cached one (e.g. a paraphrase or a translation of it).
+
+        Every entry has one or more key embeddings (e.g. of the original query and of its English translation) and a
+        scope (the retrieval parameters it was computed with): only keys of the same scope are compared. Entries
+        expire `ttl` seconds after they are stored, and the least recently used ones are evicted beyond `max_size`.
+        The results depend on the stored documents, so the owner must `clear` the cache whenever they change.
+
+        Parameters
+        ----------
+        threshold : float, optional
+            Min cosine similarity of a hit. Defaults to the `QUERY_CACHE_THRESHOLD` environment variable or 0.95.
+        max_size : int, optional
+            Max number of entries (0 disables the cache). Defaults to `QUERY_CACHE_SIZE` or 1024.
+        ttl : float, optional
+            Seconds an entry is valid. Defaults to `QUERY_CACHE_TTL` or 3600.
+        """
+        self.threshold = float(os.getenv("QUERY_CACHE_THRESHOLD", "0.95") if threshold is None else threshold)
+        self.max_size = int(os.getenv("QUERY_CACHE_SIZE", "1024") if max_size is None else max_size)
+        self.ttl = float(os.getenv("QUERY_CACHE_TTL", "3600") if ttl is None else ttl)
+
+        self._entries = OrderedDict()  # {entry id: (scope, value, expiry time)}, least recently used first
+        self._keys = np.zeros((0, 0), dtype=np.float32)  # Normalized key embeddings, one row per key
+        self._key_entries = []  # Entry id of every key row
+        self._key_scopes = []  # Scope of every key row
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _normalize(embeddings) -> np.ndarray:
+        vectors = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def get(self, embedding: list[float], scope: str = ""):
+        """
+        Returns the value of the most similar cached query of the same scope, or None if none is within the threshold.
+        Misses aren't counted here but in `put`, so a request looked up with several embeddings is a single miss.
+        """
+        if self.max_size <= 0:
+            return None
+        query = self._normalize(embedding)[0]
+        with self._lock:
+            self._drop_expired()
+            if not self._key_entries or self._keys.shape[1] != len(query):
+                return None
+            similarities = self._keys @ query
+            similarities[[key_scope != scope for key_scope in self._key_scopes]] = -np.inf
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            entry_id = self._key_entries[best]
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return self._entries[entry_id][1]
+
+    def put(self, embeddings: list[list[float]], value, scope: str = ""):
+        """
+        Caches the result `value` of a query (computed after a miss) under the key `embeddings`.
+        """
+        if self.max_size <= 0:
+            return
+        keys = self._normalize(embeddings)
+        with self._lock:
+            self.misses += 1
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (scope, value, time.monotonic() + self.ttl)
+            self._keys = keys if not self._key_entries else np.vstack([self._keys, keys])
+            self._key_entries.extend([entry_id] * len(keys))
+            self._key_scopes.extend([scope] * len(keys))
+            evicted = []
+            while len(self._entries) > self.max_size:
+                evicted.append(self._entries.popitem(last=False)[0])
+            self.evictions += len(evicted)
+            self._drop_keys(evicted)
+
+    def _drop_expired(self):
+        now = time.monotonic()
+        expired = [entry_id for entry_id, (_, _, expiry) in self._entries.items() if expiry <= now]
+        for entry_id in expired:
+            del self._entries[entry_id]
+        self.evictions += len(expired)
+        self._drop_keys(expired)
+
+    def _drop_keys(self, entry_ids):
+        if not entry_ids:
+            return
+        entry_ids = set(entry_ids)
+        keep = [i for i, entry_id in enumerate(self._key_entries) if entry_id not in entry_ids]
+        self._keys = self._keys[keep]
+        self._key_entries = [self._key_entries[i] for i in keep]
+        self._key_scopes = [self._key_scopes[i] for i in keep]
+
+    def clear(self):
+        """
+        Drops all the entries (e.g. because the stored documents changed).
+        """
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._keys = np.zeros((0, 0), dtype=np.float32)
+            self._key_entries = []
+            self._key_scopes = []
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,213 @@
+"""
+Persistent catalog of the documents stored in the VectorDB.
+
+For every document (source) the catalog keeps its chunk ids, number of chunks and pages, file size, content hash,
+splitter settings, tags and ingest time. Listing, counting and deleting documents are indexed SQLite queries over the
+catalog instead of scans of the whole Chroma collection.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+
+class DocumentCatalog:
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the SQLite file where the catalog is persisted.
+        """
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "source TEXT PRIMARY KEY, filename TEXT, sha256 TEXT, settings TEXT, chunk_count INTEGER, "
+            "pages INTEGER, size_bytes INTEGER, ingested_at REAL)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(documents)")]
+        if "tags" not in columns:
+            # Catalogs created before documents had tags.
+            self._conn.execute("ALTER TABLE documents ADD COLUMN tags TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_filename ON documents (filename)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chunks (chunk_id TEXT PRIMARY KEY, source TEXT)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.count_documents()
+
+    def __contains__(self, source):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM documents WHERE source = ?", (source,)).fetchone()
+        return row is not None
+
+    def current_sha256(self, source: str, settings: dict) -> str:
+        """
+        Returns the hash of the ingested version of a source if it was chunked with the same settings, otherwise None
+        (the source has to be ingested again).
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256, settings FROM documents WHERE source = ?", (source,)
+            ).fetchone()
+        if row is None or row[1] is None or json.loads(row[1]) != settings:
+            return None
+        return row[0]
+
+    def get(self, source: str) -> dict:
+        """
+        Returns the catalog entry of a source (with the "ids" of its chunks), or None if it isn't in the catalog.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM documents WHERE source = ?", (source,)).fetchone()
+            if row is None:
+                return None
+            ids = [r[0] for r in self._conn.execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,))]
+        entry = self._row_to_dict(row)
+        entry["ids"] = ids
+        return entry
+
+    def set(
+        self,
+        source: str,
+        sha256: str,
+        settings: dict,
+        ids: list[str],
+        pages: int = None,
+        size_bytes: int = None,
+        tags: list[str] = None
+    ):
+        """
+        Records (or replaces) the entry of a source. If `tags` is None, the tags of the previous entry are kept.
+        """
+        with self._lock, self._conn:
+            if tags is None:
+                row = self._conn.execute("SELECT tags FROM documents WHERE source = ?", (source,)).fetchone()
+                tags = json.loads(row[0]) if row and row[0] else []
+            self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    source, os.path.basename(source), sha256, json.dumps(settings) if settings else None,
+                    len(ids), pages, size_bytes, time.time(), json.dumps(sorted(tags))
+                )
+            )
+            self._conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?)", [(i, source) for i in ids])
+
+    def tags(self, source: str) -> list[str]:
+        """
+        Tags of a source ([] if it has none or isn't in the catalog).
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT tags FROM documents WHERE source = ?", (source,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else []
+
+    def set_tags(self, source: str, tags: list[str]):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE documents SET tags = ? WHERE source = ?", (json.dumps(sorted(tags)), source))
+
+    def remove(self, sources: list[str]):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM chunks WHERE source = ?", [(s,) for s in sources])
+            self._conn.executemany("DELETE FROM documents WHERE source = ?", [(s,) for s in sources])
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM documents")
+
+    def reconcile(self, chunk_sources: dict, documents: dict) -> tuple[int, int]:
+        """
+        Makes the chunks of the catalog match the ones of the vector store, e.g. after an interrupted ingestion: the
+        missing chunks are added to their source and the chunks that aren't stored anymore are removed. The entries
+        of the other sources are untouched. Sources whose chunks changed keep their tags but lose their hash, so
+        uploading them again replaces their chunks; sources without chunks left are removed.
+
+        Parameters
+        ----------
+        chunk_sources : dict
+            {chunk id: source} of every chunk of the vector store.
+        documents : dict
+            {source: {"pages": ..., "tags": [...]}} used for the sources that aren't in the catalog yet.
+
+        Returns
+        -------
+        tuple[int, int]
+            Number of chunks added and removed.
+        """
+        with self._lock, self._conn:
+            cataloged = dict(self._conn.execute("SELECT chunk_id, source FROM chunks"))
+            removed = [chunk_id for chunk_id in cataloged if chunk_id not in chunk_sources]
+            added = [
+                (chunk_id, source) for chunk_id, source in chunk_sources.items() if cataloged.get(chunk_id) != source
+            ]
+            self._conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in removed])
+            self._conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?)", added)
+
+            changed = {cataloged[chunk_id] for chunk_id in removed} | {source for _, source in added}
+            changed |= {cataloged[chunk_id] for chunk_id, _ in added if chunk_id in cataloged}
+            for source in changed:
+                count = self._conn.execute("SELECT COUNT(*) FROM chunks WHERE source = ?", (source,)).fetchone()[0]
+                exists = self._conn.execute("SELECT 1 FROM documents WHERE source = ?", (source,)).fetchone()
+                if count == 0:
+                    self._conn.execute("DELETE FROM documents WHERE source = ?", (source,))
+                elif exists:
+                    self._conn.execute(
+                        "UPDATE documents SET chunk_count = ?, sha256 = NULL WHERE source = ?", (count, source)
+                    )
+                else:
+                    document = documents.get(source, {})
+                    self._conn.execute(
+                        "INSERT INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            source, os.path.basename(source), None, None, count, document.get("pages"), None,
+                            time.time(), json.dumps(sorted(document.get("tags", [])))
+                        )
+                    )
+        return len(added), len(removed)
+
+    def sources_for_filename(self, filename: str) -> list[str]:
+        """
+        Returns the sources (full paths) whose file name is `filename`.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT source FROM documents WHERE filename = ?", (filename,)).fetchall()
+        return [row[0] for row in rows]
+
+    def list_documents(self, offset: int = 0, limit: int = None) -> list[dict]:
+        """
+        Returns a page of catalog entries (without chunk ids), sorted by file name.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM documents ORDER BY filename, source LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset)
+            ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def count_documents(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def count_chunks(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    @staticmethod
+    def _row_to_dict(row) -> dict:
+        source, filename, sha256, settings, chunk_count, pages, size_bytes, ingested_at, tags = row
+        return {
+            "source": source,
+            "filename": filename,
+            "sha256": sha256,
+            "settings": json.loads(settings) if settings else None,
+            "chunk_count": chunk_count,
+            "pages": pages,
+            "size_bytes": size_bytes,
+            "ingested_at": ingested_at,
+            "tags": json.loads(tags) if tags else [],
+        }
@@ -1,82 +1,82 @@
 # Import libraries
 import sys
 sys.path.append(".")
-from src.db import VectorDB
+from src.db import VectorDB, PERSIST_DIRECTORY
+from src.models import registry, EMBEDDING_MODEL_NAME, RERANKER_MODEL_NAME
+from src.context import TokenCounter, DEFAULT_TOKEN_MODEL, DEFAULT_TOKEN_BUDGET, SEPARATOR
+from src.synonyms import SynonymTable, english_stopwords, expandable_words, wordnet_lemmas
+from src.reranker import Reranker
+from src.translation import Translator, TRANSLATION_CACHE_FILE
+from src.pipeline import Pipeline, Stage
+from src.sessions import Conversation, Memory
+import os
+import json
+import requests
 from llm.model import LocalLLM
-import nltk
-from nltk.corpus import wordnet, stopwords
-from sentence_transformers import SentenceTransformer, util
-from sentence_transformers import CrossEncoder
-from deep_translator import GoogleTranslator
-
-# Memory class to store and manage the chat history
-class Memory:
-    def __init__(self, max_messages_count=10):
-        self._memory = []
-        self.max_messages_count = max_messages_count
-    def update_memory(self, human_msg: str, ai_msg: str):
-        self._memory.append(
-            {"role": "user", "content": human_msg}
-        )
-        self._memory.append(
-            {"role": "assistant", "content": ai_msg}
-        )
-
-    def reset_memory(self):
-        self._memory = []
-
-    @property
-    def history(self):
-        return self._memory[-self.max_messages_count:]
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # Main chatbot class
 class ChatBot:
-    def __init__(self):
-        # Ensure WordNet and stopwords are available
-        try:
-            wordnet.synsets('test')
-        except LookupError:
-            nltk.download('wordnet')
-        try:
-            stopwords("english")
-        except:
-            nltk.download("stopwords")
-            
+    def __init__(self, persist_directory: str = PERSIST_DIRECTORY):
         self.llm = LocalLLM() # Attribute pointing to the LLM to send messages.
-        self.memory = Memory() # Memory object that holds a history of the conversation that has been taken.
-
-        # Translator (auto to English)
-        try:
-            self.translator = GoogleTranslator(source='auto', target='en')
-        except Exception as e:
-            print("[WARN] Translator not loaded:", e)
-            self.translator = None
+        # State (memory, context and sources) of the conversation used when none is given. The app passes the
+        # conversation of every session instead (see `src/sessions.py`), so the ChatBot is shared by all of them.
+        self.conversation = Conversation("default")
+
+        # Max number of tokens of the retrieved context, counted with the tokenizer of the model served by the LLM.
+        self.context_token_budget = DEFAULT_TOKEN_BUDGET
+        self._token_counters = {} # {model name: TokenCounter}
+        self._llm_model_name = None  # Model served by the LLM service, as reported by its /health
+        self._llm_model_stale = True  # Whether the LLM service has to be asked for its model again
+        self._model_name_checked_at = None  # Last time the LLM service was asked for its model
+        self.model_name_retry = 30  # Seconds between those requests while the service can't be reached
+
+        # Translator to English, with a deadline (backend chosen with TRANSLATION_BACKEND) and a persistent cache kept
+        # in the folder of the vector store `persist_directory` (or in TRANSLATION_CACHE_PATH)
+        self.translator = Translator(
+            cache_path=os.getenv("TRANSLATION_CACHE_PATH") or os.path.join(persist_directory, TRANSLATION_CACHE_FILE)
+        )
         
-        # Sentence embedding model
-        self.ST_MODEL = SentenceTransformer("all-mpnet-base-v2")
+        # Sentence embedding model (the same shared instance used by the VectorDB)
+        self.ST_MODEL = registry.sentence_transformer(EMBEDDING_MODEL_NAME)
         
         # Load English stopwords
-        try:
-            _stopwords = set(stopwords.words("english"))
-        except:
-            nltk.download("stopwords")
-            _stopwords = set(stopwords.words("english"))
-        self.STOPWORDS_EN = _stopwords
+        self.STOPWORDS_EN = set(english_stopwords())
+
+        # Embeddings of the recent query variants built by `expand_query` {variant: embedding}, least recent first.
+        self._variant_embeddings = OrderedDict()
+        self.variant_cache_size = 4096
+        self._variant_lock = threading.Lock()
         
-        # CrossEncoder model for re-ranking
-        self.re_ranker = CrossEncoder('cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
+        # CrossEncoder model for re-ranking, scored in length-sorted batches with a cache of scores
+        self.re_ranker = registry.cross_encoder(RERANKER_MODEL_NAME)
+        self.reranker = Reranker(self.re_ranker)
+
+        # Threads that run the stages of the retrieval pipeline, and max seconds of every stage (overridable with the
+        # RETRIEVAL_STAGE_TIMEOUTS environment variable, e.g. '{"rerank": 5}').
+        self._pipeline_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("RETRIEVAL_WORKERS", "8")), thread_name_prefix="retrieval"
+        )
+        self.stage_timeouts = {
+            "embed": 10, "cache": 2, "detect": 2, "translate": self.translator.deadline + 1, "allowed": 10,
+            "expand": 10, "search": 15, "fuse": 10, "rerank": 20,
+        }
+        self.stage_timeouts.update(json.loads(os.getenv("RETRIEVAL_STAGE_TIMEOUTS", "{}")))
+
+        # Refresh policy of the context of a conversation (see `refresh_context`): it's retrieved again when the cosine
+        # distance between a new query and the query that retrieved it exceeds the drift threshold; otherwise it's
+        # reused, topped up with the best `context_topup_k` dense hits of the new query (0 disables the top-up).
+        self.context_drift_threshold = float(os.getenv("CONTEXT_DRIFT_THRESHOLD", "0.5"))
+        self.context_topup_k = int(os.getenv("CONTEXT_TOPUP_K", "2"))
+        self._refresh_counts = {"initial": 0, "filtered": 0, "refresh": 0, "reuse": 0, "topup": 0, "topup_chunks": 0}
+        self._drift_sum = 0.0
+        self._drift_count = 0
+        self._refresh_lock = threading.Lock()
         
-        # Download language detection model
-        try:
-            from langdetect import detect
-            self.detect_language = detect
-        except ImportError:
-            print("Installing langdetect...")
-            import subprocess
-            subprocess.check_call(["pip", "install", "langdetect"])
-            from langdetect import detect
-            self.detect_language = detect
-
         # System prompt. This is like some 'general rules' that will be passed to the LLM to behave in a certain way.
         self.system_prompt = (
             "You are an AI assistant ChatBot engaged in a conversation with a user. "
@@ -109,22 +109,48 @@ class ChatBot:
             "[END_OF_CONTEXT]"
         )
     
-    def initialize_context(self, context: str):
+    def close(self):
         """
-        Method that loads the context in the ChatBot object to use it for the conversation.
+        Releases the models this object holds in the model registry.
         """
-        self.context = context
+        registry.release("sentence_transformer", EMBEDDING_MODEL_NAME)
+        registry.release("cross_encoder", RERANKER_MODEL_NAME)
+        self.translator.close()
+        self._pipeline_executor.shutdown(wait=False)
 
-    def remove_context(self):
+    @property
+    def memory(self) -> Memory:
+        """
+        Memory of the default conversation.
+        """
+        return self.conversation.memory
+
+    @property
+    def current_sources(self) -> list:
+        """
+        Sources of the context of the default conversation.
+        """
+        return self.conversation.sources
+
+    def initialize_context(self, context: str, conversation: Conversation = None):
+        """
+        Method that loads the context in a conversation (the default one if not given) to use it for the conversation.
+        """
+        (conversation or self.conversation).context = context
+
+    def remove_context(self, conversation: Conversation = None):
         """
         Resets the context.
         """
-        del self.context
+        conversation = conversation or self.conversation
+        conversation.context = None
+        conversation.context_embedding = None
+        conversation.context_filters = None
 
-    def has_context(self):
-        return hasattr(self, "context")
+    def has_context(self, conversation: Conversation = None):
+        return (conversation or self.conversation).context is not None
 
-    def build_prompt(self, context: str, user_query: str):
+    def build_prompt(self, context: str, user_query: str, conversation: Conversation = None):
         """
         This method builds the context following the llm's chat template that huggingface models use.
         For more info see: https://huggingface.co/docs/transformers/chat_templating.
@@ -132,9 +158,12 @@ class ChatBot:
         Parameters
         ----------
         context : str
-            String that contains the context formed by the chunks of the different documents, holded in `self.context`.
+            String that contains the context formed by the chunks of the different documents, holded in the context of
+            the conversation.
         user_query : str
             New user query in string format.
+        conversation : Conversation, optional
+            Conversation whose memory is added (the default one if not given).
         
         Returns
         -------
@@ -154,42 +183,47 @@ class ChatBot:
             },
 
             # We add the history of messages.
-            *self.memory.history,
+            *(conversation or self.conversation).memory.history,
 
             # Finally, we add the last given user query.
             {"role": "user", "content": user_query}
         ]
         return messages
 
-    def infer(self, message: str):
+    def infer(self, message: str, conversation: Conversation = None):
         """
         Sends the user message to the LLM along with system prompt, context and memory.
 
         Parameters:
             message (str): User input.
+            conversation (Conversation): Conversation whose context and memory are used and updated (the default one
+                if not given).
 
         Returns:
             Tuple[str, list]: The model's response and the current sources used.
         """
-        # Detect language of the message
-        try:
-            detected_lang = self.detect_language(message)
+        conversation = conversation or self.conversation
+        # Detect language of the message (memoized, the retrieval of the same query already detected it)
+        detected_lang = self.translator.detect_language(message)
+        if detected_lang:
             # Add language instruction to the message
             message_with_lang = f"[LANGUAGE: {detected_lang.upper()}] {message}"
-        except:
+        else:
             message_with_lang = message
 
-        # If ChatBot has no attribute "context" (context hasn't been provided) it prints an error and returns an empty string.
-        if not hasattr(self, "context"):
+        # If the conversation has no context (context hasn't been provided) the message is sent without it.
+        if conversation.context is None:
             prompt = [
                 {"role": "system", "content": self.system_prompt},
-                *self.memory.history,
+                *conversation.memory.history,
                 {"role": "user", "content": message_with_lang}
             ]
             sources = []
         else:
-            prompt = self.build_prompt(context=self.context, user_query=message_with_lang)
-            sources = self.current_sources
+            prompt = self.build_prompt(
+                context=conversation.context, user_query=message_with_lang, conversation=conversation
+            )
+            sources = conversation.sources
         
         answer = self.llm(prompt)
         flag = "</think>"
@@ -197,11 +231,13 @@ class ChatBot:
             start_idx = answer.find(flag)
             if start_idx != -1:
                 answer = answer[start_idx + len(flag):]
-        self.memory.update_memory(human_msg=message, ai_msg=answer)
+        conversation.memory.update_memory(human_msg=message, ai_msg=answer)
         
         return answer, sources
     
-    def retrieve_context_from_db(self, query, vector_db: VectorDB, k=3):
+    def retrieve_context_from_db(
+        self, query, vector_db: VectorDB, k=3, filters: dict = None, conversation: Conversation = None
+    ):
         """
         Retrieves relevant context chunks from the vector DB.
 
@@ -209,136 +245,459 @@ class ChatBot:
             query (str): User query.
             vector_db (VectorDB): The vector database object.
             k (int): Number of top-k chunks to retrieve.
+            filters (dict): Metadata filter of the chunks (see `src/filters.py`).
+            conversation (Conversation): Conversation where the context is loaded (the default one if not given).
 
         Returns:
             Tuple[str, list]: Context string and list of sources.
         """
-        context, sources = vector_db.retrieve_context(query, k=k)
+        conversation = conversation or self.conversation
+        context, sources = vector_db.retrieve_context(query, k=k, filters=filters)
         if len(context) > 0:
-            self.initialize_context(context=context)
-            self.current_sources = sources  # Store sources for later use
+            self.initialize_context(context=context, conversation=conversation)
+            conversation.context_embedding = None  # Unknown: the next turn of `refresh_context` retrieves it again
+            conversation.context_filters = filters or None
+            conversation.sources = sources  # Store sources for later use
             message = "Successfully loaded context."
         else:
             message = "No context found in the Database."
-            self.current_sources = []
+            conversation.sources = []
         print(message)
         return message, sources
         
-    def expand_query(self, query_en: str, max_expansions: int = 5, min_sim: float = 0.7) -> list[str]:
+    def expand_query(
+        self,
+        query_en: str,
+        max_expansions: int = 5,
+        min_sim: float = 0.7,
+        return_embeddings: bool = False,
+        synonyms: SynonymTable = None
+    ):
         """
         Expands a query using synonyms from WordNet and filters them based on cosine similarity.
+        The synonyms come from the precomputed table of the corpus (`synonyms`, e.g. `vector_db.synonyms`) or, for the
+        words that aren't in it, from memoized WordNet lookups. The embeddings of the variants are cached, so a
+        repeated expansion doesn't run the encoder again.
 
         Parameters:
             query_en (str): Query in English.
             max_expansions (int): Max number of expansions to return.
             min_sim (float): Minimum cosine similarity threshold.
+            return_embeddings (bool): Whether to also return the embeddings of the expansions, so they can be
+                reused for retrieval instead of encoding the same strings again.
+            synonyms (SynonymTable): Precomputed synonyms of the corpus.
 
         Returns:
             list[str]: Top similar expansions of the query.
+            list[list[float]]: Embeddings of the expansions (only if `return_embeddings` is True).
         """
-        STOP = self.STOPWORDS_EN
-        tokens = [t.strip(".,¡¿?;:()[]").lower() for t in query_en.split()]
-        targets = []
-
-        for w in tokens:
-            if len(w) >= 3 and w.isalpha() and w not in STOP:
-                if wordnet.synsets(w, pos=wordnet.NOUN, lang="eng"):
-                    targets.append((w, wordnet.NOUN))
-                if wordnet.synsets(w, pos=wordnet.VERB, lang="eng"):
-                    targets.append((w, wordnet.VERB))
-
+        lookup = synonyms.lookup if synonyms is not None else wordnet_lemmas
         variants = {query_en}
-
-        for word, pos in targets:
-            synsets = wordnet.synsets(word, pos=pos, lang="eng")[:3]
-            for syn in synsets:
-                for lemma in syn.lemma_names("eng"):
-                    lemma = lemma.replace("_", " ")
-                    if lemma.lower() == word:
-                        continue
-                    if pos == wordnet.NOUN and lemma.endswith("s") and lemma[:-1] == word:
-                        continue
-                    if not lemma.isalpha() or lemma in STOP:
-                        continue
+        for word in expandable_words(query_en, self.STOPWORDS_EN):
+            for lemmas in lookup(word):  # Noun and verb synonyms
+                for lemma in lemmas:
                     variants.add(query_en.replace(word, lemma))
 
-        orig_emb = self.ST_MODEL.encode(query_en, convert_to_tensor=True)
-        var_list = list(variants)
-        var_embs = self.ST_MODEL.encode(var_list, convert_to_tensor=True)
-        sims = util.cos_sim(orig_emb, var_embs)[0].tolist()
-        scored = sorted(zip(var_list, sims), key=lambda x: x[1], reverse=True)
+        # The query itself goes first, so it is kept first among the variants with the same similarity.
+        var_list = [query_en] + sorted(variants - {query_en})
+        var_embs = self._embed_variants(var_list)
+        sims = var_embs @ var_embs[0] / np.maximum(
+            np.linalg.norm(var_embs, axis=1) * np.linalg.norm(var_embs[0]), 1e-12
+        )
+
+        scored = sorted(enumerate(sims.tolist()), key=lambda x: x[1], reverse=True)
 
         final = []
-        for text, sim in scored:
+        final_embs = []
+        for i, sim in scored:
             if sim < min_sim:
                 break
-            final.append(text)
+            final.append(var_list[i])
+            final_embs.append(var_embs[i].tolist())
             if len(final) >= max_expansions:
                 break
 
         print("Expanded queries:", final)
+        if return_embeddings:
+            return final, final_embs
         return final
+
+    def _embed_variants(self, texts: list[str]) -> np.ndarray:
+        """
+        Embeddings of query variants, served from an LRU cache; only the missing ones are encoded (in one batch).
+        """
+        with self._variant_lock:
+            cached = {text: self._variant_embeddings.get(text) for text in texts}
+        missing = [text for text, embedding in cached.items() if embedding is None]
+        if missing:
+            cached.update(zip(missing, self.ST_MODEL.encode(missing, convert_to_numpy=True)))
+        with self._variant_lock:
+            for text, embedding in cached.items():
+                self._variant_embeddings[text] = embedding
+                self._variant_embeddings.move_to_end(text)
+            while len(self._variant_embeddings) > self.variant_cache_size:
+                self._variant_embeddings.popitem(last=False)
+        return np.stack([cached[text] for text in texts])
     
-    def translate_to_english(self, text: str) -> str:
-        """Translates any input text to English using GoogleTranslator."""
-        if self.translator:
+    def active_token_counter(self) -> TokenCounter:
+        """
+        Returns a token counter with the tokenizer of the model currently served by the LLM service (it can be switched
+        from the UI). The name of the model is asked to the /health of the service once and cached until
+        `refresh_llm_model` is called (after a switch). While the service can't be reached it is asked again every
+        `model_name_retry` seconds, and meanwhile the last known model (or the default generation model) is assumed.
+        """
+        now = time.monotonic()
+        if self._llm_model_stale and (
+            self._model_name_checked_at is None or now - self._model_name_checked_at > self.model_name_retry
+        ):
+            self._model_name_checked_at = now
             try:
-                return self.translator.translate(text)
-            except:
+                response = requests.get(self.llm.url + "/health", timeout=2)
+                model_name = response.json().get("model_name")
+                if model_name:
+                    self._llm_model_name = model_name
+                    self._llm_model_stale = False
+            except Exception:
                 pass
-        return text
+        model_name = self._llm_model_name or DEFAULT_TOKEN_MODEL
+        if model_name not in self._token_counters:
+            self._token_counters[model_name] = TokenCounter(model_name)
+        return self._token_counters[model_name]
+
+    def refresh_llm_model(self):
+        """
+        Makes the next `active_token_counter` call ask the LLM service for its model (e.g. after it was switched).
+        """
+        self._llm_model_stale = True
+        self._model_name_checked_at = None
+
+    def translate_to_english(self, text: str) -> str:
+        """Translates any input text to English (English texts and translation failures are returned as they are)."""
+        return self.translator.to_english(text)
     
-    def retrieve_context_from_db_with_reranking(self, query: str, vector_db: VectorDB, k_initial: int = 5, k_final: int = 3):
+    def retrieve_context_from_db_with_reranking(
+        self,
+        query: str,
+        vector_db: VectorDB,
+        k_initial: int = 5,
+        k_final: int = 3,
+        k_rerank: int = 50,
+        ef_search: int = None,
+        filters: dict = None,
+        conversation: Conversation = None,
+        query_embedding: list[float] = None
+    ):
         """
         Expands and reranks context chunks for a query using semantic similarity.
+        Candidates come from a hybrid (dense + BM25) search fused with Reciprocal Rank Fusion. Queries close enough to a
+        recent one with the same parameters get its context from `vector_db.query_cache` instead.
 
         Parameters:
             query (str): Original user query.
             vector_db (VectorDB): Vector store object.
-            k_initial (int): Chunks to retrieve per expansion.
-            k_final (int): Final chunks to keep after reranking.
+            k_initial (int): Chunks to retrieve per expansion and per retriever.
+            k_final (int): Max number of reranked chunks (picked with MMR) whose windows form the context, which is
+                kept within `self.context_token_budget` tokens.
+            k_rerank (int): Max number of fused candidates scored by the CrossEncoder.
+            ef_search (int): HNSW candidate list size of the dense search. Raising it improves the recall of the
+                `k_initial` candidates without growing the rerank set. Defaults to the one of the collection.
+            filters (dict): Metadata filter of the chunks (see `src/filters.py`), e.g. {"source": ["guide.pdf"]}.
+                The candidates are restricted before they are scored.
+            conversation (Conversation): Conversation where the context is loaded (the default one if not given).
+            query_embedding (list[float]): Embedding of the query, if it was already computed.
 
         Returns:
             Tuple[str, list]: Final context and selected top documents.
         """
-        query_en = self.translate_to_english(query)
-        expanded_queries = self.expand_query(query_en)
-
-        all_chunks = []
-        for q in expanded_queries:
-            _, chunks = vector_db.retrieve_context(q, k=k_initial)
-            all_chunks.extend(chunks)
+        # Paraphrases of a recent query reuse its context from the semantic cache of the vector DB. The cache is first
+        # looked up with the original query (without waiting for the translation) and then with its English
+        # translation.
+        conversation = conversation or self.conversation
+        token_counter = self.active_token_counter()
+        scope = json.dumps(
+            [k_initial, k_final, k_rerank, ef_search, filters, self.context_token_budget, token_counter.model_name],
+            sort_keys=True
+        )
 
-        if not all_chunks:
+        # The stages run as a DAG (see `src/pipeline.py`). The embedding, the language detection and the filter don't
+        # depend on each other. An English query isn't translated, so its own (dense and sparse) search starts right
+        # away, while it is expanded, and only the other expansions are searched afterwards.
+        def search_original(retriever):
+            def stage(embed, detect, allowed):
+                if detect != "en":
+                    return None
+                if retriever == "dense":
+                    if embed is None:
+                        return None
+                    return vector_db.retrieve_batch(
+                        embeddings=[embed], k=k_initial, ef_search=ef_search, filters=filters
+                    )
+                return vector_db.sparse_search([query], k=k_initial, allowed=allowed)
+            return stage
+
+        def expansions(expand, translate, detect):
+            # The original query is the first expansion, already searched if it's English.
+            queries, embeddings = expand if expand is not None else ([translate], None)
+            skip = 1 if detect == "en" else 0
+            return queries[skip:], embeddings[skip:] if embeddings is not None else None
+
+        def search_expansions(retriever):
+            def stage(expand, translate, detect, allowed):
+                queries, embeddings = expansions(expand, translate, detect)
+                if not queries:
+                    return []
+                if retriever == "dense":
+                    return vector_db.retrieve_batch(
+                        queries, embeddings=embeddings, k=k_initial, ef_search=ef_search, filters=filters
+                    )
+                return vector_db.sparse_search(queries, k=k_initial, allowed=allowed)
+            return stage
+
+        def fuse(dense_original, sparse_original, dense_expansions, sparse_expansions):
+            dense = vector_db.merge_dense_results(dense_original or [], dense_expansions)
+            return vector_db.fuse_results(dense, (sparse_original or []) + sparse_expansions)
+
+        def rerank(fuse, translate):
+            candidates = self._unique_chunks(fuse)[:k_rerank]
+            return candidates, self.reranker.score(translate, candidates)
+
+        timeouts = self.stage_timeouts
+        pipeline = Pipeline(self._pipeline_executor, [
+            Stage(
+                "embed",
+                lambda: query_embedding if query_embedding is not None else vector_db.embeddings.embed_query(query),
+                timeout=timeouts["embed"], fallback=None
+            ),
+            Stage(
+                "cache",
+                lambda embed: vector_db.query_cache.get(embed, scope) if embed is not None else None,
+                deps=("embed",), timeout=timeouts["cache"], fallback=None
+            ),
+            Stage("detect", lambda: self.translator.detect_language(query), timeout=timeouts["detect"], fallback=None),
+            Stage(
+                "translate", lambda detect: self.translate_to_english(query),
+                deps=("detect",), timeout=timeouts["translate"], fallback=query
+            ),
+            Stage("allowed", lambda: vector_db.allowed_ids(filters), timeout=timeouts["allowed"]),
+            Stage(
+                "dense_original", search_original("dense"),
+                deps=("embed", "detect", "allowed"), timeout=timeouts["search"], fallback=None
+            ),
+            Stage(
+                "sparse_original", search_original("sparse"),
+                deps=("embed", "detect", "allowed"), timeout=timeouts["search"], fallback=None
+            ),
+            # The expansions are embedded with the same model as the vector store, so their embeddings are reused and
+            # every expansion is searched in a single batched query.
+            Stage(
+                "expand",
+                lambda translate: self.expand_query(translate, return_embeddings=True, synonyms=vector_db.synonyms),
+                deps=("translate",), timeout=timeouts["expand"], fallback=None
+            ),
+            Stage(
+                "cache_en",
+                lambda translate, expand: (
+                    vector_db.query_cache.get(expand[1][0], scope) if translate != query and expand and expand[1]
+                    else None
+                ),
+                deps=("translate", "expand"), timeout=timeouts["cache"], fallback=None
+            ),
+            Stage(
+                "dense_expansions", search_expansions("dense"),
+                deps=("expand", "translate", "detect", "allowed"), timeout=timeouts["search"], fallback=[]
+            ),
+            Stage(
+                "sparse_expansions", search_expansions("sparse"),
+                deps=("expand", "translate", "detect", "allowed"), timeout=timeouts["search"], fallback=[]
+            ),
+            Stage(
+                "fuse", fuse,
+                deps=("dense_original", "sparse_original", "dense_expansions", "sparse_expansions"),
+                timeout=timeouts["fuse"], fallback=[]  # No candidates: the answer is given without context.
+            ),
+            # Without the CrossEncoder (timeout or error) the candidates keep their fused order.
+            Stage("rerank", rerank, deps=("fuse", "translate"), timeout=timeouts["rerank"], fallback=None),
+        ])
+        results = pipeline.run(stop=lambda results: results.get("cache") or results.get("cache_en"))
+        conversation.stage_timings = pipeline.timings
+
+        cached = results.get("cache") or results.get("cache_en")
+        if cached is not None:
+            final_context, topk = cached
+            self.initialize_context(final_context, conversation)
+            conversation.context_embedding = results.get("embed")
+            conversation.context_filters = filters or None
+            conversation.sources = topk
+            print("Loaded context from the query cache.")
+            return final_context, topk
+
+        if not results["fuse"]:
             print("No context found in the Database.")
-            self.current_sources = []
+            conversation.sources = []
             return "", []
 
+        if results["rerank"] is not None:
+            candidates, scores = results["rerank"]
+        else:
+            candidates = self._unique_chunks(results["fuse"])[:k_rerank]
+            scores = [chunk["score"] for chunk in candidates]
+
+        ranked = sorted(zip(scores, candidates), key=lambda x: x[0], reverse=True)
+
+        # MMR picks the final chunks among the best reranked ones, and the packer merges their windows into a context
+        # that fits the token budget of the active model.
+        mmr_candidates = ranked[:3 * k_final]
+        final_context, topk = vector_db.context_packer.pack(
+            [chunk for _, chunk in mmr_candidates],
+            scores=[float(score) for score, _ in mmr_candidates],
+            k=k_final,
+            token_budget=self.context_token_budget,
+            token_counter=token_counter
+        )
+
+        cache_keys = [results["embed"]] if results["embed"] is not None else []
+        if results["translate"] != query and results["expand"] and results["expand"][1]:
+            cache_keys.append(results["expand"][1][0])
+        if cache_keys:
+            vector_db.query_cache.put(cache_keys, (final_context, topk), scope)
+        self.initialize_context(final_context, conversation)
+        conversation.context_embedding = results["embed"]
+        conversation.context_filters = filters or None
+        conversation.sources = topk
+
+        print("Successfully loaded context after re-ranking.")
+        return final_context, topk
+
+    def refresh_context(
+        self, query: str, vector_db: VectorDB, filters: dict = None, conversation: Conversation = None
+    ) -> str:
+        """
+        Loads the context for a new turn of a conversation, retrieving it again only when the topic has changed.
+
+        The embedding of the query is compared with the one of the query that retrieved the current context. If their
+        cosine distance (the drift) exceeds `self.context_drift_threshold` the context is retrieved again with
+        `retrieve_context_from_db_with_reranking`. Otherwise it's reused and topped up with the best
+        `self.context_topup_k` chunks of a dense search of the new query that aren't in it yet, within the token
+        budget. The reused context keeps the embedding of the query that retrieved it, so a conversation that drifts
+        slowly is also refreshed eventually. The filters are part of the scope of the context: a turn whose filters
+        differ from the ones the context was retrieved with always retrieves it again, and the top-up search uses them.
+
+        Parameters:
+            query (str): User query of the new turn.
+            vector_db (VectorDB): Vector store object.
+            filters (dict): Metadata filter of the chunks (see `src/filters.py`).
+            conversation (Conversation): Conversation whose context is refreshed (the default one if not given).
+
+        Returns:
+            str: Path taken: "initial", "filtered" (the filters changed), "refresh", "reuse" or "topup".
+        """
+        conversation = conversation or self.conversation
+        filters = filters or None
+        if self.has_context(conversation) and (
+            json.dumps(filters, sort_keys=True) != json.dumps(conversation.context_filters, sort_keys=True)
+        ):
+            self.retrieve_context_from_db_with_reranking(query, vector_db, filters=filters, conversation=conversation)
+            return self._count_refresh("filtered")
+
+        try:
+            embedding = vector_db.embeddings.embed_query(query)
+        except Exception as e:
+            print(f"[WARN] The query couldn't be embedded: {e}")
+            embedding = None
+        if not self.has_context(conversation) or conversation.context_embedding is None:
+            if embedding is None and self.has_context(conversation):
+                return self._count_refresh("reuse")
+            self.retrieve_context_from_db_with_reranking(
+                query, vector_db, filters=filters, conversation=conversation, query_embedding=embedding
+            )
+            return self._count_refresh("initial")
+        if embedding is None:
+            return self._count_refresh("reuse")
+
+        query_vector = np.asarray(embedding, dtype=np.float32)
+        anchor = np.asarray(conversation.context_embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(query_vector) * np.linalg.norm(anchor))
+        drift = 1.0 - float(query_vector @ anchor) / norm if norm else 1.0
+        if drift > self.context_drift_threshold:
+            self.retrieve_context_from_db_with_reranking(
+                query, vector_db, filters=filters, conversation=conversation, query_embedding=embedding
+            )
+            return self._count_refresh("refresh", drift)
+
+        added = self._top_up_context(embedding, vector_db, conversation) if self.context_topup_k > 0 else 0
+        return self._count_refresh("topup" if added else "reuse", drift, added)
+
+    def _top_up_context(self, embedding: list[float], vector_db: VectorDB, conversation: Conversation) -> int:
+        """
+        Appends to the context of a conversation the best dense hits of a query that aren't in it yet, while it fits
+        the token budget. Returns the number of chunks added.
+        """
+        token_counter = self.active_token_counter()
+        remaining = self.context_token_budget - token_counter.count([conversation.context])[0]
+        if remaining <= 0:
+            return 0
+        known = {source.get("id") for source in conversation.sources}
+        hits = [
+            hit for hit in vector_db.retrieve_batch(
+                embeddings=[embedding], k=self.context_topup_k, filters=conversation.context_filters
+            )
+            if hit["id"] not in known
+        ]
+        pieces, added = [], []
+        for hit in hits:
+            text, packed = vector_db.context_packer.pack(
+                [hit], k=1, token_budget=remaining, window=0, token_counter=token_counter
+            )
+            # The hit may already be in the context as a neighbor of one of its hits.
+            if not packed or text in conversation.context:
+                continue
+            pieces.append(text)
+            added.extend(packed)
+            remaining -= token_counter.count([text])[0]
+        if pieces:
+            conversation.context = SEPARATOR.join([conversation.context, *pieces])
+            conversation.sources = conversation.sources + added
+        return len(added)
+
+    def _count_refresh(self, path: str, drift: float = None, topup_chunks: int = 0) -> str:
+        with self._refresh_lock:
+            self._refresh_counts[path] += 1
+            self._refresh_counts["topup_chunks"] += topup_chunks
+            if drift is not None:
+                self._drift_sum += drift
+                self._drift_count += 1
+        return path
+
+    def refresh_stats(self) -> dict:
+        """
+        Counters of the paths taken by `refresh_context`, and the mean drift of the turns that had a context.
+        """
+        with self._refresh_lock:
+            counts = dict(self._refresh_counts)
+            turns = sum(counts[path] for path in ("initial", "filtered", "refresh", "reuse", "topup"))
+            retrievals = counts["initial"] + counts["filtered"] + counts["refresh"]
+            return {
+                **counts,
+                "turns": turns,
+                "retrieval_rate": round(retrievals / turns, 4) if turns else 0.0,
+                "mean_drift": round(self._drift_sum / self._drift_count, 4) if self._drift_count else None,
+                "drift_threshold": self.context_drift_threshold,
+                "topup_k": self.context_topup_k,
+            }
+
+    @staticmethod
+    def _unique_chunks(chunks: list[dict]) -> list[dict]:
+        """
+        Drops the chunks whose content was already seen (keeping the first one).
+        """
         seen = set()
         unique_chunks = []
-        for chunk in all_chunks:
+        for chunk in chunks:
             txt = chunk["content"]
             if txt not in seen:
                 seen.add(txt)
                 unique_chunks.append(chunk)
-
-        candidates = unique_chunks[:50]
-        pairs = [(query_en, chunk["content"]) for chunk in candidates]
-        scores = self.re_ranker.predict(pairs)
-
-        ranked = [chunk for _, chunk in sorted(zip(scores, candidates), key=lambda x: x[0], reverse=True)]
-        topk = ranked[:k_final]
-
-        joined_chunks = []
-        for doc in topk:
-            joined_chunks.append(vector_db._search_nearby_chunks(doc, 4))
-        final_context = "\n\n---\n\n".join(joined_chunks)
-
-        self.initialize_context(final_context)
-        self.current_sources = topk
-
-        print("Successfully loaded context after re-ranking.")
-        return final_context, topk  
+        return unique_chunks
 
     def __call__(self, message: str):
         self.infer(message=message)
@@ -0,0 +1,200 @@
+"""
+Token-budgeted assembly of the context sent to the LLM.
+
+Retrieved hits are expanded with their neighbor chunks, but instead of joining a fixed window around every hit:
+- hits are picked by relevance with MMR (Maximal Marginal Relevance), so near-duplicate hits don't fill the context,
+- windows of the same document that overlap or touch are merged into a single span, so no text is sent twice,
+- the context grows chunk by chunk around every hit until the token budget of the active model is used.
+"""
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from src.models import registry
+from src.cache import text_hash
+
+# Tokenizer used to count the tokens of the chunks at ingest time (the generation model served by default).
+DEFAULT_TOKEN_MODEL = os.getenv("MODEL_NAME", "meta-llama/Llama-3.2-3B-Instruct")
+# Default number of tokens of the context.
+DEFAULT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+
+SEPARATOR = "\n\n---\n\n"
+
+
+class TokenCounter:
+    def __init__(self, model_name: str = DEFAULT_TOKEN_MODEL):
+        """
+        Counts tokens with the tokenizer of `model_name` (shared through the model registry). If the tokenizer can't
+        be loaded (e.g. a gated model without token), tokens are estimated as 1 every 4 characters.
+        """
+        self.model_name = model_name
+        try:
+            self.tokenizer = registry.tokenizer(model_name)
+        except Exception as e:
+            print(f"[WARN] Tokenizer {model_name} not loaded, estimating token counts: {e}")
+            self.tokenizer = None
+
+    def count(self, texts: list[str]) -> list[int]:
+        if not texts:
+            return []
+        if self.tokenizer is None:
+            return [len(text) // 4 + 1 for text in texts]
+        return [len(ids) for ids in self.tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+
+
+class ContextPacker:
+    def __init__(self, vector_db, window: int = 4, mmr_lambda: float = 0.7, token_cache_size: int = 100000):
+        """
+        Parameters
+        ----------
+        vector_db : VectorDB
+            Vector database whose neighbor index provides the chunks around every hit.
+        window : int
+            Default max number of chunks added at each side of a hit.
+        mmr_lambda : float
+            Trade-off between relevance (1.0) and diversity (0.0) when picking hits.
+        token_cache_size : int
+            Max number of chunk token counts cached for tokenizers other than the one of the ingestion.
+        """
+        self.vector_db = vector_db
+        self.window = window
+        self.mmr_lambda = mmr_lambda
+        # {(tokenizer, source, chunk_idx, content hash): number of tokens}, least recently used first. The content is
+        # part of the key (like in the chunk ids), so a re-ingested chunk is counted again.
+        self._token_cache = OrderedDict()
+        self.token_cache_size = token_cache_size
+        self._token_lock = threading.Lock()
+
+    def _chunk_tokens(self, token_counter, source, chunk_idx, text):
+        """
+        Number of tokens of a chunk: the count stored at ingest time if it was made with the same tokenizer,
+        otherwise it is counted (and cached).
+        """
+        if token_counter.model_name == self.vector_db.token_counter.model_name:
+            n_tokens = self.vector_db._chunk_tokens.get(source, {}).get(chunk_idx)
+            if n_tokens is not None:
+                return n_tokens
+        key = (token_counter.model_name, source, chunk_idx, text_hash(text))
+        with self._token_lock:
+            n_tokens = self._token_cache.get(key)
+            if n_tokens is not None:
+                self._token_cache.move_to_end(key)
+                return n_tokens
+        n_tokens = token_counter.count([text])[0]
+        with self._token_lock:
+            self._token_cache[key] = n_tokens
+            while len(self._token_cache) > self.token_cache_size:
+                self._token_cache.popitem(last=False)
+        return n_tokens
+
+    def select(self, hits: list[dict], scores: list[float], k: int) -> list[dict]:
+        """
+        Picks up to `k` hits with MMR: every step takes the hit that maximizes
+        `mmr_lambda * relevance - (1 - mmr_lambda) * max similarity to the hits already picked`,
+        where relevance is the min-max normalized score and similarity the cosine of the chunk embeddings.
+        """
+        if len(hits) <= 1 or self.mmr_lambda >= 1.0:
+            return hits[:k]
+        scores = np.asarray(scores, dtype=np.float32)
+        relevance = (scores - scores.min()) / (scores.max() - scores.min() + 1e-9)
+
+        ids = [hit.get("id") for hit in hits]
+        embeddings = self.vector_db._get_embeddings([i for i in ids if i is not None])
+        dim = len(next(iter(embeddings.values()))) if embeddings else 1
+        vectors = np.stack([np.asarray(embeddings.get(i, np.zeros(dim)), dtype=np.float32) for i in ids])
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        similarities = vectors @ vectors.T
+
+        selected = [int(np.argmax(relevance))]
+        remaining = [i for i in range(len(hits)) if i != selected[0]]
+        while remaining and len(selected) < k:
+            redundancy = similarities[np.ix_(remaining, selected)].max(axis=1)
+            mmr = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+            best = remaining[int(np.argmax(mmr))]
+            selected.append(best)
+            remaining.remove(best)
+        return [hits[i] for i in selected]
+
+    def pack(
+        self,
+        hits: list[dict],
+        scores: list[float] = None,
+        k: int = 3,
+        token_budget: int = DEFAULT_TOKEN_BUDGET,
+        window: int = None,
+        token_counter: TokenCounter = None
+    ):
+        """
+        Builds the context from the hits, within `token_budget` tokens.
+
+        Parameters
+        ----------
+        hits : list[dict]
+            Source dicts of the candidate hits (with "metadata" and, for MMR, "id").
+        scores : list[float], optional
+            Relevance of every hit (e.g. CrossEncoder scores). Defaults to the order of `hits`.
+        k : int
+            Max number of hits in the context.
+        token_budget : int
+            Max number of tokens of the context.
+        window : int, optional
+            Max number of chunks added at each side of a hit. Defaults to `self.window`.
+        token_counter : TokenCounter, optional
+            Counter with the tokenizer of the model that will read the context. Defaults to the ingest tokenizer.
+
+        Returns
+        -------
+        tuple[str, list[dict]]
+            The context and the hits it contains, in order of relevance.
+        """
+        if not hits:
+            return "", []
+        if scores is None:
+            scores = [-rank for rank in range(len(hits))]
+        window = self.window if window is None else window
+        token_counter = token_counter or self.vector_db.token_counter
+        selected = self.select(hits, scores, k)
+
+        metadatas = [self.vector_db._chunk_metadata(hit) for hit in selected]
+        self.vector_db._load_sources([metadata["source"] for metadata in metadatas])
+
+        used_tokens = 0
+        included = {}  # {source: set of chunk indexes}, in order of first appearance
+        packed_hits = []
+        for hit, metadata in zip(selected, metadatas):
+            source = metadata["source"]
+            chunks = self.vector_db._chunk_index.get(source, {})
+            center = int(float(metadata.get("chunk_idx", 0)))
+            # The hit first, then its neighbors from the closest to the farthest.
+            order = [center]
+            for offset in range(1, window + 1):
+                order.extend([center - offset, center + offset])
+
+            indexes = included.setdefault(source, set())
+            for idx in order:
+                if idx not in chunks or idx in indexes:
+                    continue
+                n_tokens = self._chunk_tokens(token_counter, source, idx, chunks[idx])
+                if used_tokens + n_tokens > token_budget:
+                    break  # Stop growing this window, so it stays contiguous.
+                indexes.add(idx)
+                used_tokens += n_tokens
+            if center in indexes:
+                packed_hits.append(hit)
+
+        overlap = self.vector_db.text_splitter._chunk_overlap
+        spans = []
+        for source, indexes in included.items():
+            chunks = self.vector_db._chunk_index.get(source, {})
+            span = []
+            for idx in sorted(indexes):
+                if span and idx == span[-1][0] + 1:
+                    span.append((idx, chunks[idx][overlap:]))  # Remove the overlap with the previous chunk
+                else:
+                    if span:
+                        spans.append("".join(text for _, text in span))
+                    span = [(idx, chunks[idx])]
+            if span:
+                spans.append("".join(text for _, text in span))
+        return SEPARATOR.join(spans), packed_hits
@@ -1,165 +1,697 @@
 # Import required libraries
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
-from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from src.models import SharedEmbeddings, EMBEDDING_MODEL_NAME
+from src.bm25 import BM25Index, reciprocal_rank_fusion
+from src.ingestion import IngestionPipeline, file_sha256, iter_chunk_batches, CHUNKING_VERSION
+from src.cache import EmbeddingCache, SemanticQueryCache, text_hash
+from src.catalog import DocumentCatalog
+from src.context import ContextPacker, TokenCounter, DEFAULT_TOKEN_MODEL, DEFAULT_TOKEN_BUDGET
+from src.quantization import QuantizedIndex, parse_spec
+from src.backends import make_backend, hnsw_from_env, DEFAULT_BACKEND
+from src.filters import build_where, detect_language, tag_metadata, TAG_PREFIX
+from src.synonyms import SynonymTable
+
+PERSIST_DIRECTORY = "db"  # Default folder of the vector store and of its caches
+
+def make_chunk_id(source, chunk_idx, text):
+    """
+    Deterministic id of a chunk, derived from its source, its position in the source and its content. Ingesting the
+    same chunk again always yields the same id, so it is upserted in place instead of duplicated.
+    """
+    key = f"{source}\x00{int(chunk_idx)}\x00{text_hash(text)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
 
 # Class to handle vector database logic
 class VectorDB:
-    def __init__(self, persist_directory = "db"):
+    def __init__(
+        self,
+        persist_directory = PERSIST_DIRECTORY,
+        token_model = DEFAULT_TOKEN_MODEL,
+        quantization = None,
+        backend = DEFAULT_BACKEND,
+        hnsw = None
+    ):
         """
         Initialize the vector store with:
         - a persistence directory to save vectors
-        - a sentence-transformer model for embedding
-        - a Chroma store to persist vectorized documents
-        - a text splitter to chunk text
+        - a sentence-transformer model for embedding (shared through the model registry), with a persistent cache of
+          chunk embeddings
+        - a storage backend to persist vectorized documents (`backend`: "chroma" or "numpy", see `src/backends.py`),
+          with the HNSW parameters `hnsw` ({"M", "ef_construction", "ef_search"}, from the `HNSW_*` environment
+          variables by default) for Chroma
+        - a text splitter to chunk text, and a tokenizer (of `token_model`) to store the token count of every chunk
+        - a context packer that assembles retrieved chunks into a token-budgeted context
+        - a BM25 sparse index persisted next to the vector store, for hybrid retrieval
+        - a catalog of the stored documents (chunk ids, pages, size, content hash...), so listing, counting and
+          deleting documents don't scan the collection and unchanged files aren't ingested again
+        - optionally (`quantization`, e.g. "int8" or "binary:256:pca", see `src/quantization.py`), a compact quantized
+          copy of the embeddings used for the dense search instead of the HNSW index, rescored with full-precision
+          vectors stored on disk
+        - a table of the WordNet synonyms of the words of the corpus, filled at ingest time for the query expansion
+        - a semantic cache of retrieval results (`query_cache`, see `src/cache.py`), cleared whenever chunks are
+          written, deleted or retagged
         """
         self.persist_directory = persist_directory
-        self.embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
         
         os.makedirs(self.persist_directory, exist_ok = True )
+
+        self.embeddings = SharedEmbeddings(
+            EMBEDDING_MODEL_NAME,
+            cache=EmbeddingCache(os.path.join(self.persist_directory, "embedding_cache.sqlite3"))
+        )
         
         # Create or load the vector store from the given directory
-        self.vector_store = Chroma(
-            collection_name="example_collection",
-            embedding_function=self.embeddings, 
-            persist_directory = self.persist_directory
+        self.backend = make_backend(
+            backend, self.persist_directory, self.embeddings, hnsw=hnsw_from_env() if hnsw is None else hnsw
         )
         # Split long text into overlapping chunks
         self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+        self.token_counter = TokenCounter(token_model)
+        self.context_packer = ContextPacker(self)
+
+        # In-memory neighbor index {source: {chunk_idx: text}}. It is built once on load and kept up to date by
+        # `upload_document` and `delete_document`, so expanding a hit with its nearby chunks is a dict lookup instead
+        # of a vector store scan over the whole PDF.
+        self._chunk_index = {}
+        # Token counts {source: {chunk_idx: n_tokens}} stored at ingest time with the tokenizer of `token_model`.
+        self._chunk_tokens = {}
+
+        # Sparse index over the same chunks, keyed by their chunk ids. Dense and sparse searches run in parallel.
+        self.sparse_index = BM25Index(os.path.join(self.persist_directory, "bm25.sqlite3"))
+        self._search_executor = ThreadPoolExecutor(max_workers=2)
+        # Synonyms of the vocabulary of the stored chunks, so expanding a query doesn't query WordNet.
+        self.synonyms = SynonymTable(os.path.join(self.persist_directory, "synonyms.sqlite3"))
+
+        if quantization is None:
+            quantization = os.getenv("VECTOR_QUANTIZATION")
+        quantization = parse_spec(quantization) if isinstance(quantization, str) else quantization
+        self.quantized_index = None
+        if quantization:
+            self.quantized_index = QuantizedIndex(os.path.join(self.persist_directory, "quantized"), **quantization)
+
+        # Chunk ids, pages, size, content hash and splitter settings of every ingested file.
+        self.catalog = DocumentCatalog(os.path.join(self.persist_directory, "catalog.sqlite3"))
+
+        # Final contexts of recent queries, looked up by query embedding. Any change of the stored chunks clears it.
+        self.query_cache = SemanticQueryCache()
+
+        self._build_chunk_index()
     
-    def upload_document(self, path_to_single_document):
+    def close(self):
+        """
+        Releases the models this object holds in the model registry and saves the quantized index.
+        """
+        self.embeddings.close()
+        if self.quantized_index is not None:
+            self.quantized_index.close()
+
+    def upload_document(self, path_to_single_document, embed_batch_size=256, tags=None, progress=None):
         """
         Load a single PDF document, split it into chunks, and add them to the vector store.
-        Adds 'chunk_idx' metadata to each chunk for tracking and reordering.
+        Adds 'chunk_idx' and 'page' metadata to each chunk for tracking and reordering.
+        The pages are streamed into the splitter and the chunks are embedded and written in batches of
+        `embed_batch_size`, so memory is bounded by the size of a page and of a batch, not of the document.
+        If the same content was already ingested it is skipped; if the file changed, its previous version is replaced.
+        `tags` are custom tags attached to the document, to filter the retrieval (None keeps the current ones).
+        `progress(pages_parsed, total_pages, chunks_embedded)` is called after every batch, if given.
+
+        Returns
+        -------
+        bool
+            Whether the document is stored (ingested or already up to date).
         """
-        loader = PyPDFLoader(path_to_single_document, mode="single")
+        sha256 = file_sha256(path_to_single_document)
+        if sha256 == self.catalog.current_sha256(path_to_single_document, self.splitter_settings()):
+            if tags is not None and sorted(tags) != self.catalog.tags(path_to_single_document):
+                self._set_source_tags(path_to_single_document, tags)
+                print(f"Document: {path_to_single_document} is already up to date. Its tags were updated.")
+            else:
+                print(f"Document: {path_to_single_document} is already up to date.")
+            return True
+        if tags is None:
+            tags = self.catalog.tags(path_to_single_document)
+
+        ids = []
+        written = []
+        pages = None
         try:
-            documents = loader.load()
+            for texts, metadatas in iter_chunk_batches(path_to_single_document, self.text_splitter, embed_batch_size):
+                metadatas = [dict(metadata, **tag_metadata(tags)) for metadata in metadatas]
+                batch_ids, batch_written = self._add_chunks(texts, metadatas)
+                ids.extend(batch_ids)
+                written.extend(batch_written)
+                pages = metadatas[0].get("total_pages")
+                if progress is not None:
+                    # The last chunk of the batch starts on the last page read so far.
+                    progress(metadatas[-1].get("page", 0) + 1, pages, len(ids))
         except Exception as e:
             print(f"Document: {path_to_single_document} couldn't be generated.\nError: {e}.\n\n")
-            return None
-        
-        # Split the document into chunks
-        docs = self.text_splitter.split_documents(documents)
-
-        for idx, doc in enumerate(docs):
-            # We add the chunk id as part of the metadata to save which part of the document this chunk is.
-            doc.metadata["chunk_idx"] = idx
-        # Store docs into Chroma - persistence is automatic now
-        if len(docs) > 0:
-            self.vector_store.add_documents(docs)
-        
-    def upload_documents(self, documents_paths):
+            # The previous version (if any) is kept: remove the chunks written so far.
+            self._delete_chunks(written)
+            return False
+        self._replace_document(path_to_single_document, sha256, ids, pages=pages, tags=tags)
+        if progress is not None:
+            progress(pages or 0, pages, len(ids))
+        return True
+
+    def upload_documents(
+        self, documents_paths, workers=None, embed_batch_size=256, multi_process_encoding=False, tags=None
+    ):
+        """
+        Upload multiple PDF documents, given either a folder or a list of paths, with the parallel ingestion pipeline
+        (see `src/ingestion.py`): PDFs are parsed in a process pool, embedded in large batches and written in bulk.
+        `tags` are attached to all the documents (None keeps the current tags of the documents already stored).
+
+        Returns
+        -------
+        IngestionStats
+            Per-stage throughput and failures of the run.
+        """
+        if isinstance(documents_paths, str):
+            documents_paths = [os.path.join(documents_paths, path) for path in sorted(os.listdir(documents_paths))]
+        documents_paths = list(dict.fromkeys(documents_paths))
+        pipeline = IngestionPipeline(
+            self,
+            workers=workers,
+            embed_batch_size=embed_batch_size,
+            multi_process_encoding=multi_process_encoding,
+            tags=tags
+        )
+        stats = pipeline.run(documents_paths)
+        stats.report()
+        return stats
+
+    def splitter_settings(self):
+        """
+        Settings of the text splitter. Files chunked with other settings are ingested again.
         """
-        Upload multiple PDF documents from a given folder.
+        return {
+            "chunk_size": self.text_splitter._chunk_size,
+            "chunk_overlap": self.text_splitter._chunk_overlap,
+            "chunking": CHUNKING_VERSION
+        }
+
+    def _replace_document(self, source, sha256, ids, pages=None, tags=None):
+        """
+        Make the chunks `ids` (already written) the current version of `source`: the chunks of its previous version
+        that aren't part of the new one (changed chunks and the stale tail of a document that got shorter) are deleted
+        only now, so the document is never missing from the store while it is being re-ingested.
+        If the tags of the document changed, the chunks kept from the previous version get the new ones.
+        """
+        previous = self.catalog.get(source)
+        if previous is not None:
+            new_ids = set(ids)
+            self._delete_chunks([chunk_id for chunk_id in previous["ids"] if chunk_id not in new_ids])
+            if tags is not None and sorted(tags) != previous["tags"]:
+                self._update_tag_metadata(ids, previous["tags"], tags)
+            # Reload the neighbor index of the source, which may still hold chunks of the previous version.
+            self._chunk_index.pop(source, None)
+            self._chunk_tokens.pop(source, None)
+            self._load_sources([source])
+        size_bytes = os.path.getsize(source) if os.path.exists(source) else None
+        self.catalog.set(source, sha256, self.splitter_settings(), ids, pages=pages, size_bytes=size_bytes, tags=tags)
+
+    def _update_tag_metadata(self, ids, old_tags, new_tags):
+        """
+        Replace the tags `old_tags` of the chunks `ids` by `new_tags` in their metadata.
+        """
+        # Chroma can't remove metadata keys in an update, so removed tags are set to False (filters match True).
+        update = {TAG_PREFIX + tag: False for tag in old_tags if tag not in new_tags}
+        update.update(tag_metadata(new_tags))
+        if ids and update:
+            self.backend.update_metadatas(ids, [dict(update) for _ in ids])
+            self.query_cache.clear()
+
+    def _set_source_tags(self, source, tags):
+        entry = self.catalog.get(source)
+        self._update_tag_metadata(entry["ids"], entry["tags"], tags)
+        self.catalog.set_tags(source, tags)
+
+    def set_document_tags(self, filename, tags):
         """
-        for path in os.listdir(documents_paths):
-            self.upload_document(os.path.join(documents_paths, path))
+        Replace the tags of a document (by filename), used to filter the retrieval.
+        """
+        sources = self.catalog.sources_for_filename(filename)
+        if not sources:
+            print(f"No document found with filename: {filename}")
+            return False
+        for source in sources:
+            self._set_source_tags(source, tags)
+        return True
+
+    def _delete_chunks(self, ids):
+        """
+        Delete chunks from the vector store and from the sparse (and quantized) index.
+        """
+        self.backend.delete(ids)
+        self.sparse_index.remove(ids)
+        if self.quantized_index is not None:
+            self.quantized_index.remove(ids)
+        if ids:
+            self.query_cache.clear()
+
+    def _add_chunks(self, texts, metadatas):
+        """
+        Upsert chunks: only the chunks that aren't already stored (by their deterministic id) are embedded and written.
+
+        Returns
+        -------
+        tuple[list[str], list[str]]
+            Ids of all the given chunks and ids of the chunks that were written.
+        """
+        ids = self._chunk_ids(texts, metadatas)
+        new = self._new_chunk_positions(ids)
+        if new:
+            embeddings = self.embeddings.embed_documents([texts[i] for i in new])
+            self._write_chunks(
+                [ids[i] for i in new], [texts[i] for i in new], [metadatas[i] for i in new], embeddings
+            )
+        return ids, [ids[i] for i in new]
+
+    @staticmethod
+    def _chunk_ids(texts, metadatas):
+        return [make_chunk_id(metadata["source"], metadata["chunk_idx"], text) for text, metadata in zip(texts, metadatas)]
+
+    def _new_chunk_positions(self, ids):
+        """
+        Positions in `ids` of the chunks that aren't stored yet.
+        """
+        existing = set(self.backend.get(ids=list(dict.fromkeys(ids)), include=[])["ids"])
+        return [i for i, chunk_id in enumerate(ids) if chunk_id not in existing]
+
+    def _write_chunks(self, ids, texts, metadatas, embeddings):
+        """
+        Upsert embedded chunks into the vector store in bulk and register them in the neighbor and sparse indexes.
+        The token count and the language of every chunk are stored in its metadata.
+        """
+        n_tokens = self.token_counter.count(texts)
+        metadatas = [
+            dict(metadata, n_tokens=count, n_tokens_model=self.token_counter.model_name)
+            for metadata, count in zip(metadatas, n_tokens)
+        ]
+        for text, metadata in zip(texts, metadatas):
+            # The language of every chunk is stored so the retrieval can be filtered by language.
+            language = metadata.get("language") or detect_language(text)
+            if language:
+                metadata["language"] = language
+        self.backend.upsert(ids, embeddings, texts, metadatas)
+        self._index_chunks(texts, metadatas)
+        self.sparse_index.add(ids, texts)
+        self._add_synonyms(texts)
+        if self.quantized_index is not None:
+            self.quantized_index.add(ids, embeddings)
+        self.query_cache.clear()
             
-    def retrieve_context(self, query, k=3, chunk_window_size=4):
+    def _add_synonyms(self, texts):
+        # The synonyms are an optimization of the query expansion: if WordNet isn't available the ingestion goes on,
+        # and the missing words are looked up in WordNet when they are queried.
+        try:
+            self.synonyms.add_texts(texts)
+        except Exception as e:
+            print(f"[WARN] Synonyms of the chunks not stored: {e}")
+
+    def retrieve_context(self, query, k=3, chunk_window_size=4, token_budget=DEFAULT_TOKEN_BUDGET, filters=None):
         """
         Retrieve top-k most relevant chunks for the query, and expand them with nearby chunks.
+        The windows are merged when they overlap and the whole context is kept within `token_budget` tokens.
+        Only chunks that match `filters` (source, page, language and tags, see `src/filters.py`) are retrieved.
         Also return a short source preview for reference.
         """
-        docs = self.vector_store.similarity_search(query, k=k)
-        joined_chunks = []
-        for doc in docs:
-            joined_chunks.append(self._search_nearby_chunks(doc, chunk_window_size))
-        context = "\n\n---\n\n".join(joined_chunks)
-        
-        # Extract source information from documents
-        sources = []
-        for doc in docs:
-            # Extract just the filename from the full path
-            full_source = doc.metadata.get("source", "Unknown")
-            source_filename = os.path.basename(full_source)
-            
-            source_info = {
-                "source": source_filename,
-                "content": doc.page_content[:500] + "...",  # Preview of content
-                "metadata": doc.metadata
-            }
-            sources.append(source_info)
-            
+        hits = self.retrieve_batch([query], k=k, filters=filters)
+        context, sources = self.context_packer.pack(
+            hits, scores=[hit["score"] for hit in hits], k=k, token_budget=token_budget, window=chunk_window_size
+        )
         return context, sources
 
+    def retrieve_batch(self, queries=None, embeddings=None, k=5, ef_search=None, filters=None):
+        """
+        Retrieve the top-k chunks for several queries at once.
+
+        Either the query strings or their precomputed embeddings (e.g. the ones computed during query expansion with
+        the same sentence-transformer) must be given. Strings are embedded in a single batch, and all the vectors are
+        searched with one multi-vector query of the backend.
+
+        Parameters
+        ----------
+        queries : list[str], optional
+            Queries to embed and search.
+        embeddings : list[list[float]], optional
+            Precomputed query embeddings. Takes precedence over `queries`.
+        k : int
+            Number of chunks to retrieve per query.
+        ef_search : int, optional
+            HNSW candidate list size of this search (higher means better recall and more latency). Defaults to the
+            one of the collection.
+        filters : dict, optional
+            Metadata filter (see `src/filters.py`). The chunks that match it are selected with the attribute index of
+            the backend before they are scored.
+
+        Returns
+        -------
+        list[dict]
+            Source dicts (like the ones of `retrieve_context`) with the chunk "id" and its best dense "score" among
+            all the queries, merged by chunk id and sorted by decreasing score.
+        """
+        if embeddings is None:
+            if not queries:
+                return []
+            embeddings = self.embeddings.embed_queries(list(queries))
+        embeddings = [list(map(float, embedding)) for embedding in embeddings]
+        if not embeddings:
+            return []
+
+        where = build_where(filters, self.catalog)
+        if self.quantized_index is not None:
+            allowed = self.backend.get(where=where, include=[])["ids"] if where else None
+            results = self._quantized_query(embeddings, k, allowed)
+        else:
+            results = self.backend.search(embeddings, k, ef_search=ef_search, where=where)
+
+        merged = {}
+        for ids, contents, metadatas, distances in zip(
+            results["ids"], results["documents"], results["metadatas"], results["distances"]
+        ):
+            for chunk_id, content, metadata, distance in zip(ids, contents, metadatas, distances):
+                score = float(self.backend.relevance_score(distance))
+                if chunk_id not in merged or score > merged[chunk_id]["score"]:
+                    source_info = self._source_info(content, metadata)
+                    source_info["id"] = chunk_id
+                    source_info["score"] = score
+                    merged[chunk_id] = source_info
+        return sorted(merged.values(), key=lambda x: x["score"], reverse=True)
+
+    def _quantized_query(self, embeddings, k, allowed=None):
+        """
+        Dense search over the quantized index (restricted to the chunk ids `allowed`, if given). Returns the same
+        structure as a backend search (ids, documents, metadatas and distances per query); documents and metadatas of
+        all the hits are fetched in a single call.
+        """
+        hits = self.quantized_index.search(embeddings, k=k, ids=allowed)
+        unique_ids = list(dict.fromkeys(chunk_id for query_hits in hits for chunk_id, _ in query_hits))
+        chunks = self.backend.get(ids=unique_ids, include=["documents", "metadatas"])
+        stored = {
+            chunk_id: (content, metadata)
+            for chunk_id, content, metadata in zip(chunks["ids"], chunks["documents"], chunks["metadatas"])
+        }
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for query_hits in hits:
+            query_hits = [(chunk_id, distance) for chunk_id, distance in query_hits if chunk_id in stored]
+            results["ids"].append([chunk_id for chunk_id, _ in query_hits])
+            results["documents"].append([stored[chunk_id][0] for chunk_id, _ in query_hits])
+            results["metadatas"].append([stored[chunk_id][1] for chunk_id, _ in query_hits])
+            results["distances"].append([distance for _, distance in query_hits])
+        return results
+
+    def hybrid_search(self, queries, embeddings=None, k=5, rrf_k=60, ef_search=None, filters=None):
+        """
+        Hybrid retrieval: the dense search (`retrieve_batch`) and the BM25 search of every query run in parallel, and
+        their rankings are combined with Reciprocal Rank Fusion.
+
+        Parameters
+        ----------
+        queries : list[str]
+            Query strings, used for the sparse search (and for the dense one if `embeddings` isn't given).
+        embeddings : list[list[float]], optional
+            Precomputed embeddings of the queries for the dense search.
+        k : int
+            Number of chunks to retrieve per query and per retriever.
+        rrf_k : int
+            Constant of the Reciprocal Rank Fusion.
+        ef_search : int, optional
+            HNSW candidate list size of the dense search.
+        filters : dict, optional
+            Metadata filter (see `src/filters.py`) applied to both searches before scoring.
+
+        Returns
+        -------
+        list[dict]
+            Source dicts with the chunk "id", its fused "score" and its "dense_score"/"sparse_score" when the chunk was
+            found by that retriever, sorted by decreasing fused score.
+        """
+        dense_future = self._search_executor.submit(self.retrieve_batch, queries, embeddings, k, ef_search, filters)
+        sparse_future = self._search_executor.submit(self.sparse_search, queries, k, filters)
+        return self.fuse_results(dense_future.result(), sparse_future.result(), rrf_k=rrf_k)
+
+    def allowed_ids(self, filters: dict = None) -> set:
+        """
+        Ids of the chunks that match a metadata filter, or None if there's no filter.
+        """
+        where = build_where(filters, self.catalog)
+        return set(self.backend.get(where=where, include=[])["ids"]) if where else None
+
+    def sparse_search(self, queries, k=5, filters=None, allowed=None) -> list[list[tuple[str, float]]]:
+        """
+        BM25 search of every query: a list (one per query) of (chunk_id, score) tuples. The chunks can be restricted
+        by `filters` or directly by their ids (`allowed`, see `allowed_ids`).
+        """
+        if allowed is None:
+            allowed = self.allowed_ids(filters)
+        return [self.sparse_index.search(query, k=k, ids=allowed) for query in queries]
+
+    @staticmethod
+    def merge_dense_results(*results: list[dict]) -> list[dict]:
+        """
+        Merges the results of several `retrieve_batch` calls by chunk id (keeping the best score), like a single call
+        with all their queries.
+        """
+        merged = {}
+        for sources in results:
+            for source in sources:
+                if source["id"] not in merged or source["score"] > merged[source["id"]]["score"]:
+                    merged[source["id"]] = source
+        return sorted(merged.values(), key=lambda x: x["score"], reverse=True)
+
+    def fuse_results(self, dense_results, sparse_results, rrf_k=60) -> list[dict]:
+        """
+        Combines the dense ranking (`retrieve_batch`) and the sparse rankings of every query (`sparse_search`) with
+        Reciprocal Rank Fusion. Returns the source dicts of `hybrid_search`.
+
+        The dense results are already merged across the queries (best score per chunk), so the sparse hits are merged
+        the same way: both retrievers enter the fusion as a single ranking and weigh the same, whatever the number of
+        queries.
+        """
+        sparse_scores = {}
+        for hits in sparse_results:
+            for chunk_id, score in hits:
+                sparse_scores[chunk_id] = max(score, sparse_scores.get(chunk_id, 0.0))
+        rankings = [
+            [source["id"] for source in dense_results],
+            sorted(sparse_scores, key=sparse_scores.get, reverse=True),
+        ]
+        fused = reciprocal_rank_fusion(rankings, k=rrf_k)
+
+        # Chunks found only by the sparse search are fetched from the backend in a single call.
+        sources = {source["id"]: source for source in dense_results}
+        for source in sources.values():
+            source["dense_score"] = source["score"]
+        missing = [chunk_id for chunk_id, _ in fused if chunk_id not in sources]
+        if missing:
+            chunks = self.backend.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, content, metadata in zip(chunks["ids"], chunks["documents"], chunks["metadatas"]):
+                source_info = self._source_info(content, metadata)
+                source_info["id"] = chunk_id
+                sources[chunk_id] = source_info
+
+        results = []
+        for chunk_id, score in fused:
+            if chunk_id not in sources:
+                continue  # The chunk was deleted from the vector store but is still in the sparse index.
+            source_info = sources[chunk_id]
+            source_info["score"] = score
+            if chunk_id in sparse_scores:
+                source_info["sparse_score"] = sparse_scores[chunk_id]
+            results.append(source_info)
+        return results
+
+    @staticmethod
+    def _source_info(content, metadata):
+        """
+        Build the source dict returned to callers (and to the frontend) for a retrieved chunk.
+        """
+        # Extract just the filename from the full path
+        full_source = metadata.get("source", "Unknown")
+        return {
+            "source": os.path.basename(full_source),
+            "content": content[:500] + "...",  # Preview of content
+            "metadata": metadata
+        }
+
+    def _get_embeddings(self, ids):
+        """
+        Return the stored embeddings of the given chunk ids as a dict {id: embedding}.
+        """
+        if not ids:
+            return {}
+        chunks = self.backend.get(ids=list(dict.fromkeys(ids)), include=["embeddings"])
+        return dict(zip(chunks["ids"], chunks["embeddings"]))
+
+    def _build_chunk_index(self, batch_size=5000):
+        """
+        Build the neighbor index from every chunk already stored in the vector store.
+        The collection is read in pages so that loading a large store doesn't materialize it all at once.
+        """
+        self._chunk_index = {}
+        self._chunk_tokens = {}
+        # The sparse index is (re)built here as well if it doesn't match the collection, e.g. on the first load of a
+        # store created before it existed.
+        rebuild_sparse = len(self.sparse_index) != self.backend.count()
+        if rebuild_sparse:
+            print("Building the sparse index from the vector store...")
+            self.sparse_index.clear()
+        # Stores created before the catalog existed get their documents cataloged here (without hash, so uploading
+        # those files again replaces their chunks instead of duplicating them). When the catalog doesn't match the
+        # store (e.g. after an interrupted ingestion) only the chunks that differ are reconciled, so the hash and the
+        # tags of the other documents are kept.
+        reconcile_catalog = self.catalog.count_chunks() != self.backend.count()
+        # The quantized index is (re)built as well when it's enabled on an existing store.
+        rebuild_quantized = (
+            self.quantized_index is not None and len(self.quantized_index) != self.backend.count()
+        )
+        # So is the synonym table of stores created before it existed.
+        rebuild_synonyms = len(self.synonyms) == 0 and self.backend.count() > 0
+        if rebuild_synonyms:
+            print("Building the synonym table from the vector store...")
+        include = ["documents", "metadatas"]
+        if rebuild_quantized:
+            print("Building the quantized index from the vector store...")
+            self.quantized_index.clear()
+            include.append("embeddings")
+        chunk_sources = {}
+        documents = {}
+        offset = 0
+        while True:
+            batch = self.backend.get(include=include, limit=batch_size, offset=offset)
+            if not batch["ids"]:
+                break
+            self._index_chunks(batch["documents"], batch["metadatas"])
+            if rebuild_sparse:
+                self.sparse_index.add(batch["ids"], batch["documents"])
+            if rebuild_quantized:
+                self.quantized_index.add(batch["ids"], batch["embeddings"])
+            if rebuild_synonyms:
+                self._add_synonyms(batch["documents"])
+            if reconcile_catalog:
+                for chunk_id, metadata in zip(batch["ids"], batch["metadatas"]):
+                    source = metadata.get("source")
+                    if source is None:
+                        continue
+                    chunk_sources[chunk_id] = source
+                    documents.setdefault(source, {
+                        "pages": metadata.get("total_pages"),
+                        "tags": [key[len(TAG_PREFIX):] for key, value in metadata.items()
+                                 if key.startswith(TAG_PREFIX) and value is True],
+                    })
+            offset += len(batch["ids"])
+        if rebuild_quantized:
+            self.quantized_index.flush()
+        if reconcile_catalog:
+            added, removed = self.catalog.reconcile(chunk_sources, documents)
+            print(f"Catalog reconciled with the vector store: {added} chunks added, {removed} removed.")
+
+    def _index_chunks(self, contents, metadatas):
+        """
+        Add chunks to the neighbor index. The first chunk seen for a (source, chunk_idx) pair wins, which
+        keeps duplicated uploads from changing the assembled windows.
+        """
+        for content, metadata in zip(contents, metadatas):
+            source = metadata.get("source")
+            if source is None or "chunk_idx" not in metadata:
+                continue
+            chunks = self._chunk_index.setdefault(source, {})
+            chunks.setdefault(int(metadata["chunk_idx"]), content)
+            if metadata.get("n_tokens_model") == self.token_counter.model_name:
+                self._chunk_tokens.setdefault(source, {}).setdefault(int(metadata["chunk_idx"]), metadata["n_tokens"])
+
+    def _load_sources(self, sources):
+        """
+        Fetch into the neighbor index, in a single backend call, the chunks of those sources it doesn't know yet
+        (e.g. chunks written to the collection by another process). Sources without chunks aren't remembered, so
+        their chunks are found as soon as they are written.
+        """
+        missing = [source for source in dict.fromkeys(sources) if source not in self._chunk_index]
+        if not missing:
+            return
+        where = {"source": missing[0]} if len(missing) == 1 else {"source": {"$in": missing}}
+        chunks = self.backend.get(where=where, include=["documents", "metadatas"])
+        self._index_chunks(chunks["documents"], chunks["metadatas"])
+
+    @staticmethod
+    def _chunk_metadata(doc):
+        """
+        Return the metadata of a chunk given either as a langchain Document or as a source dict.
+        """
+        if hasattr(doc, "metadata"):
+            return doc.metadata
+        return doc["metadata"]
+
     def _search_nearby_chunks(self, doc, window):
         """
         Given a document chunk, find nearby chunks in the same PDF file (based on chunk_idx).
         This helps preserve context that might have been split.
         """
-        if hasattr(doc, "metadata"):
-            source_doc = doc.metadata["source"]
-        else:
-            source_doc = doc["metadata"]["source"]
-        # Get every chunk of the same pdf document.
-        all_chunks = self.vector_store.get(where={"source": source_doc})
-
-        unique_chunks = []
-        unique_metadatas = []
-        seen_keys = set()
-
-        # For removing duplicates.
-        for i, content in enumerate(all_chunks["documents"]):
-            metadata = all_chunks["metadatas"][i]
-            key = (metadata.get("source"), metadata.get("chunk_idx"))
-            if key not in seen_keys:
-                seen_keys.add(key)
-                unique_chunks.append(content)
-                unique_metadatas.append(metadata)
-        all_chunks["documents"] = unique_chunks
-        all_chunks["metadatas"] = unique_metadatas
-        
-        # Create a list of tuples (chunk_idx, content) for sorting
-        chunk_data = []
-        for i, content in enumerate(all_chunks["documents"]):
-            metadata = all_chunks["metadatas"][i]
-            # Use chunk_idx if available, otherwise use position in list
-            chunk_idx = float(metadata.get("chunk_idx", i))
-            chunk_data.append((chunk_idx, content))
-
-        # Sort chunks by chunk_idx
-        chunk_data.sort(key=lambda x: x[0])
-
-        # Get the current chunk's index
-        if hasattr(doc, "metadata"):
-            current_chunk_idx = float(doc.metadata.get("chunk_idx", 0))
-        else:
-            current_chunk_idx = float(doc["metadata"].get("chunk_idx", 0))
-        
-        nearby_chunks = []
-        target_indices = set(range(int(current_chunk_idx - window), int(current_chunk_idx + window + 1)))
-        for idx, content in chunk_data:
-            if idx in target_indices:
-                nearby_chunks.append(content)
+        return self._search_nearby_chunks_batch([doc], window)[0]
+
+    def _search_nearby_chunks_batch(self, docs, window):
+        """
+        Expand every chunk in `docs` with the chunks at most `window` positions away in the same PDF file.
+        Sources that aren't in the neighbor index yet are fetched together, so all the windows of a query
+        cost at most one backend round trip.
 
-        cleaned_chunks = [nearby_chunks[0]]  # Keep the first chunk as-is
+        Returns
+        -------
+        list[str]
+            The joined text of each window, in the same order as `docs`.
+        """
+        metadatas = [self._chunk_metadata(doc) for doc in docs]
+        self._load_sources([metadata["source"] for metadata in metadatas])
+
+        joined_texts = []
+        for metadata in metadatas:
+            chunks = self._chunk_index.get(metadata["source"], {})
+            current_chunk_idx = int(float(metadata.get("chunk_idx", 0)))
 
-        for chunk in nearby_chunks[1:]:
-            cleaned_chunks.append(chunk[self.text_splitter._chunk_overlap:])  # Remove the 20-character overlap
+            nearby_chunks = []
+            for idx in range(current_chunk_idx - window, current_chunk_idx + window + 1):
+                if idx in chunks:
+                    nearby_chunks.append(chunks[idx])
+            if not nearby_chunks:
+                joined_texts.append("")
+                continue
 
-        joined_text = "".join(cleaned_chunks)
-        return joined_text
+            cleaned_chunks = [nearby_chunks[0]]  # Keep the first chunk as-is
+            for chunk in nearby_chunks[1:]:
+                cleaned_chunks.append(chunk[self.text_splitter._chunk_overlap:])  # Remove the overlap
 
-    def list_documents(self):
+            joined_texts.append("".join(cleaned_chunks))
+        return joined_texts
+
+    def count(self):
         """
-        List all unique source documents currently stored in the vector database.
+        Number of chunks stored in the vector database.
+        """
+        return self.backend.count()
+
+    def list_documents(self, offset=0, limit=None, details=False):
+        """
+        List the source documents currently stored in the vector database, sorted by filename, from the catalog.
+
+        Parameters
+        ----------
+        offset : int
+            Number of documents to skip.
+        limit : int, optional
+            Max number of documents to return. All of them if None.
+        details : bool
+            Whether to return the catalog entries (chunk count, pages, size, ingest time...) instead of filenames.
         """
         try:
-            # Get all documents and their metadata
-            results = self.vector_store.get()
-            # Extract unique source documents
-            documents = set()
-            
-            for metadata in results['metadatas']:
-                if 'source' in metadata:
-                    # Get just the filename from the full path
-                    filename = os.path.basename(metadata['source'])
-                    documents.add(filename)
-                    
-            return list(documents)
+            entries = self.catalog.list_documents(offset=offset, limit=limit)
+            if details:
+                return entries
+            return [entry["filename"] for entry in entries]
         except Exception as e:
             print(f"Error listing documents: {str(e)}")
             return []
@@ -169,29 +701,23 @@ class VectorDB:
         Delete all chunks belonging to a specific document by filename.
         """
         try:
-            print(f"DEBUG - Starting deletion for filename: {filename}")
-            # Get all documents and their metadata
-            results = self.vector_store.get()
-            print(f"DEBUG - Retrieved {len(results['metadatas'])} total documents")
-            
-            # Find all chunk IDs that belong to this document
+            sources = self.catalog.sources_for_filename(filename)
             ids_to_delete = []
-            for i, metadata in enumerate(results['metadatas']):
-                if 'source' in metadata:
-                    source_filename = os.path.basename(metadata['source'])
-                    print(f"DEBUG - Checking source: {source_filename} against target: {filename}")
-                    if source_filename == filename:
-                        ids_to_delete.append(results['ids'][i])
-            
-            print(f"DEBUG - Found {len(ids_to_delete)} chunks to delete")
-            if not ids_to_delete:
+            for source in sources:
+                ids_to_delete.extend(self.catalog.get(source)["ids"])
+
+            if not sources:
                 print(f"No document found with filename: {filename}")
                 return False
             
             # Delete the chunks
             try:
-                self.vector_store.delete(ids=ids_to_delete)
-                print(f"Successfully deleted document: {filename}")
+                self._delete_chunks(ids_to_delete)
+                for source in sources:
+                    self._chunk_index.pop(source, None)
+                    self._chunk_tokens.pop(source, None)
+                self.catalog.remove(sources)
+                print(f"Successfully deleted document: {filename} ({len(ids_to_delete)} chunks)")
                 return True
             except Exception as e:
                 print(f"Error during deletion of document {filename}: {str(e)}")
@@ -199,4 +725,4 @@ class VectorDB:
             
         except Exception as e:
             print(f"Error deleting document {filename}: {str(e)}")
-            return False
\ No newline at end of file
+            return False
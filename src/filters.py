@@ -0,0 +1,105 @@
+"""
+Metadata filters of the retrieval.
+
+Every chunk stores in its metadata the attributes it can be filtered by: its "source", the "page" where it starts
+(0-based), its "language" (detected at ingest time) and the custom tags of its document (one boolean key "tag:<name>"
+per tag, attached at upload time). A filter is a dict with any of these keys, combined with AND:
+
+    {"source": ["WHO_guideline.pdf"], "page": [0, 10], "language": "en", "tags": ["who", "neonatal"]}
+
+- source: file name(s) or full path(s) of the documents.
+- page: a page number or a [first, last] range (either end can be None).
+- language: language code(s), e.g. "en" or ["en", "es"].
+- tags: tag(s); chunks of documents with any of them match.
+
+`build_where` turns a filter into the metadata condition (Chroma syntax) that the backends use to pre-filter the
+candidates before scoring them.
+"""
+TAG_PREFIX = "tag:"
+FILTER_KEYS = ("source", "page", "language", "tags")
+
+try:
+    from langdetect import DetectorFactory, detect
+    DetectorFactory.seed = 0  # Deterministic detections
+except ImportError:
+    detect = None
+
+_warned = False
+
+
+def detect_language(text: str) -> str:
+    """
+    Language code of a text (e.g. "en"), or None if it can't be detected.
+    """
+    global _warned
+    if detect is None:
+        if not _warned:
+            _warned = True
+            print("[WARN] langdetect is not installed: languages won't be detected.")
+        return None
+    try:
+        return detect(text)
+    except Exception:
+        return None  # No features in the text (e.g. only numbers)
+
+
+def tag_metadata(tags: list[str]) -> dict:
+    """
+    Metadata keys that attach `tags` to a chunk.
+    """
+    return {TAG_PREFIX + tag: True for tag in tags}
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def build_where(filters: dict, catalog=None) -> dict:
+    """
+    Builds the metadata condition of a filter, or None if it doesn't filter anything.
+
+    Parameters
+    ----------
+    filters : dict
+        Filter with the keys "source", "page", "language" and/or "tags".
+    catalog : DocumentCatalog, optional
+        Catalog used to resolve file names into the full paths stored in the "source" metadata.
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError(f"Filters must be an object with the keys {FILTER_KEYS}, got {type(filters).__name__}.")
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Not supported filter keys: {sorted(unknown)}. Use {FILTER_KEYS}.")
+
+    conditions = []
+    if filters.get("source"):
+        sources = []
+        for source in _as_list(filters["source"]):
+            if catalog is not None and source not in catalog:
+                sources.extend(catalog.sources_for_filename(source))
+            else:
+                sources.append(source)
+        # A filter on unknown documents matches nothing.
+        conditions.append({"source": {"$in": sources or [""]}})
+    if filters.get("page") is not None:
+        page = filters["page"]
+        if isinstance(page, (list, tuple)):
+            first, last = page
+            if first is not None:
+                conditions.append({"page": {"$gte": int(first)}})
+            if last is not None:
+                conditions.append({"page": {"$lte": int(last)}})
+        else:
+            conditions.append({"page": int(page)})
+    if filters.get("language"):
+        conditions.append({"language": {"$in": _as_list(filters["language"])}})
+    if filters.get("tags"):
+        tags = _as_list(filters["tags"])
+        tag_conditions = [{TAG_PREFIX + tag: True} for tag in tags]
+        conditions.append(tag_conditions[0] if len(tag_conditions) == 1 else {"$or": tag_conditions})
+
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
@@ -0,0 +1,397 @@
+"""
+Parallel, batched ingestion pipeline for loading many PDF documents into the VectorDB.
+
+The pipeline has three stages connected by bounded queues, so a slow stage applies backpressure instead of letting
+parsed documents pile up in memory:
+
+1. Parsing and splitting: PDFs are parsed and chunked in a pool of worker processes.
+2. Embedding: chunks are grouped in large batches and embedded with the shared sentence-transformer (optionally using
+   its multi-process encoding).
+3. Writing: embedded batches are written in bulk into Chroma and registered in the neighbor and sparse indexes.
+
+Ingestion is incremental: the document catalog records the content hash of every ingested file, so unchanged files
+are skipped, and changed files are replaced only once all their new chunks have been written.
+
+PDFs are never loaded as a single string: `iter_pdf_chunks` streams their pages into the text splitter, carrying the
+last chunk of every page over to the next one, so chunks can span page boundaries while the text held in memory is
+bounded by the size of a page.
+"""
+import os
+import time
+import hashlib
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from langchain_community.document_loaders import PyPDFLoader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from src.filters import tag_metadata
+
+_END = object()  # Sentinel that tells the next stage that there is nothing else to process.
+
+# Delimiter between consecutive pages (the same one PyPDFLoader uses to join the pages of a document).
+PAGES_DELIMITER = "\n\f"
+# Version of the chunking, stored with the splitter settings so files chunked differently are ingested again.
+CHUNKING_VERSION = "pages-v1"
+
+
+def file_sha256(path: str) -> str:
+    """
+    Hash of the content of a file, read in blocks so big PDFs aren't loaded in memory.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_pdf_chunks(path: str, text_splitter):
+    """
+    Streams the chunks of a PDF document, page by page.
+
+    Every page is split together with the last chunk of the previous pages, which is held back until the next page
+    is read, so a paragraph that continues on the next page ends in the same chunk and the splitter overlap is kept
+    across pages. Only one page and one chunk are held in memory at a time.
+
+    Yields
+    ------
+    tuple[str, dict]
+        Text of the chunk and its metadata: the metadata of the page where the chunk starts ("source", "page",
+        "page_label", "total_pages"...) and the position of the chunk in the document ("chunk_idx").
+    """
+    carry, carry_metadata = "", None
+    chunk_idx = 0
+    for page in PyPDFLoader(path, mode="page").lazy_load():
+        if carry:
+            text = carry + PAGES_DELIMITER + page.page_content
+            boundaries = [(0, carry_metadata), (len(carry) + len(PAGES_DELIMITER), page.metadata)]
+        else:
+            text = page.page_content
+            boundaries = [(0, page.metadata)]
+        chunks = text_splitter.split_text(text)
+        if not chunks:
+            continue
+
+        def metadata_at(offset):
+            return next(metadata for start, metadata in reversed(boundaries) if start <= offset)
+
+        located = []
+        start = -1
+        for chunk in chunks:
+            found = text.find(chunk, start + 1)
+            start = found if found >= 0 else max(start, 0)
+            located.append((chunk, start))
+        for chunk, start in located[:-1]:
+            yield chunk, dict(metadata_at(start), chunk_idx=chunk_idx)
+            chunk_idx += 1
+        carry, start = located[-1]
+        carry_metadata = metadata_at(start)
+    if carry:
+        yield carry, dict(carry_metadata, chunk_idx=chunk_idx)
+
+
+def iter_chunk_batches(path: str, text_splitter, batch_size: int = 256):
+    """
+    Groups the chunks streamed by `iter_pdf_chunks` in batches of `batch_size`, ready to be embedded.
+
+    Yields
+    ------
+    tuple[list[str], list[dict]]
+        Texts and metadatas of the chunks of the batch.
+    """
+    texts, metadatas = [], []
+    for text, metadata in iter_pdf_chunks(path, text_splitter):
+        texts.append(text)
+        metadatas.append(metadata)
+        if len(texts) >= batch_size:
+            yield texts, metadatas
+            texts, metadatas = [], []
+    if texts:
+        yield texts, metadatas
+
+
+def parse_and_split(path: str, chunk_size: int, chunk_overlap: int, known_sha256: str = None):
+    """
+    Loads a PDF document and splits it into chunks, adding the 'chunk_idx' of every chunk to its metadata.
+    Runs in the worker processes of the parsing stage.
+
+    Parameters
+    ----------
+    known_sha256 : str, optional
+        Hash of the already ingested version of the file. If the file still has this hash it isn't parsed.
+
+    Returns
+    -------
+    tuple[str, list[str], list[dict]]
+        Hash of the file and texts and metadatas of the chunks (both None if the file is unchanged).
+    """
+    sha256 = file_sha256(path)
+    if sha256 == known_sha256:
+        return sha256, None, None
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    texts, metadatas = [], []
+    for text, metadata in iter_pdf_chunks(path, text_splitter):
+        texts.append(text)
+        metadatas.append(metadata)
+    return sha256, texts, metadatas
+
+
+class IngestionStats:
+    """
+    Counters of an ingestion run. Every stage accumulates the time it has been busy, so the throughput of each stage
+    can be compared to find the bottleneck.
+    """
+    def __init__(self):
+        self.files_parsed = 0
+        self.files_skipped = 0
+        self.chunks_embedded = 0
+        self.chunks_unchanged = 0
+        self.chunks_written = 0
+        self.failures = []  # [(path, stage, error message)]
+        self.busy_time = {"parse": 0.0, "embed": 0.0, "write": 0.0}
+        self.wall_time = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float, **counters):
+        with self._lock:
+            self.busy_time[stage] += seconds
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def fail(self, path: str, stage: str, error: Exception):
+        with self._lock:
+            self.failures.append((path, stage, str(error)))
+
+    def throughput(self) -> dict:
+        """
+        Items processed per second of busy time for every stage.
+        """
+        def rate(count, seconds):
+            return round(count / seconds, 2) if seconds > 0 else 0.0
+        return {
+            "parse (files/s)": rate(self.files_parsed, self.busy_time["parse"]),
+            "embed (chunks/s)": rate(self.chunks_embedded, self.busy_time["embed"]),
+            "write (chunks/s)": rate(self.chunks_written, self.busy_time["write"]),
+        }
+
+    def report(self):
+        print(f"Ingestion finished in {self.wall_time:.1f}s: {self.files_parsed} files parsed, "
+              f"{self.files_skipped} unchanged files skipped, {self.chunks_embedded} chunks embedded, "
+              f"{self.chunks_written} chunks written, {self.chunks_unchanged} unchanged chunks kept.")
+        for stage, value in self.throughput().items():
+            print(f"  - {stage}: {value}")
+        if self.failures:
+            print(f"  {len(self.failures)} failure(s):")
+            for path, stage, error in self.failures:
+                print(f"    [{stage}] {path}: {error}")
+
+
+class IngestionPipeline:
+    def __init__(
+        self,
+        vector_db,
+        workers: int = None,
+        embed_batch_size: int = 256,
+        multi_process_encoding: bool = False,
+        queue_size: int = 8,
+        tags: list[str] = None
+    ):
+        """
+        Parameters
+        ----------
+        vector_db : VectorDB
+            Vector database where the documents are ingested.
+        workers : int, optional
+            Number of processes that parse and split PDFs. Defaults to the number of CPUs.
+        embed_batch_size : int
+            Number of chunks embedded (and then written) together.
+        multi_process_encoding : bool
+            Whether to embed with the multi-process pool of sentence-transformers (one process per GPU, or several
+            CPU processes) instead of in the current process.
+        queue_size : int
+            Capacity of the queues between stages, in parsed documents and in embedded batches respectively.
+        tags : list[str], optional
+            Tags attached to all the documents. If None, documents keep their current tags.
+        """
+        self.vector_db = vector_db
+        self.workers = workers or os.cpu_count() or 1
+        self.embed_batch_size = embed_batch_size
+        self.multi_process_encoding = multi_process_encoding
+        self.queue_size = queue_size
+        self.tags = tags
+
+    def run(self, paths: list[str]) -> IngestionStats:
+        """
+        Ingests the given PDF documents and returns the stats of the run.
+        """
+        stats = IngestionStats()
+        start = time.perf_counter()
+        # Documents being written: {path: {"sha256": hash, "pages": number of pages, "remaining": chunks left to write,
+        # "ids": ids of its chunks, "written": ids of the chunks that weren't already stored}}
+        self._documents = {}
+        self._documents_lock = threading.Lock()
+        parsed_queue = queue.Queue(maxsize=self.queue_size)
+        embedded_queue = queue.Queue(maxsize=self.queue_size)
+
+        embedder = threading.Thread(target=self._embed_stage, args=(parsed_queue, embedded_queue, stats))
+        writer = threading.Thread(target=self._write_stage, args=(embedded_queue, stats))
+        embedder.start()
+        writer.start()
+        try:
+            self._parse_stage(paths, parsed_queue, stats)
+        finally:
+            parsed_queue.put(_END)
+            embedder.join()
+            writer.join()
+            # Documents that couldn't be fully written keep their previous version: remove their partial new chunks.
+            for document in self._documents.values():
+                if document["written"]:
+                    self.vector_db._delete_chunks(document["written"])
+        stats.wall_time = time.perf_counter() - start
+        return stats
+
+    def _parse_stage(self, paths, parsed_queue, stats):
+        """
+        Parses and splits the documents in a process pool. At most `workers + queue_size` documents are in flight,
+        and results are handed to the embedding stage as soon as they are ready.
+        """
+        chunk_size = self.vector_db.text_splitter._chunk_size
+        chunk_overlap = self.vector_db.text_splitter._chunk_overlap
+        settings = self.vector_db.splitter_settings()
+        pending_paths = iter(paths)
+        in_flight = {}
+        # "spawn" avoids forking a process that holds loaded models and running threads.
+        with ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            def submit_next():
+                path = next(pending_paths, None)
+                if path is not None:
+                    known_sha256 = self.vector_db.catalog.current_sha256(path, settings)
+                    future = executor.submit(parse_and_split, path, chunk_size, chunk_overlap, known_sha256)
+                    in_flight[future] = (path, time.perf_counter())
+                return path is not None
+
+            for _ in range(self.workers + self.queue_size):
+                if not submit_next():
+                    break
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, submitted = in_flight.pop(future)
+                    try:
+                        sha256, texts, metadatas = future.result()
+                    except Exception as e:
+                        stats.fail(path, "parse", e)
+                    else:
+                        # Wall time of the task divided by the workers approximates the busy time of the pool.
+                        busy_time = (time.perf_counter() - submitted) / self.workers
+                        tags = self.tags if self.tags is not None else self.vector_db.catalog.tags(path)
+                        if texts is None:
+                            stats.add("parse", busy_time, files_skipped=1)
+                            # Unchanged file: only its tags may have to be updated.
+                            if sorted(tags) != self.vector_db.catalog.tags(path):
+                                self.vector_db._set_source_tags(path, tags)
+                        elif texts:
+                            stats.add("parse", busy_time, files_parsed=1)
+                            metadatas = [dict(metadata, **tag_metadata(tags)) for metadata in metadatas]
+                            with self._documents_lock:
+                                self._documents[path] = {
+                                    "sha256": sha256,
+                                    "tags": tags,
+                                    "pages": metadatas[0].get("total_pages"),
+                                    "remaining": len(texts),
+                                    "ids": [],
+                                    "written": []
+                                }
+                            parsed_queue.put((path, texts, metadatas))  # Blocks while the embedder is behind.
+                        else:
+                            stats.add("parse", busy_time, files_parsed=1)
+                            # The new version has no text at all: it just replaces the previous one.
+                            self.vector_db._replace_document(path, sha256, [], tags=tags)
+                    submit_next()
+
+    def _embed_stage(self, parsed_queue, embedded_queue, stats):
+        """
+        Groups parsed chunks in batches of `embed_batch_size` and embeds the ones that aren't already stored.
+        """
+        embeddings = self.vector_db.embeddings
+        pool = embeddings.client.start_multi_process_pool() if self.multi_process_encoding else None
+        batch_paths, batch_texts, batch_metadatas = [], [], []
+
+        def flush():
+            if not batch_texts:
+                return
+            start = time.perf_counter()
+            try:
+                ids = self.vector_db._chunk_ids(batch_texts, batch_metadatas)
+                new = self.vector_db._new_chunk_positions(ids)
+                vectors = embeddings.embed_documents(
+                    [batch_texts[i] for i in new], batch_size=self.embed_batch_size, pool=pool
+                )
+            except Exception as e:
+                for path in dict.fromkeys(batch_paths):
+                    stats.fail(path, "embed", e)
+            else:
+                stats.add(
+                    "embed",
+                    time.perf_counter() - start,
+                    chunks_embedded=len(new),
+                    chunks_unchanged=len(ids) - len(new)
+                )
+                embedded_queue.put((list(batch_paths), ids, list(batch_texts), list(batch_metadatas), new, vectors))
+            batch_paths.clear()
+            batch_texts.clear()
+            batch_metadatas.clear()
+
+        try:
+            while True:
+                item = parsed_queue.get()
+                if item is _END:
+                    break
+                path, texts, metadatas = item
+                batch_paths.extend([path] * len(texts))
+                batch_texts.extend(texts)
+                batch_metadatas.extend(metadatas)
+                if len(batch_texts) >= self.embed_batch_size:
+                    flush()
+            flush()
+        finally:
+            if pool is not None:
+                embeddings.client.stop_multi_process_pool(pool)
+            embedded_queue.put(_END)
+
+    def _write_stage(self, embedded_queue, stats):
+        """
+        Writes embedded batches into the vector database in bulk. Once all the chunks of a document are written, it
+        replaces the previous version of the document.
+        """
+        while True:
+            item = embedded_queue.get()
+            if item is _END:
+                break
+            paths, ids, texts, metadatas, new, vectors = item
+            start = time.perf_counter()
+            try:
+                if new:
+                    self.vector_db._write_chunks(
+                        [ids[i] for i in new], [texts[i] for i in new], [metadatas[i] for i in new], vectors
+                    )
+            except Exception as e:
+                for path in dict.fromkeys(paths):
+                    stats.fail(path, "write", e)
+                continue
+            new = set(new)
+            for i, (path, chunk_id) in enumerate(zip(paths, ids)):
+                with self._documents_lock:
+                    document = self._documents[path]
+                    document["ids"].append(chunk_id)
+                    if i in new:
+                        document["written"].append(chunk_id)
+                    document["remaining"] -= 1
+                    if document["remaining"] > 0:
+                        continue
+                    del self._documents[path]
+                self.vector_db._replace_document(
+                    path, document["sha256"], document["ids"], pages=document["pages"], tags=document["tags"]
+                )
+            stats.add("write", time.perf_counter() - start, chunks_written=len(new))
@@ -0,0 +1,207 @@
+"""
+Background ingestion jobs, so uploads return immediately instead of parsing, embedding and writing a PDF inside the
+HTTP request.
+
+Jobs run in a small pool of worker threads (bounded concurrency) with lower priority than the interactive queries:
+the worker threads are reniced (on Linux) and they pause between batches while queries are being answered, so an
+upload doesn't slow down `/infer`. The progress of every job (pages parsed, chunks embedded, ETA) can be polled.
+"""
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class IngestionJob:
+    """
+    State and progress of the ingestion of one uploaded file.
+    """
+    def __init__(self, path: str, tags: list[str] = None, cleanup: bool = True):
+        self.id = uuid.uuid4().hex
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.tags = tags
+        self.cleanup = cleanup  # Remove the file when the job ends (uploads are saved to a temporary folder).
+        self.status = QUEUED
+        self.error = None
+        self.pages_parsed = 0
+        self.total_pages = None
+        self.chunks_embedded = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def eta(self) -> float:
+        """
+        Estimated seconds left, from the parsing rate of the pages so far (None if it can't be estimated yet).
+        """
+        if self.status != RUNNING or not self.pages_parsed or not self.total_pages:
+            return None
+        elapsed = time.time() - self.started_at
+        return round(elapsed / self.pages_parsed * max(self.total_pages - self.pages_parsed, 0), 1)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "error": self.error,
+            "pages_parsed": self.pages_parsed,
+            "total_pages": self.total_pages,
+            "chunks_embedded": self.chunks_embedded,
+            "progress": round(self.pages_parsed / self.total_pages, 3) if self.total_pages else None,
+            "eta_seconds": self.eta(),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestionJobManager:
+    def __init__(
+        self,
+        vector_db,
+        workers: int = None,
+        max_pending: int = None,
+        nice: int = 10,
+        max_yield_seconds: float = 5.0,
+        history: int = 100
+    ):
+        """
+        Parameters
+        ----------
+        vector_db : VectorDB
+            Vector database where the files are ingested.
+        workers : int, optional
+            Max number of files ingested at the same time. Defaults to the `INGEST_JOB_WORKERS` environment
+            variable or 1.
+        max_pending : int, optional
+            Max number of queued and running jobs; more submissions are rejected. Defaults to `INGEST_MAX_PENDING`
+            or 1000 (an archive queues one job per PDF).
+        nice : int
+            Niceness added to the worker threads (Linux only), so the OS schedules the queries first.
+        max_yield_seconds : float
+            Max time a worker waits between two batches for the running queries to finish, so jobs aren't starved
+            under constant traffic.
+        history : int
+            Number of finished jobs kept to be polled.
+        """
+        self.vector_db = vector_db
+        self.workers = workers or int(os.getenv("INGEST_JOB_WORKERS", "1"))
+        self.max_pending = max_pending or int(os.getenv("INGEST_MAX_PENDING", "1000"))
+        self.nice = nice
+        self.max_yield_seconds = max_yield_seconds
+        self.history = history
+
+        self._jobs = OrderedDict()  # {job id: IngestionJob}, oldest first
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="ingestion", initializer=self._lower_priority
+        )
+        # Number of interactive queries being answered, the workers pause while it isn't 0.
+        self._active_queries = 0
+        self._idle = threading.Condition()
+
+    def _lower_priority(self):
+        try:
+            # On Linux every thread has its own niceness.
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), os.getpriority(os.PRIO_PROCESS, 0) + self.nice)
+        except (AttributeError, OSError) as e:
+            print(f"[WARN] The priority of the ingestion workers couldn't be lowered: {e}")
+
+    @contextmanager
+    def interactive(self):
+        """
+        Context manager around the handling of an interactive query: ingestion jobs wait for it to finish before
+        processing their next batch.
+        """
+        with self._idle:
+            self._active_queries += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self._active_queries -= 1
+                self._idle.notify_all()
+
+    def _yield_to_queries(self):
+        with self._idle:
+            self._idle.wait_for(lambda: self._active_queries == 0, timeout=self.max_yield_seconds)
+
+    def submit(self, path: str, tags: list[str] = None, cleanup: bool = True) -> IngestionJob:
+        """
+        Queues the ingestion of a file and returns its job right away.
+
+        Raises
+        ------
+        RuntimeError
+            If there are already `max_pending` unfinished jobs.
+        ValueError
+            If the same file is already being ingested.
+        """
+        with self._lock:
+            pending = [job for job in self._jobs.values() if not job.finished]
+            if len(pending) >= self.max_pending:
+                raise RuntimeError(f"Too many pending ingestion jobs ({len(pending)}), try again later.")
+            if any(job.path == path for job in pending):
+                raise ValueError(f"{os.path.basename(path)} is already being ingested.")
+            job = IngestionJob(path, tags=tags, cleanup=cleanup)
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> IngestionJob:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> list[IngestionJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def busy(self, path: str) -> bool:
+        """
+        Whether an unfinished job is ingesting `path`.
+        """
+        with self._lock:
+            return any(job.path == path and not job.finished for job in self._jobs.values())
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self._jobs[job_id]
+
+    def _run(self, job: IngestionJob):
+        job.status = RUNNING
+        job.started_at = time.time()
+
+        def progress(pages_parsed, total_pages, chunks_embedded):
+            job.pages_parsed, job.total_pages, job.chunks_embedded = pages_parsed, total_pages, chunks_embedded
+            self._yield_to_queries()
+
+        try:
+            self._yield_to_queries()
+            stored = self.vector_db.upload_document(job.path, tags=job.tags, progress=progress)
+            job.status = DONE if stored else FAILED
+            if not stored:
+                job.error = "The document couldn't be ingested."
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            if job.cleanup and os.path.exists(job.path):
+                os.remove(job.path)
+            print(f"Ingestion job {job.id} ({job.filename}) {job.status} in {job.finished_at - job.started_at:.1f}s")
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,256 @@
+"""
+Process-wide registry of the models used by the project (sentence-transformers, cross-encoders, tokenizers...).
+
+Every component asks the registry for the models it needs instead of loading them itself, so a model used by the
+ChatBot, the VectorDB and the evaluation scripts is loaded only once per process. The registry keeps a reference count
+of every model, applies the same device/precision policy to all of them and can report how much memory they use.
+"""
+import os
+import threading
+from langchain_core.embeddings import Embeddings
+
+# Names of the models shared by the ChatBot and the VectorDB.
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+RERANKER_MODEL_NAME = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+
+# Supported precisions and their torch dtype names.
+PRECISIONS = {"float32": "float32", "float16": "float16", "bfloat16": "bfloat16"}
+
+
+class ModelRegistry:
+    def __init__(self, device: str = None, precision: str = None):
+        """
+        Parameters
+        ----------
+        device : str, optional
+            Device where the models are placed: "cpu", "cuda", "mps" or "auto" (picks the best available one).
+            Defaults to the `MODELS_DEVICE` environment variable or "auto".
+        precision : str, optional
+            Precision of the model weights: "float32", "float16" or "bfloat16". Half precisions are only applied on
+            accelerators, on CPU models are always kept in float32. Defaults to the `MODELS_PRECISION` environment
+            variable or "float32".
+        """
+        self.device = device or os.getenv("MODELS_DEVICE", "auto")
+        self.precision = precision or os.getenv("MODELS_PRECISION", "float32")
+        if self.precision not in PRECISIONS:
+            print(f"Not supported precision: {self.precision}. Defaulting to float32.")
+            self.precision = "float32"
+
+        self._models = {}  # {(kind, name): model}
+        self._refcounts = {}  # {(kind, name): number of holders}
+        self._loaders = {
+            "sentence_transformer": self._load_sentence_transformer,
+            "cross_encoder": self._load_cross_encoder,
+            "tokenizer": self._load_tokenizer,
+        }
+        self._lock = threading.RLock()
+        # One lock per model being loaded, so different models load in parallel (e.g. in the startup threads) and
+        # concurrent requests of the same model wait for a single load.
+        self._load_locks = {}  # {(kind, name): Lock}
+        # Local directories the models are loaded from instead of the Hub (set by an artifact bundle, see
+        # `src/artifacts.py`). Offline, models missing from them can't be loaded.
+        self.model_paths = {}  # {(kind, name): path}
+        self.offline = False
+
+    def resolve_device(self) -> str:
+        """
+        Returns the device where models are placed, resolving "auto" to the best available one.
+        """
+        if self.device != "auto":
+            return self.device
+        import torch
+        if torch.cuda.is_available():
+            return "cuda"
+        if torch.backends.mps.is_available():
+            return "mps"
+        return "cpu"
+
+    def acquire(self, kind: str, name: str, loader=None):
+        """
+        Returns the shared instance of a model, loading it the first time it is requested, and increases its
+        reference count. Every `acquire` should be paired with a `release` once the model isn't needed anymore.
+
+        Parameters
+        ----------
+        kind : str
+            Kind of model ("sentence_transformer", "cross_encoder", "tokenizer" or any custom kind).
+        name : str
+            Name (or local path) of the model.
+        loader : callable, optional
+            Function `loader(name)` used to load models of custom kinds.
+        """
+        key = (kind, name)
+        with self._lock:
+            if key in self._models:
+                self._refcounts[key] += 1
+                return self._models[key]
+            loader = loader or self._loaders.get(kind)
+            if loader is None:
+                raise ValueError(f"No loader registered for models of kind '{kind}'.")
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                loaded = key in self._models
+            if not loaded:
+                path = self.model_paths.get(key)
+                if path is None and self.offline:
+                    raise RuntimeError(f"The {kind} model {name} is not in the artifact bundle (offline mode).")
+                print(f"Loading {kind} model: {name}" + (f" from {path}" if path else ""))
+                model = loader(path or name)
+                with self._lock:
+                    self._models[key] = model
+                    self._refcounts[key] = 0
+        with self._lock:
+            self._refcounts[key] += 1
+            return self._models[key]
+
+    def release(self, kind: str, name: str):
+        """
+        Decreases the reference count of a model and unloads it once nobody holds it.
+        """
+        key = (kind, name)
+        with self._lock:
+            if key not in self._models:
+                return
+            self._refcounts[key] -= 1
+            if self._refcounts[key] > 0:
+                return
+            del self._models[key]
+            del self._refcounts[key]
+        if self.resolve_device() == "cuda":
+            import torch
+            torch.cuda.empty_cache()
+
+    def sentence_transformer(self, name: str = EMBEDDING_MODEL_NAME):
+        return self.acquire("sentence_transformer", name)
+
+    def cross_encoder(self, name: str = RERANKER_MODEL_NAME):
+        return self.acquire("cross_encoder", name)
+
+    def tokenizer(self, name: str):
+        return self.acquire("tokenizer", name)
+
+    def _apply_precision(self, module):
+        """
+        Casts a torch module to the registry precision (only on accelerators).
+        """
+        if self.precision == "float32":
+            return module
+        if self.resolve_device() == "cpu":
+            print(f"Precision {self.precision} is not applied on CPU. Keeping float32.")
+            return module
+        import torch
+        return module.to(getattr(torch, PRECISIONS[self.precision]))
+
+    def _load_sentence_transformer(self, name):
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(name, device=self.resolve_device())
+        return self._apply_precision(model)
+
+    def _load_cross_encoder(self, name):
+        from sentence_transformers import CrossEncoder
+        model = CrossEncoder(name, device=self.resolve_device())
+        model.model = self._apply_precision(model.model)
+        return model
+
+    def _load_tokenizer(self, name):
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(name, token=os.getenv("HUGGINGFACE_TOKEN", None))
+
+    @staticmethod
+    def _module_size(model):
+        """
+        Returns the number of parameters and the size in bytes of the weights of a model (0 if it has no weights).
+        """
+        module = getattr(model, "model", model)  # CrossEncoder wraps the torch module
+        if not hasattr(module, "parameters"):
+            return 0, 0
+        n_params, n_bytes = 0, 0
+        for param in module.parameters():
+            n_params += param.numel()
+            n_bytes += param.numel() * param.element_size()
+        return n_params, n_bytes
+
+    def memory_report(self) -> list[dict]:
+        """
+        Returns, for every loaded model, its kind, name, reference count, number of parameters and weights size.
+        """
+        with self._lock:
+            items = list(self._models.items())
+            refcounts = dict(self._refcounts)
+        report = []
+        for (kind, name), model in items:
+            n_params, n_bytes = self._module_size(model)
+            report.append({
+                "kind": kind,
+                "name": name,
+                "refs": refcounts[(kind, name)],
+                "parameters": n_params,
+                "size_mb": round(n_bytes / 1024 ** 2, 1),
+            })
+        return report
+
+    def print_memory_report(self):
+        report = self.memory_report()
+        print(f"Loaded models (device: {self.resolve_device()}, precision: {self.precision}):")
+        for item in report:
+            print(f"  - [{item['kind']}] {item['name']}: {item['size_mb']} MB, "
+                  f"{item['parameters']} parameters, {item['refs']} reference(s)")
+        print(f"  Total: {round(sum(item['size_mb'] for item in report), 1)} MB")
+
+
+# Registry shared by the whole process.
+registry = ModelRegistry()
+
+
+class SharedEmbeddings(Embeddings):
+    """
+    LangChain embeddings backed by the shared sentence-transformer of the registry, so the vector store and the
+    ChatBot use the same weights. It embeds exactly like `HuggingFaceEmbeddings` (newlines are replaced by spaces).
+    Document embeddings can be served from a persistent `EmbeddingCache`; query embeddings are never cached.
+    """
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, model_registry: ModelRegistry = registry, cache=None):
+        self.model_name = model_name
+        self.registry = model_registry
+        self.client = model_registry.sentence_transformer(model_name)
+        self.cache = cache
+
+    def _encode(self, texts: list[str], batch_size: int = 32, pool: dict = None) -> list[list[float]]:
+        """
+        Embeds a list of texts. If a multi-process `pool` (from `client.start_multi_process_pool()`) is given, the
+        texts are encoded by its processes.
+        """
+        if not texts:
+            return []
+        texts = [text.replace("\n", " ") for text in texts]
+        if pool is not None:
+            return self.client.encode_multi_process(texts, pool, batch_size=batch_size).tolist()
+        return self.client.encode(texts, batch_size=batch_size, show_progress_bar=False).tolist()
+
+    def embed_documents(self, texts: list[str], batch_size: int = 32, pool: dict = None) -> list[list[float]]:
+        """
+        Embeds a list of document chunks. Only the chunks missing from the cache (if any) are encoded.
+        """
+        if self.cache is None:
+            return self._encode(texts, batch_size=batch_size, pool=pool)
+        vectors = self.cache.get_many(self.model_name, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            new_vectors = self._encode(missing_texts, batch_size=batch_size, pool=pool)
+            self.cache.put_many(self.model_name, missing_texts, new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+        return vectors
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        return self._encode(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._encode([text])[0]
+
+    def close(self):
+        """
+        Releases the shared model.
+        """
+        self.registry.release("sentence_transformer", self.model_name)
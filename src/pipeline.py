@@ -0,0 +1,129 @@
+"""
+Small DAG runner for the stages of the retrieval pipeline.
+
+Every stage is a function of the results of the stages it depends on. A stage is submitted to a thread pool as soon
+as all its dependencies are done, so independent stages (e.g. the translation of a query and the search of its
+original text) overlap and the latency approaches the critical path of the DAG instead of the sum of the stages.
+Every stage can have a timeout, counted from the moment its function starts running (not while it waits for a thread
+of a busy pool): a stage that fails or times out takes its `fallback` value, or fails the whole pipeline if it has
+none. Threads can't be interrupted, so a timed out stage keeps running in the background and its result is ignored.
+"""
+import time
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+
+_REQUIRED = object()
+# Max seconds between checks of the stages that are still waiting for a thread, whose deadline isn't known yet.
+_QUEUED_POLL = 0.05
+
+
+class StageError(Exception):
+    """
+    A stage without fallback failed or timed out.
+    """
+
+
+class Stage:
+    def __init__(self, name: str, fn, deps: tuple = (), timeout: float = None, fallback=_REQUIRED):
+        """
+        Parameters
+        ----------
+        name : str
+            Name of the stage, the key of its result.
+        fn : callable
+            Function called with the results of `deps` as keyword arguments.
+        deps : tuple[str]
+            Names of the stages whose results it needs.
+        timeout : float, optional
+            Max seconds it can run.
+        fallback : optional
+            Result used if it fails or times out. Without it, the pipeline fails.
+        """
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.fallback = fallback
+
+
+class Pipeline:
+    def __init__(self, executor, stages: list[Stage]):
+        """
+        Parameters
+        ----------
+        executor : concurrent.futures.Executor
+            Pool where the stages run.
+        stages : list[Stage]
+            Stages of the DAG. Dependencies must name stages of the list.
+        """
+        self.executor = executor
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            unknown = [dep for dep in stage.deps if dep not in self.stages]
+            if unknown:
+                raise ValueError(f"Stage {stage.name} depends on unknown stages: {unknown}")
+        self.results = {}
+        self.timings = {}  # {stage: seconds}, of the stages that ended
+        self.failed = {}  # {stage: "timeout" or error message}
+
+    def _settle(self, stage: Stage, error: str):
+        self.failed[stage.name] = error
+        if stage.fallback is _REQUIRED:
+            raise StageError(f"Stage {stage.name} failed: {error}")
+        print(f"[WARN] Stage {stage.name} failed ({error}), using its fallback.")
+        self.results[stage.name] = stage.fallback
+
+    def run(self, stop=None) -> dict:
+        """
+        Runs the stages and returns their results {stage: result}. If `stop(results)` becomes true when a stage ends,
+        the pipeline returns right away with the results so far (the running stages are abandoned).
+        """
+        pending = dict(self.stages)
+        running = {}  # {future: stage}
+        started = {}  # {stage: time its function started running}
+        lock = threading.Lock()
+
+        def call(stage, kwargs):
+            with lock:
+                started[stage.name] = time.perf_counter()
+            return stage.fn(**kwargs)
+
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if all(dep in self.results for dep in stage.deps):
+                    del pending[name]
+                    kwargs = {dep: self.results[dep] for dep in stage.deps}
+                    running[self.executor.submit(call, stage, kwargs)] = stage
+            if not running:
+                raise StageError(f"Stages {list(pending)} can't run: their dependencies form a cycle.")
+
+            now = time.perf_counter()
+            with lock:
+                starts = dict(started)
+            deadlines = [
+                starts[stage.name] + stage.timeout - now if stage.name in starts else _QUEUED_POLL
+                for stage in running.values() if stage.timeout is not None
+            ]
+            timeout = max(min(deadlines), 0) if deadlines else None
+            done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+            now = time.perf_counter()
+            with lock:
+                starts = dict(started)
+            for future in list(running):
+                stage = running[future]
+                start = starts.get(stage.name, now)
+                if future in done:
+                    del running[future]
+                    self.timings[stage.name] = round(now - start, 4)
+                    error = future.exception()
+                    if error is None:
+                        self.results[stage.name] = future.result()
+                    else:
+                        self._settle(stage, str(error))
+                elif stage.timeout is not None and stage.name in starts and now - start >= stage.timeout:
+                    del running[future]
+                    self.timings[stage.name] = round(now - start, 4)
+                    self._settle(stage, "timeout")
+            if stop is not None and stop(self.results):
+                break
+        return self.results
@@ -0,0 +1,364 @@
+"""
+Compact (quantized and dimension-reduced) copy of the chunk embeddings for the first-pass dense search.
+
+The 768-d float32 vectors of the collection are reduced with PCA or Matryoshka truncation (optional) and quantized to
+int8 or binary codes, which are the only vectors kept in memory. A search scans the codes to get `rescore_factor * k`
+candidates, and then rescores them exactly against the full-precision vectors, which are stored on disk and read
+through a memory map. Scores are squared L2 distances, like the ones Chroma returns, so both stores are interchangeable.
+
+New vectors are appended to the full-precision file, but the codes and the ids are saved lazily (every `save_every`
+changed rows, after a rebuild of the codes and on `flush`/exit), so an ingestion in many small batches doesn't rewrite
+the whole state every time. Rows appended after the last save are dropped when the index is loaded again.
+"""
+import os
+import json
+import atexit
+import threading
+import numpy as np
+
+METHODS = ("int8", "binary")
+REDUCTIONS = ("pca", "matryoshka")
+
+# Number of set bits of every byte, to compute Hamming distances between packed binary codes.
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class QuantizedIndex:
+    def __init__(
+        self,
+        path: str,
+        method: str = "int8",
+        dims: int = None,
+        reduction: str = "pca",
+        rescore_factor: int = 4,
+        block_size: int = 65536,
+        save_every: int = 10000
+    ):
+        """
+        Parameters
+        ----------
+        path : str
+            Folder where the codes, the quantization parameters and the full-precision vectors are persisted.
+        method : str
+            Quantization of the codes: "int8" (1 byte per dimension) or "binary" (1 bit per dimension).
+        dims : int, optional
+            Number of dimensions kept before quantizing. All of them if None.
+        reduction : str
+            How dimensions are reduced when `dims` is given: "pca" (projection on the principal components of the
+            stored vectors) or "matryoshka" (first `dims` dimensions, for models trained with Matryoshka loss).
+        rescore_factor : int
+            Candidates rescored with the full-precision vectors, as a multiple of the requested k.
+        block_size : int
+            Number of codes scanned at once, which bounds the temporary memory of a search.
+        save_every : int
+            Number of added or removed rows after which the state is saved (it's also saved by `flush`).
+        """
+        if method not in METHODS:
+            raise ValueError(f"Not supported quantization method: {method}. Use one of {METHODS}.")
+        if reduction not in REDUCTIONS:
+            raise ValueError(f"Not supported dimension reduction: {reduction}. Use one of {REDUCTIONS}.")
+        self.path = path
+        self.method = method
+        self.dims = dims
+        self.reduction = reduction
+        self.rescore_factor = rescore_factor
+        self.block_size = block_size
+        self.save_every = save_every
+        os.makedirs(path, exist_ok=True)
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._state_path = os.path.join(path, "state.npz")
+        self._ids_path = os.path.join(path, "ids.json")
+        self._lock = threading.RLock()
+
+        self.ids = []  # Row of the full-precision file -> chunk id
+        self._rows = {}  # Chunk id -> row
+        self.alive = np.zeros(0, dtype=bool)  # Rows not deleted
+        self.codes = None
+        self.dim = None  # Dimension of the full-precision vectors
+        self._fitted_rows = 0  # Number of rows when the parameters were fitted
+        self._mean = self._components = self._offset = self._scale = None
+        self._vectors = None
+        self._unsaved = 0  # Rows added or removed since the last save
+        self._load()
+        atexit.register(self.flush)
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def __contains__(self, chunk_id):
+        row = self._rows.get(chunk_id)
+        return row is not None and bool(self.alive[row])
+
+    def settings(self) -> dict:
+        return {"method": self.method, "dims": self.dims, "reduction": self.reduction}
+
+    def _load(self):
+        if not os.path.exists(self._state_path):
+            return
+        with open(self._ids_path, encoding="utf-8") as f:
+            stored = json.load(f)
+        if stored["settings"] != self.settings():
+            print(f"Quantized index settings changed ({stored['settings']} -> {self.settings()}). Rebuilding it.")
+            self.clear()
+            return
+        state = np.load(self._state_path)
+        self.ids = stored["ids"]
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self.alive = state["alive"]
+        self.codes = state["codes"]
+        self.dim = int(state["dim"])
+        self._fitted_rows = int(state["fitted_rows"])
+        self._mean, self._components = state["mean"], state["components"]
+        self._offset, self._scale = state["offset"], state["scale"]
+        # Vectors appended after the last save have no code nor id: they are dropped (and added again by the caller).
+        size = len(self.ids) * self.dim * np.dtype(np.float32).itemsize
+        stored_size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        if stored_size < size:
+            print("The quantized index is corrupted (missing vectors). Rebuilding it.")
+            self.clear()
+            return
+        if stored_size > size:
+            os.truncate(self._vectors_path, size)
+        self._open_vectors()
+
+    def _save(self):
+        np.savez(
+            self._state_path,
+            alive=self.alive, codes=self.codes, dim=self.dim, fitted_rows=self._fitted_rows,
+            mean=self._mean, components=self._components, offset=self._offset, scale=self._scale
+        )
+        with open(self._ids_path, "w", encoding="utf-8") as f:
+            json.dump({"settings": self.settings(), "ids": self.ids}, f)
+        self._unsaved = 0
+
+    def flush(self):
+        """
+        Saves the codes, the ids and the parameters if they changed since the last save.
+        """
+        with self._lock:
+            if self._unsaved and self.codes is not None:
+                self._save()
+
+    def close(self):
+        self.flush()
+
+    def _open_vectors(self):
+        self._vectors = None
+        if self.ids:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(len(self.ids), self.dim))
+
+    def clear(self):
+        with self._lock:
+            self._vectors = None
+            for path in (self._vectors_path, self._state_path, self._ids_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.ids, self._rows = [], {}
+            self.alive = np.zeros(0, dtype=bool)
+            self.codes = None
+            self.dim = None
+            self._fitted_rows = 0
+            self._unsaved = 0
+
+    def _fit(self, sample: np.ndarray):
+        """
+        Fits the dimension reduction and the int8 ranges on a sample of the full-precision vectors.
+        """
+        dims = self.dims or sample.shape[1]
+        if dims < sample.shape[1] and self.reduction == "pca" and len(sample) > 1:
+            self._mean = sample.mean(axis=0)
+            _, _, vt = np.linalg.svd(sample - self._mean, full_matrices=False)
+            components = vt[:dims]
+            if len(components) < dims:
+                # Fewer samples than dimensions: the remaining directions are the first unused axes.
+                components = np.vstack([components, np.eye(sample.shape[1], dtype=np.float32)[:dims - len(components)]])
+            self._components = components.T.astype(np.float32)
+        else:
+            # Matryoshka (or no reduction): the first `dims` dimensions, no projection matrix is needed.
+            self._mean = np.zeros(sample.shape[1], dtype=np.float32)
+            self._components = np.zeros((0, 0), dtype=np.float32)
+        reduced = self._reduce(sample)
+        # int8 ranges are taken per dimension from the 0.1-99.9 percentiles, so outliers don't waste the 256 levels.
+        low, high = np.percentile(reduced, [0.1, 99.9], axis=0)
+        self._offset = ((low + high) / 2).astype(np.float32)
+        self._scale = (np.maximum(high - low, 1e-6) / 254).astype(np.float32)
+
+    def _reduce(self, vectors: np.ndarray) -> np.ndarray:
+        if self._components.size:
+            reduced = (vectors - self._mean) @ self._components
+        else:
+            reduced = vectors[:, :self.dims or vectors.shape[1]]
+        if self.dims and self.reduction == "matryoshka":
+            norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+            reduced = reduced / np.where(norms == 0, 1, norms)
+        return reduced.astype(np.float32)
+
+    def _quantize(self, vectors: np.ndarray) -> np.ndarray:
+        reduced = self._reduce(vectors)
+        if self.method == "binary":
+            return np.packbits(reduced > 0, axis=1)
+        return np.clip(np.rint((reduced - self._offset) / self._scale), -127, 127).astype(np.int8)
+
+    def _requantize(self):
+        """
+        Fits the parameters again on (a sample of) the stored vectors and recomputes all the codes. It is done when
+        the index has doubled its size since the last fit, so early parameters fitted on few vectors are replaced.
+        """
+        rows = np.flatnonzero(self.alive)
+        if len(rows) > 20000:
+            rows = np.sort(np.random.default_rng(0).choice(rows, 20000, replace=False))
+        self._fit(np.asarray(self._vectors[rows]))
+        self.codes = np.concatenate([
+            self._quantize(np.asarray(self._vectors[start:start + self.block_size]))
+            for start in range(0, len(self.ids), self.block_size)
+        ])
+        self._fitted_rows = len(self.ids)
+
+    def add(self, ids: list[str], vectors: list[list[float]]):
+        """
+        Adds vectors. Ids that are already stored are skipped: chunk ids are derived from the content of the chunk,
+        so the same id always has the same embedding.
+        """
+        with self._lock:
+            new = {}
+            for chunk_id, vector in zip(ids, vectors):
+                if chunk_id not in self and chunk_id not in new:
+                    new[chunk_id] = vector
+            if not new:
+                return
+            vectors = np.asarray(list(new.values()), dtype=np.float32)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._fit(vectors)
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            codes = self._quantize(vectors)
+            self.codes = codes if self.codes is None else np.concatenate([self.codes, codes])
+            for chunk_id in new:
+                self._rows[chunk_id] = len(self.ids)
+                self.ids.append(chunk_id)
+            self.alive = np.concatenate([self.alive, np.ones(len(new), dtype=bool)])
+            self._open_vectors()
+            self._unsaved += len(new)
+            if len(self.ids) >= 2 * self._fitted_rows:
+                self._requantize()
+                self._save()
+            elif self._unsaved >= self.save_every:
+                self._save()
+
+    def remove(self, ids: list[str]):
+        """
+        Marks vectors as deleted. Their rows are reclaimed once they are half of the index.
+        """
+        with self._lock:
+            rows = [self._rows.pop(chunk_id) for chunk_id in ids if chunk_id in self._rows]
+            if not rows:
+                return
+            self.alive[rows] = False
+            self._unsaved += len(rows)
+            if (~self.alive).sum() * 2 >= len(self.alive):
+                # The full-precision file is rewritten with the new rows, so the state must match it right away.
+                self._compact()
+                self._save()
+            elif self._unsaved >= self.save_every:
+                self._save()
+
+    def _compact(self):
+        rows = np.flatnonzero(self.alive)
+        vectors = np.asarray(self._vectors[rows]) if len(rows) else np.zeros((0, self.dim), dtype=np.float32)
+        codes = self.codes[rows]
+        ids = [self.ids[row] for row in rows]
+        self._vectors = None
+        with open(self._vectors_path, "wb") as f:
+            f.write(vectors.tobytes())
+        self.ids = ids
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(ids)}
+        self.codes = codes
+        self.alive = np.ones(len(ids), dtype=bool)
+        self._open_vectors()
+
+    def _first_pass(self, queries: np.ndarray, n_candidates: int, allowed: np.ndarray = None) -> np.ndarray:
+        """
+        Rows and scores of the `n_candidates` best codes for every query (higher is better: inner product for int8
+        codes, minus the Hamming distance for binary codes). If `allowed` (a mask of rows) is given, only those rows
+        are candidates.
+        """
+        reduced = self._reduce(queries)
+        if self.method == "binary":
+            query_codes = np.packbits(reduced > 0, axis=1)
+        else:
+            # <q, offset + scale * code> = <q, offset> + <q * scale, code>; the first term is the same for every code.
+            weights = reduced * self._scale
+        scores = np.empty((len(queries), len(self.ids)), dtype=np.float32)
+        for start in range(0, len(self.ids), self.block_size):
+            block = self.codes[start:start + self.block_size]
+            if self.method == "binary":
+                xor = np.bitwise_xor(block[None, :, :], query_codes[:, None, :])
+                scores[:, start:start + len(block)] = -_POPCOUNT[xor].sum(axis=2, dtype=np.int32)
+            else:
+                scores[:, start:start + len(block)] = weights @ block.T.astype(np.float32)
+        mask = self.alive if allowed is None else self.alive & allowed
+        scores[:, ~mask] = -np.inf
+        n_candidates = min(n_candidates, int(mask.sum()))
+        candidates = np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates]
+        return candidates, np.take_along_axis(scores, candidates, axis=1)
+
+    def search(
+        self, query_vectors: list[list[float]], k: int = 5, rescore: bool = True, ids: list[str] = None
+    ) -> list[list[tuple]]:
+        """
+        Returns the k nearest chunks of every query as lists of (chunk id, squared L2 distance), closest first.
+        Candidates of the first pass over the codes are rescored with the full-precision vectors (unless
+        `rescore` is False: then the k best codes are returned in the order of the first pass). If `ids` is given,
+        only those chunks are searched (pre-filtering).
+        """
+        with self._lock:
+            if not len(self) or k <= 0:
+                return [[] for _ in query_vectors]
+            queries = np.asarray(query_vectors, dtype=np.float32)
+            allowed = None
+            if ids is not None:
+                allowed = np.zeros(len(self.alive), dtype=bool)
+                allowed[[self._rows[chunk_id] for chunk_id in ids if chunk_id in self._rows]] = True
+                if not allowed.any():
+                    return [[] for _ in query_vectors]
+            n_candidates = k * self.rescore_factor if rescore else k
+            candidates, first_pass_scores = self._first_pass(queries, n_candidates, allowed)
+            results = []
+            for query, rows, row_scores in zip(queries, candidates, first_pass_scores):
+                sorting = np.argsort(rows)  # Sequential reads of the memory-mapped file
+                rows, row_scores = rows[sorting], row_scores[sorting]
+                vectors = np.asarray(self._vectors[rows])
+                distances = ((vectors - query) ** 2).sum(axis=1)
+                order = np.argsort(distances)[:k] if rescore else np.argsort(-row_scores, kind="stable")[:k]
+                results.append([(self.ids[rows[i]], float(distances[i])) for i in order])
+            return results
+
+    def memory_bytes(self) -> int:
+        """
+        Bytes kept in memory by the first pass: the codes and the reduction/quantization parameters.
+        """
+        if self.codes is None:
+            return 0
+        params = (self._mean, self._components, self._offset, self._scale)
+        return int(self.codes.nbytes + sum(p.nbytes for p in params))
+
+    def disk_bytes(self) -> int:
+        paths = (self._vectors_path, self._state_path, self._ids_path)
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def parse_spec(spec: str) -> dict:
+    """
+    Parses a quantization spec "method[:dims[:reduction]]" (e.g. "int8", "binary:256:pca") into the keyword
+    arguments of `QuantizedIndex`. An empty spec means no quantization (None).
+    """
+    if not spec:
+        return None
+    parts = spec.split(":")
+    kwargs = {"method": parts[0]}
+    if len(parts) > 1 and parts[1]:
+        kwargs["dims"] = int(parts[1])
+    if len(parts) > 2 and parts[2]:
+        kwargs["reduction"] = parts[2]
+    return kwargs
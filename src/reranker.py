@@ -0,0 +1,121 @@
+"""
+CrossEncoder reranking of the retrieved chunks, with batching controls, a score cache and latency stats.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """
+    Key of a query in the score cache: lowercase, single spaces and no surrounding punctuation, so trivial variations
+    of the same query share their scores.
+    """
+    return " ".join(query.lower().split()).strip(" .,;:!?¡¿")
+
+
+class Reranker:
+    def __init__(self, model, batch_size: int = None, max_length: int = None, cache_size: int = None):
+        """
+        Scores (query, chunk) pairs with a CrossEncoder.
+
+        The pairs are sorted by chunk length before they are batched, so every batch holds texts of similar length
+        and little padding is computed. Scores are cached by (normalized query, chunk id): chunk ids are derived from
+        their content, so a cached score never gets stale. The latency of every call is recorded.
+
+        Parameters
+        ----------
+        model : CrossEncoder
+            Model (shared through the model registry).
+        batch_size : int, optional
+            Pairs scored per forward pass. Defaults to the `RERANKER_BATCH_SIZE` environment variable or 16.
+        max_length : int, optional
+            Max number of tokens of a pair (longer chunks are truncated). Defaults to `RERANKER_MAX_LENGTH` or the
+            max length of the model. It is set on the model, so it applies to the whole process.
+        cache_size : int, optional
+            Max number of cached scores (least recently used are evicted, 0 disables the cache). Defaults to
+            `RERANKER_CACHE_SIZE` or 50000.
+        """
+        self.model = model
+        self.batch_size = batch_size or int(os.getenv("RERANKER_BATCH_SIZE", "16"))
+        max_length = max_length or int(os.getenv("RERANKER_MAX_LENGTH", "0"))
+        if max_length:
+            self.model.max_length = max_length
+        self.cache_size = int(os.getenv("RERANKER_CACHE_SIZE", "50000") if cache_size is None else cache_size)
+
+        self._scores = OrderedDict()  # {(normalized query, chunk id): score}, least recently used first
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.pairs = 0
+        self.hits = 0
+        self.misses = 0
+        self._latencies = deque(maxlen=1000)  # Seconds of the most recent calls
+
+    def score(self, query: str, chunks: list[dict]) -> list[float]:
+        """
+        Scores every chunk (a dict with its "content" and, to be cached, its "id") against the query.
+        """
+        start = time.perf_counter()
+        key = normalize_query(query)
+        scores = [None] * len(chunks)
+        with self._lock:
+            for i, chunk in enumerate(chunks):
+                cached = self._scores.get((key, chunk.get("id")))
+                if cached is not None:
+                    self._scores.move_to_end((key, chunk["id"]))
+                    scores[i] = cached
+
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            # Sorted by length, the batches are padded to similar lengths.
+            missing.sort(key=lambda i: len(chunks[i]["content"]))
+            predicted = self.model.predict(
+                [(query, chunks[i]["content"]) for i in missing],
+                batch_size=self.batch_size,
+                show_progress_bar=False
+            )
+            for i, score in zip(missing, np.asarray(predicted, dtype=np.float32).tolist()):
+                scores[i] = score
+
+        with self._lock:
+            if self.cache_size > 0:
+                for i in missing:
+                    if chunks[i].get("id") is not None:
+                        self._scores[(key, chunks[i]["id"])] = scores[i]
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+            self.calls += 1
+            self.pairs += len(chunks)
+            self.hits += len(chunks) - len(missing)
+            self.misses += len(missing)
+            self._latencies.append(time.perf_counter() - start)
+        return scores
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+
+    def stats(self) -> dict:
+        """
+        Counters of the calls and latency (ms) of the recent calls.
+        """
+        with self._lock:
+            latencies = np.asarray(self._latencies) * 1000
+            return {
+                "calls": self.calls,
+                "pairs": self.pairs,
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "hit_rate": round(self.hits / self.pairs, 4) if self.pairs else 0.0,
+                "cached_scores": len(self._scores),
+                "batch_size": self.batch_size,
+                "max_length": getattr(self.model, "max_length", None),
+                "latency_ms": {
+                    "last": round(float(latencies[-1]), 2),
+                    "mean": round(float(latencies.mean()), 2),
+                    "p50": round(float(np.percentile(latencies, 50)), 2),
+                    "p95": round(float(np.percentile(latencies, 95)), 2),
+                } if len(latencies) else None,
+            }
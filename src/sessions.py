@@ -0,0 +1,212 @@
+"""
+Per-conversation state, so one process can serve many concurrent conversations with the same (stateless) ChatBot.
+
+A `Conversation` holds the memory, the retrieved context and its sources of one conversation. The `SessionStore`
+keeps the active ones in memory, keyed by a session id, with LRU and TTL eviction. Evicted conversations can be spilled
+to a SQLite file, and are restored from it when their session comes back.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# Memory class to store and manage the chat history
+class Memory:
+    def __init__(self, max_messages_count=10):
+        self._memory = []
+        self.max_messages_count = max_messages_count
+    def update_memory(self, human_msg: str, ai_msg: str):
+        self._memory.append(
+            {"role": "user", "content": human_msg}
+        )
+        self._memory.append(
+            {"role": "assistant", "content": ai_msg}
+        )
+
+    def reset_memory(self):
+        self._memory = []
+
+    @property
+    def history(self):
+        return self._memory[-self.max_messages_count:]
+
+
+class Conversation:
+    """
+    State of one conversation: its memory, the context loaded for it (None if there's none) and its sources.
+    """
+    def __init__(self, session_id: str = None):
+        self.id = session_id or uuid.uuid4().hex
+        self.memory = Memory()
+        self.context = None
+        self.context_embedding = None  # Embedding of the query that retrieved the context
+        self.context_filters = None  # Metadata filter the context was retrieved with
+        self.sources = []
+        self.stage_timings = {}  # {stage: seconds} of its last retrieval
+        self.updated_at = time.time()
+        # Held while a request uses the conversation, so requests of the same conversation run one at a time.
+        self.lock = threading.Lock()
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "memory": self.memory._memory,
+            "max_messages_count": self.memory.max_messages_count,
+            "context": self.context,
+            "context_embedding": self.context_embedding,
+            "context_filters": self.context_filters,
+            "sources": self.sources,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "Conversation":
+        conversation = cls(state["id"])
+        conversation.memory = Memory(max_messages_count=state["max_messages_count"])
+        conversation.memory._memory = state["memory"]
+        conversation.context = state["context"]
+        conversation.context_embedding = state.get("context_embedding")
+        conversation.context_filters = state.get("context_filters")
+        conversation.sources = state["sources"]
+        conversation.updated_at = state["updated_at"]
+        return conversation
+
+
+class SessionStore:
+    def __init__(self, max_sessions: int = None, ttl: float = None, spill_path: str = None):
+        """
+        Parameters
+        ----------
+        max_sessions : int, optional
+            Max number of conversations kept in memory (the least recently used are evicted first). Defaults to the
+            `SESSION_MAX_ACTIVE` environment variable or 1000.
+        ttl : float, optional
+            Seconds a conversation is kept after its last request. Defaults to `SESSION_TTL` or 86400.
+        spill_path : str, optional
+            SQLite file where the conversations evicted from memory (but not expired) are kept. Defaults to
+            `SESSION_SPILL_PATH`; if it's not set, evicted conversations are dropped.
+        """
+        self.max_sessions = max_sessions or int(os.getenv("SESSION_MAX_ACTIVE", "1000"))
+        self.ttl = float(os.getenv("SESSION_TTL", str(24 * 3600)) if ttl is None else ttl)
+        self.spill_path = spill_path or os.getenv("SESSION_SPILL_PATH")
+
+        self._sessions = OrderedDict()  # {session id: Conversation}, least recently used first
+        self._lock = threading.Lock()
+        self._conn = None
+        if self.spill_path:
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.spill_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, state TEXT, updated_at REAL)"
+            )
+            self._conn.commit()
+        self.created = 0
+        self.evicted = 0
+        self.expired = 0
+        self.spilled = 0
+        self.restored = 0
+
+    def _expired(self, conversation: Conversation, now: float) -> bool:
+        return now - conversation.updated_at > self.ttl
+
+    def _load(self, session_id: str) -> Conversation:
+        if self._conn is None:
+            return None
+        row = self._conn.execute("SELECT state FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        self._conn.commit()
+        return Conversation.from_dict(json.loads(row[0]))
+
+    def _evict(self, now: float):
+        """
+        Drops the expired conversations and spills the least recently used ones beyond `max_sessions`. Conversations
+        being used by a request are never evicted.
+        """
+        spill = []
+        for session_id, conversation in list(self._sessions.items()):
+            if not self._expired(conversation, now) and len(self._sessions) <= self.max_sessions:
+                break  # The next ones were used more recently.
+            if conversation.lock.locked():
+                continue
+            if self._expired(conversation, now):
+                del self._sessions[session_id]
+                self.expired += 1
+            elif len(self._sessions) > self.max_sessions:
+                del self._sessions[session_id]
+                self.evicted += 1
+                spill.append(conversation)
+        if self._conn is not None and spill:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                [(c.id, json.dumps(c.to_dict()), c.updated_at) for c in spill]
+            )
+            self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl,))
+            self._conn.commit()
+            self.spilled += len(spill)
+
+    def get(self, session_id: str = None, create: bool = True) -> Conversation:
+        """
+        Conversation of a session (restored from the spill file if it was evicted). A new one is created if it
+        doesn't exist (or has expired) and `create`, otherwise None is returned.
+        """
+        now = time.time()
+        with self._lock:
+            conversation = self._sessions.get(session_id) if session_id else None
+            if conversation is None and session_id:
+                conversation = self._load(session_id)
+                if conversation is not None and not self._expired(conversation, now):
+                    self.restored += 1
+            if conversation is not None and self._expired(conversation, now) and not conversation.lock.locked():
+                self._sessions.pop(session_id, None)
+                self.expired += 1
+                conversation = None
+            if conversation is None:
+                if not create:
+                    return None
+                conversation = Conversation(session_id)
+                self.created += 1
+            conversation.updated_at = now
+            self._sessions[conversation.id] = conversation
+            self._sessions.move_to_end(conversation.id)
+            self._evict(now)
+            return conversation
+
+    @contextmanager
+    def session(self, session_id: str = None):
+        """
+        Context manager that yields the conversation of a session (see `get`), holding its lock.
+        """
+        conversation = self.get(session_id)
+        with conversation.lock:
+            yield conversation
+            conversation.updated_at = time.time()
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            found = self._sessions.pop(session_id, None) is not None
+            if self._conn is not None:
+                found = self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0 or found
+                self._conn.commit()
+            return found
+
+    def stats(self) -> dict:
+        with self._lock:
+            spilled_now = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] if self._conn else 0
+            return {
+                "active": len(self._sessions),
+                "spilled": spilled_now,
+                "max_active": self.max_sessions,
+                "ttl": self.ttl,
+                "created": self.created,
+                "evicted": self.evicted,
+                "expired": self.expired,
+                "spilled_total": self.spilled,
+                "restored": self.restored,
+            }
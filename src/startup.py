@@ -0,0 +1,119 @@
+"""
+Startup of the app in the background: the models are loaded in parallel threads, the components are built from the
+loaded models and a warm-up runs a dummy inference through every model, so the first query doesn't pay the lazy
+initialization of the kernels, indexes and language profiles. The time of every step is recorded and logged, and the
+app reports itself ready (`/ready`) only when all of them are done.
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+STARTING, READY, FAILED = "starting", "ready", "failed"
+
+
+class Startup:
+    def __init__(self):
+        self.status = STARTING
+        self.started_at = time.time()
+        self.finished_at = None
+        self.timings = {}  # {step: seconds}, in the order they finished
+        self.errors = {}  # {step: error message}
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.status == READY
+
+    def step(self, name: str, fn, required: bool = True):
+        """
+        Runs and times `fn()`. If it fails the error is recorded, and raised again if the step is `required`.
+        """
+        start = time.perf_counter()
+        try:
+            return fn()
+        except Exception as e:
+            with self._lock:
+                self.errors[name] = str(e)
+            print(f"[WARN] Startup step {name} failed: {e}")
+            if required:
+                raise
+        finally:
+            with self._lock:
+                self.timings[name] = round(time.perf_counter() - start, 3)
+
+    def parallel(self, steps: dict, required: bool = True) -> dict:
+        """
+        Runs the steps {name: fn} in parallel threads and returns their results {name: result}.
+        """
+        with ThreadPoolExecutor(max_workers=len(steps), thread_name_prefix="startup") as executor:
+            futures = {name: executor.submit(self.step, name, fn, required) for name, fn in steps.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+    def run(self, initialize, background: bool = True):
+        """
+        Runs `initialize(self)` (in a background thread if `background`) and marks the startup as ready or failed.
+        """
+        def target():
+            try:
+                initialize(self)
+                self.status = READY
+            except Exception as e:
+                self.status = FAILED
+                self.errors.setdefault("startup", str(e))
+            finally:
+                self.finished_at = time.time()
+                self._ready.set()
+                self.log()
+
+        if not background:
+            target()
+            return None
+        thread = threading.Thread(target=target, name="startup", daemon=True)
+        thread.start()
+        return thread
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Waits for the startup to end. Returns whether the app is ready.
+        """
+        self._ready.wait(timeout)
+        return self.ready
+
+    def to_dict(self) -> dict:
+        end = self.finished_at or time.time()
+        with self._lock:
+            return {
+                "status": self.status,
+                "elapsed_seconds": round(end - self.started_at, 3),
+                "timings": dict(self.timings),
+                "errors": dict(self.errors),
+            }
+
+    def log(self):
+        state = self.to_dict()
+        print(f"Startup {state['status']} in {state['elapsed_seconds']:.2f}s:")
+        for name, seconds in state["timings"].items():
+            print(f"  {name:<32} {seconds:8.3f}s" + (" (failed)" if name in state["errors"] else ""))
+
+
+def warm_up(startup: Startup, chatbot, vector_db):
+    """
+    Runs a dummy inference through every model and index used by a query (optional steps: a failure is only logged).
+    """
+    query = "What are the warning signs during pregnancy?"
+    embedding = startup.step("warm_up.embedding", lambda: vector_db.embeddings.embed_query(query), required=False)
+    # The model is called directly, so the warm-up doesn't count in the reranker stats.
+    startup.step(
+        "warm_up.cross_encoder",
+        lambda: chatbot.reranker.model.predict([(query, query)], show_progress_bar=False),
+        required=False
+    )
+    if embedding is not None and vector_db.count():
+        startup.step(
+            "warm_up.hybrid_search",
+            lambda: vector_db.hybrid_search([query], embeddings=[embedding], k=1),
+            required=False
+        )
+    startup.step("warm_up.language_detection", lambda: chatbot.translator.detect_language(query), required=False)
+    startup.step("warm_up.tokenizer", lambda: vector_db.token_counter.count([query]), required=False)
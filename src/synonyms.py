@@ -0,0 +1,159 @@
+"""
+Precomputed WordNet synonyms of the words of the indexed corpus, used by `ChatBot.expand_query`.
+
+Expanding a query used to call `wordnet.synsets` several times per token (and the first call pays the lazy load of the
+NLTK corpus). Instead, the synonyms of every word of the corpus are computed once, when the chunks are ingested, and
+stored in a small SQLite table next to the vector store: a query only does memoized lookups. Words missing from the
+table (not in the corpus) fall back to WordNet, memoized as well.
+"""
+import sqlite3
+import threading
+from functools import lru_cache
+
+# Separator of the lemmas stored in a column (lemmas are alphabetic, see `wordnet_lemmas`).
+_SEPARATOR = "\t"
+_SQL_BATCH = 500
+
+# Whether missing NLTK corpora are downloaded. Disabled in offline mode, where they come from the artifact bundle.
+ALLOW_DOWNLOADS = True
+
+
+def _download(resource: str):
+    if not ALLOW_DOWNLOADS:
+        raise LookupError(f"NLTK resource '{resource}' not found and downloads are disabled (offline mode).")
+    import nltk
+    nltk.download(resource)
+
+
+@lru_cache(maxsize=1)
+def load_wordnet():
+    """
+    WordNet corpus reader, loaded (and downloaded if it's missing) on the first call.
+    """
+    from nltk.corpus import wordnet
+    try:
+        wordnet.synsets("test")  # Loads the corpus
+    except LookupError:
+        _download("wordnet")
+    return wordnet
+
+
+@lru_cache(maxsize=1)
+def english_stopwords() -> frozenset:
+    from nltk.corpus import stopwords
+    try:
+        return frozenset(stopwords.words("english"))
+    except LookupError:
+        _download("stopwords")
+        return frozenset(stopwords.words("english"))
+
+
+def expandable_words(text: str, stop: frozenset = None) -> list[str]:
+    """
+    Words of a text that can be expanded with synonyms: lowercase alphabetic tokens of 3+ characters that aren't
+    stopwords (the same tokens that `ChatBot.expand_query` expands).
+    """
+    stop = english_stopwords() if stop is None else stop
+    words = []
+    for token in text.split():
+        word = token.strip(".,¡¿?;:()[]").lower()
+        if len(word) >= 3 and word.isalpha() and word not in stop:
+            words.append(word)
+    return words
+
+
+@lru_cache(maxsize=65536)
+def wordnet_lemmas(word: str) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    """
+    Synonyms of a word from the first 3 noun and verb synsets of WordNet, filtered like the query expansion always
+    did: the word itself, its plural (for nouns), multi-word lemmas and stopwords are skipped.
+
+    Returns
+    -------
+    tuple[tuple[str, ...], tuple[str, ...]]
+        Noun and verb lemmas.
+    """
+    wordnet = load_wordnet()
+    stop = english_stopwords()
+    result = []
+    for pos in (wordnet.NOUN, wordnet.VERB):
+        lemmas = []
+        for syn in wordnet.synsets(word, pos=pos, lang="eng")[:3]:
+            for lemma in syn.lemma_names("eng"):
+                lemma = lemma.replace("_", " ")
+                if lemma.lower() == word:
+                    continue
+                if pos == wordnet.NOUN and lemma.endswith("s") and lemma[:-1] == word:
+                    continue
+                if not lemma.isalpha() or lemma in stop:
+                    continue
+                if lemma not in lemmas:
+                    lemmas.append(lemma)
+        result.append(tuple(lemmas))
+    return tuple(result)
+
+
+class SynonymTable:
+    def __init__(self, path: str = None, cache_size: int = 65536):
+        """
+        Synonyms of the vocabulary of the corpus: {word: (noun lemmas, verb lemmas)}, persisted in a SQLite file (or
+        in memory if `path` is None) and filled incrementally by `add_texts` as chunks are ingested. Words are never
+        removed when documents are deleted: a few extra rows don't change the expansions.
+
+        Parameters
+        ----------
+        path : str, optional
+            Path of the SQLite file.
+        cache_size : int
+            Number of lookups memoized in memory.
+        """
+        self.path = path
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS synonyms (word TEXT PRIMARY KEY, nouns TEXT, verbs TEXT)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM synonyms").fetchone()[0]
+
+    def add_texts(self, texts: list[str]) -> int:
+        """
+        Adds the words of `texts` that aren't in the table yet, with their synonyms. Returns the number of new words.
+        """
+        words = list({word for text in texts for word in expandable_words(text)})
+        with self._lock:
+            known = set()
+            for start in range(0, len(words), _SQL_BATCH):
+                batch = words[start:start + _SQL_BATCH]
+                known.update(row[0] for row in self._conn.execute(
+                    f"SELECT word FROM synonyms WHERE word IN ({','.join('?' * len(batch))})", batch
+                ))
+        new_words = [word for word in words if word not in known]
+        if not new_words:
+            return 0
+        rows = []
+        for word in new_words:
+            nouns, verbs = wordnet_lemmas(word)
+            rows.append((word, _SEPARATOR.join(nouns), _SEPARATOR.join(verbs)))
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO synonyms VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+        return len(new_words)
+
+    def _lookup(self, word: str) -> tuple[tuple[str, ...], tuple[str, ...]]:
+        """
+        Noun and verb synonyms of a word (memoized through `lookup`).
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT nouns, verbs FROM synonyms WHERE word = ?", (word,)).fetchone()
+        if row is None:
+            return wordnet_lemmas(word)
+        return tuple(tuple(column.split(_SEPARATOR)) if column else () for column in row)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM synonyms")
+            self._conn.commit()
+        self.lookup.cache_clear()
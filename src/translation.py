@@ -0,0 +1,200 @@
+"""
+Translation of the queries to English (the language of the retrieval models), with pluggable backends.
+
+`Translator.to_english` detects the language of a query (memoized, so the retrieval and the prompt share one
+detection) and skips the translation of English queries. Other queries are served from a persistent cache of
+translations, and the backend is only called on a miss, with a deadline: if it doesn't answer in time (or fails) the
+original text is used, and a late translation is still cached for the next time.
+
+Backends are selected with the `TRANSLATION_BACKEND` environment variable:
+
+- google: Google Translate through `deep_translator` (network).
+- marian: local MarianMT model (`TRANSLATION_MODEL`, default "Helsinki-NLP/opus-mt-mul-en"), for offline deployments.
+- none: no translation.
+"""
+import os
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from src.cache import TranslationCache
+from src.filters import detect_language
+from src.models import registry
+
+TRANSLATION_CACHE_FILE = "translation_cache.sqlite3"  # Kept in the folder of the vector store
+MARIAN_MODEL_NAME = "Helsinki-NLP/opus-mt-mul-en"
+
+
+class TranslationBackend:
+    """
+    Translates texts to English. `name` identifies the backend (and model) in the translation cache.
+    """
+    name = "none"
+
+    def translate(self, text: str, source: str = None) -> str:
+        """
+        Translation of `text` to English. `source` is its detected language code, if known.
+        """
+        return text
+
+    def close(self):
+        pass
+
+
+class GoogleTranslationBackend(TranslationBackend):
+    name = "google"
+
+    def __init__(self):
+        from deep_translator import GoogleTranslator
+        self._translator = GoogleTranslator(source="auto", target="en")
+
+    def translate(self, text: str, source: str = None) -> str:
+        return self._translator.translate(text)
+
+
+class MarianTranslationBackend(TranslationBackend):
+    def __init__(self, model_name: str = None):
+        """
+        Local MarianMT model (loaded through the model registry on the first translation).
+        """
+        self.model_name = model_name or os.getenv("TRANSLATION_MODEL", MARIAN_MODEL_NAME)
+        self.name = f"marian:{self.model_name}"
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                self._model = registry.acquire("translation", self.model_name, loader=self._load_model)
+        return self._model
+
+    @staticmethod
+    def _load_model(name):
+        from transformers import MarianMTModel, MarianTokenizer
+        tokenizer = MarianTokenizer.from_pretrained(name)
+        model = MarianMTModel.from_pretrained(name).to(registry.resolve_device())
+        model.eval()
+        return tokenizer, model
+
+    def translate(self, text: str, source: str = None) -> str:
+        import torch
+        tokenizer, model = self._load()
+        inputs = tokenizer([text], return_tensors="pt", truncation=True).to(model.device)
+        with torch.no_grad():
+            output = model.generate(**inputs)
+        return tokenizer.decode(output[0], skip_special_tokens=True)
+
+    def close(self):
+        with self._lock:
+            if self._model is not None:
+                registry.release("translation", self.model_name)
+                self._model = None
+
+
+BACKENDS = {
+    "google": GoogleTranslationBackend,
+    "marian": MarianTranslationBackend,
+    "none": TranslationBackend,
+}
+
+
+def make_translation_backend(name: str = None) -> TranslationBackend:
+    """
+    Backend called `name` (defaults to the `TRANSLATION_BACKEND` environment variable or "google"). If it can't be
+    created (e.g. `deep_translator` isn't installed), texts aren't translated.
+    """
+    name = (name or os.getenv("TRANSLATION_BACKEND", "google")).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown translation backend '{name}'. Available: {', '.join(BACKENDS)}")
+    try:
+        return BACKENDS[name]()
+    except Exception as e:
+        print(f"[WARN] Translation backend '{name}' not loaded, queries won't be translated: {e}")
+        return TranslationBackend()
+
+
+class Translator:
+    def __init__(self, backend: TranslationBackend = None, cache_path: str = None, deadline: float = None):
+        """
+        Parameters
+        ----------
+        backend : TranslationBackend, optional
+            Defaults to `make_translation_backend()`.
+        cache_path : str, optional
+            SQLite file of the translation cache. Defaults to the `TRANSLATION_CACHE_PATH` environment variable; if
+            it's not set either, translations are only cached in memory.
+        deadline : float, optional
+            Seconds to wait for the backend before falling back to the original text. Defaults to
+            `TRANSLATION_DEADLINE` or 2.
+        """
+        self.backend = backend or make_translation_backend()
+        cache_path = cache_path or os.getenv("TRANSLATION_CACHE_PATH") or ":memory:"
+        if cache_path != ":memory:":
+            os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self.cache = TranslationCache(cache_path)
+        self.deadline = float(os.getenv("TRANSLATION_DEADLINE", "2") if deadline is None else deadline)
+        # Calls that miss the deadline keep running in the background (their result is cached).
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="translation")
+        self.detect_language = lru_cache(maxsize=1024)(detect_language)
+
+        self._lock = threading.Lock()
+        self.fast_path = 0
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def to_english(self, text: str) -> str:
+        """
+        English translation of `text`, or `text` itself if it is English, the backend fails or misses the deadline.
+        """
+        source = self.detect_language(text)
+        if source == "en" or self.backend.name == "none":
+            self._count("fast_path")
+            return text
+
+        cached = self.cache.get(self.backend.name, "en", text)
+        if cached is not None:
+            self._count("hits")
+            return cached
+        self._count("misses")
+
+        future = self._executor.submit(self.backend.translate, text, source)
+        future.add_done_callback(lambda f: self._store(text, f))
+        try:
+            return future.result(timeout=self.deadline) or text
+        except TimeoutError:
+            self._count("timeouts")
+            print(f"[WARN] Translation took more than {self.deadline}s, using the original query.")
+        except Exception as e:
+            print(f"[WARN] Translation failed, using the original query: {e}")
+        return text
+
+    def _store(self, text: str, future):
+        if future.exception() is not None:
+            self._count("errors")
+            return
+        translation = future.result()
+        if translation:
+            self.cache.put(self.backend.name, "en", text, translation)
+
+    def stats(self) -> dict:
+        with self._lock:
+            translated = self.hits + self.misses
+            return {
+                "backend": self.backend.name,
+                "deadline": self.deadline,
+                "english_fast_path": self.fast_path,
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "hit_rate": round(self.hits / translated, 4) if translated else 0.0,
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.backend.close()
@@ -0,0 +1,265 @@
+"""
+Handling of uploaded files: size limits, extraction of zip/tar archives of PDFs and resumable chunked uploads.
+
+Nothing is held in memory: multipart files and upload chunks are copied to disk in blocks of `COPY_BUFFER_SIZE`, and
+archive members are extracted one at a time. A chunked upload is a session persisted in `UPLOADS_DIR` (the received
+bytes and a small JSON state), so a dropped transfer (or a restart of the server) resumes at the last received byte
+instead of starting again:
+
+    POST /uploads {"filename": "docs.zip", "size": 2147483648}    ->  {"upload_id": ..., "received": 0}
+    PUT  /uploads/<id>  (Content-Range: bytes 0-8388607/2147483648, raw bytes)  ->  {"received": 8388608}
+    GET  /uploads/<id>                                              ->  {"received": ...}  (where to resume)
+    POST /uploads/<id>/complete                                     ->  ingestion jobs of the PDFs
+"""
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import tarfile
+import zipfile
+import threading
+
+UPLOADS_DIR = os.path.join("temp", "uploads")
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Size limits (bytes) of a request or chunked upload, and of the PDFs extracted from one archive.
+MAX_UPLOAD_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(2 * 1024 ** 3)))
+MAX_EXTRACTED_BYTES = int(os.getenv("UPLOAD_MAX_EXTRACTED_BYTES", str(4 * 1024 ** 3)))
+MAX_ARCHIVE_FILES = int(os.getenv("UPLOAD_MAX_ARCHIVE_FILES", "2000"))
+# Chunked upload sessions not updated for this long are removed.
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+
+DOCUMENT_SUFFIXES = (".pdf",)
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class UploadError(Exception):
+    """
+    Invalid upload. `status` is the HTTP status code to answer with.
+    """
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def is_document(filename: str) -> bool:
+    return filename.lower().endswith(DOCUMENT_SUFFIXES)
+
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def safe_filename(filename: str) -> str:
+    """
+    Base name of an uploaded file, without any directory (so it can't be written outside the upload folder).
+    """
+    name = os.path.basename(filename.replace("\\", "/")).strip()
+    if not name or name in (".", ".."):
+        raise UploadError(f"Invalid file name: {filename!r}")
+    return name
+
+
+def copy_stream(source, destination, limit: int = MAX_UPLOAD_BYTES) -> int:
+    """
+    Copies a file-like object into another one in blocks, stopping with an error beyond `limit` bytes.
+    Returns the number of bytes copied.
+    """
+    copied = 0
+    while True:
+        block = source.read(COPY_BUFFER_SIZE)
+        if not block:
+            return copied
+        copied += len(block)
+        if copied > limit:
+            raise UploadError(f"The upload exceeds the limit of {limit} bytes", status=413)
+        destination.write(block)
+
+
+def extract_documents(archive_path: str, output_dir: str) -> tuple[list[str], list[str]]:
+    """
+    Extracts the PDFs of a zip or tar archive into `output_dir` (flattened: only their base names are kept), member
+    by member. Other files, links and PDFs whose name was already extracted are skipped. The number of files and
+    their total uncompressed size are limited, so a malicious archive can't fill the disk.
+
+    Returns
+    -------
+    tuple[list[str], list[str]]
+        Paths of the extracted PDFs and names of the skipped members.
+    """
+    extracted, skipped, names = [], [], set()
+    total = 0
+
+    def members():
+        if zipfile.is_zipfile(archive_path):
+            with zipfile.ZipFile(archive_path) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    with archive.open(info) as member:
+                        yield info.filename, info.file_size, member
+        else:
+            try:
+                archive = tarfile.open(archive_path, mode="r:*")
+            except tarfile.TarError:
+                raise UploadError(f"{os.path.basename(archive_path)} is not a valid zip or tar archive")
+            with archive:
+                # Members are read in order, so compressed tars are decompressed as a stream.
+                for info in archive:
+                    if info.isdir():
+                        continue
+                    if not info.isfile():
+                        skipped.append(info.name)
+                        continue
+                    yield info.name, info.size, archive.extractfile(info)
+
+    for name, size, member in members():
+        filename = os.path.basename(name)
+        if not is_document(filename) or filename in names:
+            skipped.append(name)
+            continue
+        if len(extracted) >= MAX_ARCHIVE_FILES:
+            raise UploadError(f"The archive has more than {MAX_ARCHIVE_FILES} documents", status=413)
+        if total + size > MAX_EXTRACTED_BYTES:
+            raise UploadError(f"The documents of the archive exceed {MAX_EXTRACTED_BYTES} bytes", status=413)
+        path = os.path.join(output_dir, safe_filename(filename))
+        with open(path, "wb") as output:
+            # The declared size of a member can't be trusted: the copy is limited too.
+            total += copy_stream(member, output, limit=MAX_EXTRACTED_BYTES - total)
+        names.add(filename)
+        extracted.append(path)
+    return extracted, skipped
+
+
+class UploadSessions:
+    def __init__(
+        self, directory: str = UPLOADS_DIR, max_bytes: int = MAX_UPLOAD_BYTES, ttl: float = UPLOAD_SESSION_TTL
+    ):
+        """
+        Resumable chunked uploads, persisted in `directory` as "<id>.part" (received bytes) and "<id>.json" (state).
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(self.directory, exist_ok=True)
+        # The store lock only guards the lock of every upload {upload id: Lock}. Chunks are written under the lock of
+        # their upload, so a slow client doesn't block the other uploads.
+        self._lock = threading.Lock()
+        self._upload_locks = {}
+
+    def _upload_lock(self, upload_id: str) -> threading.Lock:
+        _, state_path = self._paths(upload_id)
+        with self._lock:
+            if upload_id not in self._upload_locks and not os.path.exists(state_path):
+                raise UploadError(f"Upload {upload_id} not found", status=404)
+            return self._upload_locks.setdefault(upload_id, threading.Lock())
+
+    def _paths(self, upload_id: str):
+        if not re.fullmatch(r"[0-9a-f]{32}", upload_id or ""):
+            raise UploadError(f"Upload {upload_id} not found", status=404)
+        base = os.path.join(self.directory, upload_id)
+        return base + ".part", base + ".json"
+
+    def create(self, filename: str, size: int, tags: str = None) -> dict:
+        """
+        Starts an upload of `size` bytes. `tags` are kept with it until it is completed.
+        """
+        filename = safe_filename(filename)
+        if not (is_document(filename) or is_archive(filename)):
+            raise UploadError("Only PDF files and zip/tar archives of PDFs are supported")
+        if size < 0 or size > self.max_bytes:
+            raise UploadError(f"The upload exceeds the limit of {self.max_bytes} bytes", status=413)
+        self.cleanup()
+        upload_id = uuid.uuid4().hex
+        part_path, state_path = self._paths(upload_id)
+        open(part_path, "wb").close()
+        state = {"upload_id": upload_id, "filename": filename, "size": size, "tags": tags, "updated_at": time.time()}
+        with open(state_path, "w") as f:
+            json.dump(state, f)
+        return self.status(upload_id)
+
+    def status(self, upload_id: str) -> dict:
+        part_path, state_path = self._paths(upload_id)
+        if not os.path.exists(state_path):
+            raise UploadError(f"Upload {upload_id} not found", status=404)
+        with open(state_path) as f:
+            state = json.load(f)
+        state["received"] = os.path.getsize(part_path)
+        return state
+
+    def write(self, upload_id: str, stream, content_range: str = None) -> dict:
+        """
+        Appends a chunk (read from `stream` in blocks) to an upload. The "Content-Range" header, if given, must start
+        at the number of bytes already received; a chunk that was already received (e.g. sent again after a lost
+        response) is acknowledged without writing it again.
+        """
+        with self._upload_lock(upload_id):
+            state = self.status(upload_id)
+            start = state["received"]
+            if content_range:
+                match = _CONTENT_RANGE.fullmatch(content_range.strip())
+                if match is None:
+                    raise UploadError(f"Invalid Content-Range: {content_range}")
+                first, last = int(match.group(1)), int(match.group(2))
+                if last < start:
+                    return state
+                if first != start:
+                    raise UploadError(f"Expected a chunk starting at byte {start}, got {first}", status=416)
+            part_path, state_path = self._paths(upload_id)
+            with open(part_path, "ab") as part:
+                try:
+                    copy_stream(stream, part, limit=state["size"] - start)
+                except UploadError:
+                    # Keep only the bytes received before this chunk.
+                    part.truncate(start)
+                    raise
+            state["updated_at"] = time.time()
+            with open(state_path, "w") as f:
+                json.dump({key: value for key, value in state.items() if key != "received"}, f)
+            return self.status(upload_id)
+
+    def complete(self, upload_id: str, output_dir: str) -> dict:
+        """
+        Ends a fully received upload: moves its file into `output_dir` and returns its state, with the "path" of the
+        file.
+        """
+        with self._upload_lock(upload_id):
+            state = self.status(upload_id)
+            if state["received"] != state["size"]:
+                raise UploadError(f"Upload incomplete: {state['received']} of {state['size']} bytes received", 409)
+            part_path, state_path = self._paths(upload_id)
+            os.makedirs(output_dir, exist_ok=True)
+            state["path"] = os.path.join(output_dir, f"{upload_id}-{state['filename']}")
+            shutil.move(part_path, state["path"])
+            os.remove(state_path)
+        with self._lock:
+            self._upload_locks.pop(upload_id, None)
+        return state
+
+    def cleanup(self):
+        """
+        Removes the sessions not updated for `ttl` seconds (unless a chunk is being written to them).
+        """
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            state_path = os.path.join(self.directory, name)
+            if not os.path.exists(state_path) or now - os.path.getmtime(state_path) <= self.ttl:
+                continue
+            upload_id = name[:-len(".json")]
+            lock = self._upload_lock(upload_id)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                for path in (state_path, state_path[:-len(".json")] + ".part"):
+                    if os.path.exists(path):
+                        os.remove(path)
+            finally:
+                lock.release()
+                with self._lock:
+                    self._upload_locks.pop(upload_id, None)
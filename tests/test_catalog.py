@@ -0,0 +1,55 @@
+import sys
+import pytest
+sys.path.append(".")
+from src.catalog import DocumentCatalog
+
+SETTINGS = {"chunk_size": 1000}
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = DocumentCatalog(str(tmp_path / "catalog.sqlite3"))
+    catalog.set("/docs/a.pdf", "sha-a", SETTINGS, ["a1", "a2"], pages=3, tags=["neonatal"])
+    catalog.set("/docs/b.pdf", "sha-b", SETTINGS, ["b1", "b2", "b3"], pages=2, tags=["labour"])
+    return catalog
+
+
+def test_reconcile_keeps_the_documents_that_match(catalog):
+    store = {"a1": "/docs/a.pdf", "a2": "/docs/a.pdf", "b1": "/docs/b.pdf", "b2": "/docs/b.pdf"}
+    assert catalog.reconcile(store, {}) == (0, 1)
+    a = catalog.get("/docs/a.pdf")
+    assert a["sha256"] == "sha-a"
+    assert a["tags"] == ["neonatal"]
+    assert catalog.current_sha256("/docs/a.pdf", SETTINGS) == "sha-a"
+
+
+def test_reconcile_drops_orphaned_chunks_and_keeps_tags(catalog):
+    store = {"a1": "/docs/a.pdf", "a2": "/docs/a.pdf", "b1": "/docs/b.pdf"}
+    catalog.reconcile(store, {})
+    b = catalog.get("/docs/b.pdf")
+    assert b["ids"] == ["b1"]
+    assert b["chunk_count"] == 1
+    assert b["tags"] == ["labour"]
+    # Its next upload replaces it.
+    assert catalog.current_sha256("/docs/b.pdf", SETTINGS) is None
+
+
+def test_reconcile_adds_missing_chunks_and_sources(catalog):
+    store = {
+        "a1": "/docs/a.pdf", "a2": "/docs/a.pdf", "a3": "/docs/a.pdf",
+        "b1": "/docs/b.pdf", "b2": "/docs/b.pdf", "b3": "/docs/b.pdf",
+        "n1": "/docs/new.pdf",
+    }
+    assert catalog.reconcile(store, {"/docs/new.pdf": {"pages": 1, "tags": ["guide"]}}) == (2, 0)
+    assert sorted(catalog.get("/docs/a.pdf")["ids"]) == ["a1", "a2", "a3"]
+    assert catalog.get("/docs/a.pdf")["tags"] == ["neonatal"]
+    assert catalog.get("/docs/b.pdf")["sha256"] == "sha-b"
+    new = catalog.get("/docs/new.pdf")
+    assert (new["ids"], new["pages"], new["tags"], new["sha256"]) == (["n1"], 1, ["guide"], None)
+    assert catalog.count_chunks() == len(store)
+
+
+def test_reconcile_removes_sources_without_chunks(catalog):
+    catalog.reconcile({"a1": "/docs/a.pdf", "a2": "/docs/a.pdf"}, {})
+    assert "/docs/b.pdf" not in catalog
+    assert catalog.count_documents() == 1
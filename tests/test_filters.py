@@ -0,0 +1,58 @@
+import sys
+import pytest
+sys.path.append(".")
+from src.catalog import DocumentCatalog
+from src.filters import build_where, tag_metadata
+
+
+def test_empty_filters_filter_nothing():
+    assert build_where(None) is None
+    assert build_where({}) is None
+    assert build_where({"source": [], "tags": []}) is None
+
+
+def test_single_condition():
+    assert build_where({"source": "a.pdf"}) == {"source": {"$in": ["a.pdf"]}}
+    assert build_where({"page": 3}) == {"page": 3}
+    assert build_where({"tags": ["who"]}) == {"tag:who": True}
+
+
+def test_conditions_are_combined_with_and():
+    where = build_where({"source": ["a.pdf", "b.pdf"], "page": [2, None], "language": "en", "tags": ["who", "nice"]})
+    assert where == {"$and": [
+        {"source": {"$in": ["a.pdf", "b.pdf"]}},
+        {"page": {"$gte": 2}},
+        {"language": {"$in": ["en"]}},
+        {"$or": [{"tag:who": True}, {"tag:nice": True}]},
+    ]}
+
+
+def test_page_range():
+    assert build_where({"page": [1, 4]}) == {"$and": [{"page": {"$gte": 1}}, {"page": {"$lte": 4}}]}
+    assert build_where({"page": [None, 4]}) == {"page": {"$lte": 4}}
+
+
+def test_tag_metadata_matches_the_tag_condition():
+    assert tag_metadata(["who", "neonatal"]) == {"tag:who": True, "tag:neonatal": True}
+
+
+def test_file_names_are_resolved_with_the_catalog(tmp_path):
+    catalog = DocumentCatalog(str(tmp_path / "catalog.sqlite3"))
+    catalog.set("/docs/a.pdf", "sha-a", {}, ["a1"], pages=1)
+    catalog.set("/other/a.pdf", "sha-a2", {}, ["a2"], pages=1)
+    where = build_where({"source": ["a.pdf", "/docs/a.pdf"]}, catalog)
+    assert sorted(where["source"]["$in"]) == ["/docs/a.pdf", "/docs/a.pdf", "/other/a.pdf"]
+    # A filter on unknown documents matches nothing.
+    assert build_where({"source": "missing.pdf"}, catalog) == {"source": {"$in": [""]}}
+
+
+@pytest.mark.parametrize("filters", [
+    {"author": "WHO"},
+    ["source", "a.pdf"],
+    "a.pdf",
+    {"page": "first"},
+    {"page": [1, 2, 3]},
+])
+def test_invalid_filters_raise(filters):
+    with pytest.raises(ValueError):
+        build_where(filters)
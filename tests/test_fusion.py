@@ -0,0 +1,50 @@
+import sys
+sys.path.append(".")
+from src.db import VectorDB
+
+
+class FakeBackend:
+    def get(self, ids=None, include=None, where=None):
+        return {
+            "ids": list(ids),
+            "documents": [f"content of {chunk_id}" for chunk_id in ids],
+            "metadatas": [{"source": "guide.pdf", "chunk_idx": 0} for _ in ids],
+        }
+
+
+def make_db():
+    db = VectorDB.__new__(VectorDB)
+    db.backend = FakeBackend()
+    return db
+
+
+def dense(*ids):
+    return [
+        {"id": chunk_id, "score": 1.0 - rank / 10, "content": chunk_id, "source": "guide.pdf", "metadata": {}}
+        for rank, chunk_id in enumerate(ids)
+    ]
+
+
+def test_chunk_top_in_both_rankings_beats_sparse_only_chunk():
+    # "both" is the best dense hit and the best sparse hit of the original query. "sparse_only" is found by the BM25
+    # search of every expansion, but never by the dense search.
+    dense_results = dense("both", "dense_2", "dense_3")
+    sparse_results = [
+        [("both", 9.0), ("sparse_only", 8.0)],
+        [("sparse_only", 7.0)],
+        [("sparse_only", 7.0)],
+        [("sparse_only", 7.0)],
+        [("sparse_only", 7.0)],
+    ]
+    fused = make_db().fuse_results(dense_results, sparse_results)
+    ids = [source["id"] for source in fused]
+    assert ids[0] == "both"
+    assert ids.index("both") < ids.index("sparse_only")
+
+
+def test_number_of_queries_does_not_change_the_weight_of_the_retrievers():
+    one_query = make_db().fuse_results(dense("a", "b"), [[("b", 5.0), ("a", 1.0)]])
+    many_queries = make_db().fuse_results(dense("a", "b"), [[("b", 5.0), ("a", 1.0)]] * 5)
+    scores = {source["id"]: source["score"] for source in one_query}
+    assert scores == {source["id"]: source["score"] for source in many_queries}
+    assert scores["a"] == scores["b"]
@@ -0,0 +1,99 @@
+import sys
+import numpy as np
+import pytest
+sys.path.append(".")
+from src.backends import NumpyBackend
+
+
+def _chunks(n, dim=8, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    ids = [f"c{i}" for i in range(n)]
+    documents = [f"chunk {i}" for i in range(n)]
+    metadatas = [{"source": f"doc{i % 3}.pdf", "page": i % 5} for i in range(n)]
+    return ids, vectors, documents, metadatas
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = NumpyBackend(str(tmp_path), block_size=16)
+    ids, vectors, documents, metadatas = _chunks(50)
+    backend.add(ids, vectors.tolist(), documents, metadatas)
+    backend.vectors = vectors
+    return backend
+
+
+def _exact(vectors, query, k, rows=None):
+    rows = np.arange(len(vectors)) if rows is None else np.asarray(rows)
+    distances = ((vectors[rows] - query) ** 2).sum(axis=1)
+    return [f"c{rows[i]}" for i in np.argsort(distances)[:k]]
+
+
+def test_search_returns_the_exact_nearest_neighbours(backend):
+    queries = np.random.default_rng(1).normal(size=(3, 8)).astype(np.float32)
+    results = backend.search(queries.tolist(), k=5)
+    for query, ids, distances in zip(queries, results["ids"], results["distances"]):
+        assert ids == _exact(backend.vectors, query, 5)
+        assert distances == sorted(distances)
+    assert results["documents"][0][0] == "chunk " + results["ids"][0][0][1:]
+
+
+def test_search_skips_the_deleted_chunks(backend):
+    query = backend.vectors[7]
+    assert backend.search([query.tolist()], k=1)["ids"] == [["c7"]]
+    backend.delete(["c7"])
+    assert "c7" not in backend.search([query.tolist()], k=5)["ids"][0]
+    assert backend.count() == 49
+
+
+def test_upsert_replaces_the_vector(backend):
+    far = np.full(8, 100.0, dtype=np.float32)
+    backend.upsert(["c3"], [far.tolist()], ["moved"], [{"source": "doc0.pdf", "page": 0}])
+    results = backend.search([far.tolist()], k=1)
+    assert results["ids"] == [["c3"]]
+    assert results["documents"] == [["moved"]]
+    assert backend.count() == 50
+
+
+def test_add_keeps_the_existing_chunks(backend):
+    backend.add(["c0"], [np.zeros(8).tolist()], ["new"], [{"source": "doc0.pdf", "page": 0}])
+    assert backend.get(ids=["c0"])["documents"] == ["chunk 0"]
+
+
+def test_search_with_where_only_scores_the_matching_chunks(backend):
+    query = backend.vectors[0]
+    results = backend.search([query.tolist()], k=4, where={"source": "doc1.pdf"})
+    assert all(metadata["source"] == "doc1.pdf" for metadata in results["metadatas"][0])
+    assert results["ids"][0] == _exact(backend.vectors, query, 4, rows=range(1, 50, 3))
+
+
+def test_search_with_where_operators(backend):
+    where = {"$and": [{"source": {"$in": ["doc0.pdf", "doc2.pdf"]}}, {"page": {"$gte": 1}}, {"page": {"$lte": 2}}]}
+    results = backend.search([backend.vectors[0].tolist()], k=50, where=where)
+    metadatas = results["metadatas"][0]
+    assert metadatas
+    assert all(m["source"] != "doc1.pdf" and 1 <= m["page"] <= 2 for m in metadatas)
+    expected = [i for i in range(50) if i % 3 != 1 and 1 <= i % 5 <= 2]
+    assert sorted(results["ids"][0]) == sorted(f"c{i}" for i in expected)
+
+
+def test_search_without_matches_returns_empty_lists(backend):
+    results = backend.search([backend.vectors[0].tolist()] * 2, k=3, where={"source": "missing.pdf"})
+    assert results["ids"] == [[], []]
+    assert results["distances"] == [[], []]
+
+
+def test_unsupported_operator_raises(backend):
+    with pytest.raises(ValueError):
+        backend.search([backend.vectors[0].tolist()], k=3, where={"page": {"$regex": "1"}})
+
+
+def test_get_with_where(backend):
+    assert backend.get(where={"page": 4}, limit=2)["ids"] == ["c4", "c9"]
+    assert backend.get(ids=["c1", "c2", "c4"], where={"source": "doc1.pdf"})["ids"] == ["c1", "c4"]
+
+
+def test_get_and_reopen(backend, tmp_path):
+    assert backend.get(ids=["c9", "c4"])["ids"] == ["c4", "c9"]
+    reopened = NumpyBackend(str(tmp_path))
+    assert reopened.count() == 50
+    assert reopened.search([backend.vectors[11].tolist()], k=1)["ids"] == [["c11"]]
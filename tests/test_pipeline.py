@@ -0,0 +1,76 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+sys.path.append(".")
+from src.pipeline import Pipeline, Stage, StageError
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        yield executor
+
+
+def test_stages_get_the_results_of_their_dependencies(executor):
+    pipeline = Pipeline(executor, [
+        Stage("a", lambda: 2),
+        Stage("b", lambda: 3),
+        Stage("sum", lambda a, b: a + b, deps=("a", "b")),
+    ])
+    assert pipeline.run() == {"a": 2, "b": 3, "sum": 5}
+    assert set(pipeline.timings) == {"a", "b", "sum"}
+    assert pipeline.failed == {}
+
+
+def test_independent_stages_overlap(executor):
+    pipeline = Pipeline(executor, [Stage(name, lambda: time.sleep(0.2)) for name in "abc"])
+    start = time.perf_counter()
+    pipeline.run()
+    assert time.perf_counter() - start < 0.5
+
+
+def test_timed_out_stage_takes_its_fallback(executor):
+    pipeline = Pipeline(executor, [
+        Stage("slow", lambda: time.sleep(1) or "late", timeout=0.1, fallback="fallback"),
+        Stage("next", lambda slow: slow + "!", deps=("slow",)),
+    ])
+    start = time.perf_counter()
+    assert pipeline.run()["next"] == "fallback!"
+    assert time.perf_counter() - start < 0.5
+    assert pipeline.failed == {"slow": "timeout"}
+
+
+def test_failed_stage_takes_its_fallback(executor):
+    pipeline = Pipeline(executor, [Stage("boom", lambda: 1 / 0, fallback=None)])
+    assert pipeline.run() == {"boom": None}
+    assert "division by zero" in pipeline.failed["boom"]
+
+
+def test_failed_stage_without_fallback_fails_the_pipeline(executor):
+    pipeline = Pipeline(executor, [Stage("required", lambda: time.sleep(1), timeout=0.1)])
+    with pytest.raises(StageError):
+        pipeline.run()
+
+
+def test_timeout_starts_when_the_stage_runs():
+    # With a single busy thread, "queued" waits longer than its timeout before it runs, and still succeeds.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(time.sleep, 0.3)
+        pipeline = Pipeline(executor, [Stage("queued", lambda: "ok", timeout=0.1)])
+        assert pipeline.run() == {"queued": "ok"}
+
+
+def test_stop_returns_early(executor):
+    pipeline = Pipeline(executor, [
+        Stage("cache", lambda: "hit"),
+        Stage("slow", lambda cache: time.sleep(1), deps=("cache",)),
+    ])
+    start = time.perf_counter()
+    assert pipeline.run(stop=lambda results: results.get("cache")) == {"cache": "hit"}
+    assert time.perf_counter() - start < 0.5
+
+
+def test_unknown_dependency_is_rejected(executor):
+    with pytest.raises(ValueError):
+        Pipeline(executor, [Stage("a", lambda b: b, deps=("b",))])
@@ -0,0 +1,114 @@
+import os
+import sys
+import numpy as np
+import pytest
+sys.path.append(".")
+from src.quantization import QuantizedIndex, parse_spec
+
+DIM = 32
+
+
+def _vectors(n, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, DIM)).astype(np.float32)
+
+
+def _exact(vectors, ids, query, k):
+    distances = ((vectors - query) ** 2).sum(axis=1)
+    return [ids[i] for i in np.argsort(distances)[:k]]
+
+
+@pytest.fixture
+def data():
+    vectors = _vectors(300)
+    return [f"c{i}" for i in range(len(vectors))], vectors
+
+
+@pytest.mark.parametrize("spec", ["int8", "binary", "int8:8:pca", "binary:16:matryoshka"])
+def test_rescoring_returns_the_exact_neighbours_of_the_candidates(tmp_path, data, spec):
+    ids, vectors = data
+    # Every row is a candidate, so the rescored results are the exact nearest neighbours.
+    index = QuantizedIndex(str(tmp_path), rescore_factor=len(ids), **parse_spec(spec))
+    index.add(ids, vectors.tolist())
+    for query in _vectors(5, seed=1):
+        results = index.search([query.tolist()], k=5)[0]
+        assert [chunk_id for chunk_id, _ in results] == _exact(vectors, ids, query, 5)
+        exact = {ids[i]: float(((vectors[i] - query) ** 2).sum()) for i in range(len(ids))}
+        for chunk_id, distance in results:
+            assert distance == pytest.approx(exact[chunk_id], rel=1e-4)
+
+
+def test_int8_first_pass_keeps_the_nearest_neighbours(tmp_path, data):
+    ids, vectors = data
+    # The first pass ranks by inner product, which matches L2 for normalized embeddings.
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = QuantizedIndex(str(tmp_path), method="int8", rescore_factor=4)
+    index.add(ids, vectors.tolist())
+    queries = _vectors(20, seed=2)
+    hits = sum(
+        len({chunk_id for chunk_id, _ in results} & set(_exact(vectors, ids, query, 5)))
+        for query, results in zip(queries, index.search(queries.tolist(), k=5))
+    )
+    assert hits / (5 * len(queries)) >= 0.9
+
+
+def test_removed_chunks_are_not_returned(tmp_path, data):
+    ids, vectors = data
+    index = QuantizedIndex(str(tmp_path), rescore_factor=len(ids))
+    index.add(ids, vectors.tolist())
+    index.remove(["c10", "missing"])
+    assert "c10" not in index
+    assert len(index) == len(ids) - 1
+    assert "c10" not in [chunk_id for chunk_id, _ in index.search([vectors[10].tolist()], k=5)[0]]
+    # Removing half of the rows compacts the index.
+    index.remove(ids[:200])
+    assert len(index.alive) == len(index) == 100
+    assert index.search([vectors[250].tolist()], k=1)[0][0][0] == "c250"
+
+
+def test_search_within_ids(tmp_path, data):
+    ids, vectors = data
+    index = QuantizedIndex(str(tmp_path), rescore_factor=len(ids))
+    index.add(ids, vectors.tolist())
+    allowed = ids[100:110]
+    results = index.search([vectors[0].tolist()], k=3, ids=allowed)[0]
+    assert [chunk_id for chunk_id, _ in results] == _exact(vectors[100:110], allowed, vectors[0], 3)
+    assert index.search([vectors[0].tolist()], k=3, ids=["missing"]) == [[]]
+
+
+def test_duplicate_ids_are_skipped(tmp_path, data):
+    ids, vectors = data
+    index = QuantizedIndex(str(tmp_path))
+    index.add(ids[:10], vectors[:10].tolist())
+    index.add(ids[:20], vectors[:20].tolist())
+    assert len(index) == 20
+    assert len(index.ids) == 20
+
+
+def test_unsaved_rows_are_dropped_on_load_until_flushed(tmp_path, data):
+    ids, vectors = data
+    index = QuantizedIndex(str(tmp_path), save_every=1000)
+    index.add(ids[:200], vectors[:200].tolist())  # The first add fits the codes and saves them
+    index.add(ids[200:250], vectors[200:250].tolist())
+    reopened = QuantizedIndex(str(tmp_path), save_every=1000)
+    assert len(reopened) == 200
+    assert os.path.getsize(os.path.join(str(tmp_path), "vectors.f32")) == 200 * DIM * 4
+    reopened.add(ids[200:250], vectors[200:250].tolist())
+    reopened.flush()
+    reopened = QuantizedIndex(str(tmp_path), save_every=1000, rescore_factor=len(ids))
+    assert len(reopened) == 250
+    assert reopened.search([vectors[220].tolist()], k=1)[0][0][0] == "c220"
+
+
+def test_changed_settings_rebuild_the_index(tmp_path, data):
+    ids, vectors = data
+    QuantizedIndex(str(tmp_path), method="int8").add(ids, vectors.tolist())
+    assert len(QuantizedIndex(str(tmp_path), method="binary")) == 0
+
+
+def test_invalid_settings():
+    with pytest.raises(ValueError):
+        QuantizedIndex("unused", method="int4")
+    with pytest.raises(ValueError):
+        QuantizedIndex("unused", reduction="random")
+    assert parse_spec("") is None
+    assert parse_spec("binary:256:pca") == {"method": "binary", "dims": 256, "reduction": "pca"}
@@ -0,0 +1,88 @@
+import sys
+import time
+import pytest
+sys.path.append(".")
+from src.sessions import SessionStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SessionStore(max_sessions=2, ttl=3600, spill_path=str(tmp_path / "sessions.sqlite3"))
+
+
+def test_same_session_returns_the_same_conversation(store):
+    conversation = store.get("a")
+    assert conversation.id == "a"
+    assert store.get("a") is conversation
+    assert store.get(create=False) is None
+    assert store.get("missing", create=False) is None
+    assert store.get().id != store.get().id
+
+
+def test_least_recently_used_is_spilled_and_restored(store):
+    a = store.get("a")
+    a.memory.update_memory("hello", "hi")
+    a.context = "Context"
+    a.context_filters = {"tags": ["who"]}
+    store.get("b")
+    store.get("a")  # "b" is now the least recently used
+    store.get("c")
+    stats = store.stats()
+    assert stats["active"] == 2
+    assert stats["spilled"] == 1
+    assert stats["evicted"] == 1
+
+    store.get("b")  # Restored, "a" is spilled in turn
+    store.get("a")
+    restored = store.get("a")
+    assert restored.memory.history == [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "hi"}]
+    assert restored.context == "Context"
+    assert restored.context_filters == {"tags": ["who"]}
+    assert store.stats()["restored"] == 2
+
+
+def test_without_spill_file_evicted_conversations_are_dropped():
+    store = SessionStore(max_sessions=1, ttl=3600)
+    store.get("a").context = "Context"
+    store.get("b")
+    assert store.get("a", create=False) is None
+    assert store.stats()["spilled"] == 0
+
+
+def test_conversation_in_use_is_not_evicted(store):
+    with store.session("a") as a:
+        store.get("b")
+        store.get("c")  # "a" is the least recently used, but it's in use: "b" is spilled instead
+        assert store.get("a") is a
+    assert store.stats()["spilled"] == 1
+    assert store.get("b").id == "b"
+    assert store.stats()["restored"] == 1
+
+
+def test_expired_conversations_are_dropped(store):
+    store.get("a").updated_at = time.time() - 7200
+    assert store.get("a", create=False) is None
+    fresh = store.get("a")
+    assert fresh.context is None
+    assert store.stats()["expired"] == 1
+
+
+def test_expired_spilled_conversations_are_not_restored(store):
+    store.get("a")
+    store.get("b")
+    store.get("c")  # "a" is spilled
+    store.ttl = 0
+    time.sleep(0.01)
+    assert store.get("a", create=False) is None
+    assert store.stats()["restored"] == 0
+
+
+def test_delete(store):
+    store.get("a")
+    store.get("b")
+    store.get("c")  # "a" is spilled
+    assert store.delete("a")
+    assert store.delete("c")
+    assert not store.delete("c")
+    assert store.get("a", create=False) is None
+    assert store.stats()["active"] == 1
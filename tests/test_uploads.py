@@ -0,0 +1,108 @@
+import io
+import os
+import sys
+import pytest
+sys.path.append(".")
+from src.uploads import UploadError, UploadSessions
+
+DATA = bytes(range(256)) * 4  # 1024 bytes
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    return UploadSessions(str(tmp_path / "uploads"), max_bytes=4096, ttl=3600)
+
+
+def _put(sessions, upload_id, first, last):
+    return sessions.write(upload_id, io.BytesIO(DATA[first:last + 1]), f"bytes {first}-{last}/{len(DATA)}")
+
+
+def test_chunks_are_appended_and_completed(sessions, tmp_path):
+    upload_id = sessions.create("guide.pdf", len(DATA))["upload_id"]
+    assert _put(sessions, upload_id, 0, 511)["received"] == 512
+    assert sessions.status(upload_id)["received"] == 512
+    assert _put(sessions, upload_id, 512, 1023)["received"] == 1024
+    state = sessions.complete(upload_id, str(tmp_path / "docs"))
+    with open(state["path"], "rb") as f:
+        assert f.read() == DATA
+    with pytest.raises(UploadError) as error:
+        sessions.status(upload_id)
+    assert error.value.status == 404
+
+
+def test_upload_resumes_after_a_restart(sessions, tmp_path):
+    upload_id = sessions.create("guide.pdf", len(DATA))["upload_id"]
+    _put(sessions, upload_id, 0, 299)
+    restarted = UploadSessions(sessions.directory, max_bytes=4096)
+    assert restarted.status(upload_id)["received"] == 300
+    assert _put(restarted, upload_id, 300, 1023)["received"] == 1024
+
+
+def test_chunk_already_received_is_acknowledged(sessions):
+    upload_id = sessions.create("guide.pdf", len(DATA))["upload_id"]
+    _put(sessions, upload_id, 0, 511)
+    # The response was lost and the client sends the chunk again.
+    assert _put(sessions, upload_id, 0, 511)["received"] == 512
+    assert os.path.getsize(os.path.join(sessions.directory, upload_id + ".part")) == 512
+
+
+def test_chunk_with_a_gap_is_rejected(sessions):
+    upload_id = sessions.create("guide.pdf", len(DATA))["upload_id"]
+    _put(sessions, upload_id, 0, 255)
+    with pytest.raises(UploadError) as error:
+        _put(sessions, upload_id, 512, 1023)
+    assert error.value.status == 416
+    assert sessions.status(upload_id)["received"] == 256
+
+
+def test_invalid_content_range(sessions):
+    upload_id = sessions.create("guide.pdf", len(DATA))["upload_id"]
+    with pytest.raises(UploadError) as error:
+        sessions.write(upload_id, io.BytesIO(DATA), "0-1023")
+    assert error.value.status == 400
+
+
+def test_oversized_chunk_is_truncated(sessions):
+    upload_id = sessions.create("guide.pdf", 600)["upload_id"]
+    _put(sessions, upload_id, 0, 255)
+    with pytest.raises(UploadError) as error:
+        _put(sessions, upload_id, 256, 1023)
+    assert error.value.status == 413
+    # Only the bytes received before the failed chunk are kept, so the upload can resume.
+    assert sessions.status(upload_id)["received"] == 256
+    assert _put(sessions, upload_id, 256, 599)["received"] == 600
+
+
+def test_incomplete_upload_cannot_be_completed(sessions, tmp_path):
+    upload_id = sessions.create("guide.pdf", len(DATA))["upload_id"]
+    _put(sessions, upload_id, 0, 99)
+    with pytest.raises(UploadError) as error:
+        sessions.complete(upload_id, str(tmp_path / "docs"))
+    assert error.value.status == 409
+
+
+@pytest.mark.parametrize("filename, size, status", [
+    ("notes.txt", 10, 400),
+    ("../", 10, 400),
+    ("guide.pdf", 10 ** 6, 413),
+])
+def test_invalid_uploads_are_rejected(sessions, filename, size, status):
+    with pytest.raises(UploadError) as error:
+        sessions.create(filename, size)
+    assert error.value.status == status
+
+
+def test_unknown_upload(sessions):
+    for upload_id in ("0" * 32, "../../etc/passwd"):
+        with pytest.raises(UploadError) as error:
+            sessions.write(upload_id, io.BytesIO(DATA))
+        assert error.value.status == 404
+
+
+def test_expired_sessions_are_removed(sessions):
+    upload_id = sessions.create("guide.pdf", len(DATA))["upload_id"]
+    sessions.ttl = -1
+    sessions.cleanup()
+    assert os.listdir(sessions.directory) == []
+    with pytest.raises(UploadError):
+        sessions.status(upload_id)
@@ -6,13 +6,17 @@ import altair as alt
 
 # ---- Constants ----
 FLASK_API_URL = "http://localhost:5002/infer"
-UPLOAD_URL = "http://localhost:5002/upload"
+UPLOADS_URL = "http://localhost:5002/uploads"  # Resumable chunked uploads
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_RETRIES = 5
 REFRESH_URL = "http://localhost:5002/refresh_documents"
 LIST_DOCS_URL = "http://localhost:5002/list_documents"
+JOBS_URL = "http://localhost:5002/jobs"
 DELETE_DOC_URL = "http://localhost:5002/delete_document"
 DELETE_CONTEXT_URL = "http://localhost:5002/reset_chatbot"
 MODEL_LIST = ["Llama 3.2 3B", "Gemma 3 1B", "Deepseek R1 Distill Qwen 1.5", "Qwen 2.5 0.5B"]
 LLM_SERVICE_URL = "http://localhost:5001"
+REFRESH_LLM_MODEL_URL = "http://localhost:5002/refresh_llm_model"
 
 # Get current model from LLM service and reorder MODEL_LIST
 try:
@@ -78,6 +82,8 @@ with st.sidebar:
             if response.status_code == 200:
                 st.success(f"Model switched to {model}")
                 st.session_state.current_model = model
+                # The API counts the tokens of the context with the tokenizer of the served model.
+                requests.post(REFRESH_LLM_MODEL_URL)
             else:
                 st.error(f"Error switching model: {response.json().get('error', 'Unknown error')}")
         except Exception as e:
@@ -133,6 +139,13 @@ Preview: <em>{source['content']}</em><br/>
             st.error(f"API Request Failed: {e}")
             return None
 
+    # Optional restriction of the retrieval to some of the documents
+    try:
+        available_docs = requests.get(LIST_DOCS_URL).json().get("documents", [])
+    except Exception:
+        available_docs = []
+    selected_docs = st.multiselect("Search only in these documents (optional)", options=available_docs)
+
     # Display existing chat history above the input
     for message in st.session_state.messages:
         display_message(message)
@@ -145,12 +158,18 @@ Preview: <em>{source['content']}</em><br/>
 
         # Call API
         api_payload = {"messages": st.session_state.messages}
+        # The backend keeps the context of this conversation under its session id.
+        if st.session_state.get("session_id"):
+            api_payload["session_id"] = st.session_state.session_id
+        if selected_docs:
+            api_payload["filters"] = {"source": selected_docs}
         api_response = call_api(FLASK_API_URL, payload=api_payload)
 
         # Append assistant response if any
         if api_response:
             assistant_message = api_response.get("response", "Error: No response received.")
             sources = api_response.get("sources", [])
+            st.session_state.session_id = api_response.get("session_id")
             st.session_state.messages.append({"role": "assistant", "content": assistant_message, "sources": sources})
 
         # Rerun to render updated messages above the input
@@ -160,25 +179,110 @@ Preview: <em>{source['content']}</em><br/>
     if st.button("Clear Chat"):
         st.session_state.messages = []
         st.success("Chat cleared!")
-        call_api(DELETE_CONTEXT_URL)
+        call_api(DELETE_CONTEXT_URL, payload={"session_id": st.session_state.get("session_id")})
         st.rerun()
 
 # ---- Documents Tab ----
 with tab2:
     st.header("📤 Upload Documents")
     st.markdown("<div class='upload-section'>", unsafe_allow_html=True)
-    uploaded_file = st.file_uploader("Choose a PDF file", type="pdf")
-    if uploaded_file is not None:
+    uploaded_files = st.file_uploader(
+        "Choose PDF files or zip/tar archives of PDFs",
+        type=["pdf", "zip", "tar", "gz", "tgz"],
+        accept_multiple_files=True
+    )
+    tags = st.text_input("Tags (optional, comma-separated)", placeholder="e.g. who, neonatal")
+
+    def upload_in_chunks(uploaded_file, progress_bar):
+        """
+        Sends a file with the resumable chunked uploads of the API, so it is never copied whole in memory and a
+        dropped connection resumes at the last byte received by the server. Returns the response of the completion.
+        """
+        size = uploaded_file.size
+        response = requests.post(UPLOADS_URL, json={"filename": uploaded_file.name, "size": size, "tags": tags})
+        if response.status_code != 201:
+            return response
+        upload_id = response.json()["upload_id"]
+        received, retries = 0, 0
+        while received < size:
+            uploaded_file.seek(received)
+            chunk = uploaded_file.read(UPLOAD_CHUNK_SIZE)
+            try:
+                response = requests.put(
+                    f"{UPLOADS_URL}/{upload_id}",
+                    data=chunk,
+                    headers={"Content-Range": f"bytes {received}-{received + len(chunk) - 1}/{size}"}
+                )
+                response.raise_for_status()
+                received = response.json()["received"]
+            except requests.RequestException:
+                retries += 1
+                if retries > UPLOAD_RETRIES:
+                    raise
+                time.sleep(retries)
+                # Resume where the server stopped receiving.
+                received = requests.get(f"{UPLOADS_URL}/{upload_id}").json()["received"]
+                continue
+            retries = 0
+            progress_bar.progress(received / max(size, 1), text=f"Uploading {uploaded_file.name}...")
+        return requests.post(f"{UPLOADS_URL}/{upload_id}/complete")
+
+    if uploaded_files:
         if st.button("Upload"):
-            with st.spinner("Uploading document..."):
-                files = {"file": (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")}
-                response = requests.post(UPLOAD_URL, files=files)
-                if response.status_code == 200:
-                    success_message = st.success("Document uploaded successfully!")
-                    time.sleep(2)
-                    success_message.empty()
+            jobs = []
+            progress_bar = st.progress(0.0, text="Uploading...")
+            for uploaded_file in uploaded_files:
+                try:
+                    response = upload_in_chunks(uploaded_file, progress_bar)
+                except requests.RequestException as e:
+                    st.error(f"Error uploading {uploaded_file.name}: {e}")
+                    continue
+                if response.status_code == 202:
+                    jobs.extend(response.json()["jobs"])
                 else:
-                    st.error(f"Error uploading document: {response.json().get('error', 'Unknown error')}")
+                    st.error(f"Error uploading {uploaded_file.name}: {response.json().get('error', 'Unknown error')}")
+                for error in response.json().get("errors", []):
+                    st.warning(f"{error['filename']} skipped: {error['error']}")
+
+            # The documents are ingested in the background: poll the status of every unfinished job until they end.
+            # Finished jobs may be dropped by the API, so a job that isn't found anymore is finished too.
+            job_ids = {job["job_id"] for job in jobs}
+            finished = {}
+            pending = set(job_ids)
+            while pending:
+                unfinished = []
+                for job_id in sorted(pending):
+                    response = requests.get(f"{JOBS_URL}/{job_id}")
+                    if response.status_code == 404:
+                        pending.discard(job_id)
+                        continue
+                    job = response.json()
+                    if job["status"] in ("done", "failed"):
+                        finished[job_id] = job
+                        pending.discard(job_id)
+                    else:
+                        unfinished.append(job)
+                if not unfinished:
+                    break
+                n_finished = len(job_ids) - len(unfinished)
+                text = f"Processing documents: {n_finished}/{len(job_ids)} done"
+                current = next((job for job in unfinished if job["status"] == "running"), None)
+                if current is not None:
+                    text += f", {current['filename']}: {current['pages_parsed']}/{current['total_pages'] or '?'} pages"
+                    if current.get("eta_seconds") is not None:
+                        text += f" (~{current['eta_seconds']:.0f}s left)"
+                progress_bar.progress(n_finished / len(job_ids), text=text)
+                time.sleep(1)
+            progress_bar.empty()
+            finished = list(finished.values())
+            for job in finished:
+                if job["status"] == "failed":
+                    st.error(f"Error processing {job['filename']}: {job.get('error') or 'Unknown error'}")
+            done = len(job_ids) - sum(job["status"] == "failed" for job in finished)
+            if done:
+                success_message = st.success(f"{done} document(s) uploaded successfully!")
+                time.sleep(2)
+                success_message.empty()
     st.markdown("</div>", unsafe_allow_html=True)
 
     st.header("📄 Documents in Database")